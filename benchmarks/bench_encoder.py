@@ -0,0 +1,64 @@
+"""
+Micro-benchmark of per-packet Enhanced Packet Block encoding
+
+    python benchmarks/bench_encoder.py [-n 100000]  # with mavsniff installed (pip install -e .)
+
+Compares python-pcapng `EnhancedPacket` with `udp_header` (the former `Capture._write_packet`)
+against the preallocated `PacketEncoder`.
+"""
+import argparse
+import io
+import time
+import timeit
+
+import pcapng
+
+from mavsniff.utils.ip import udp_header
+from mavsniff.utils.pcap import PacketEncoder
+
+FRAME = bytes.fromhex("fd1c000001010121000000000000000000000000000000000000000000000000000000000000a1b2")
+
+
+def pcapng_path(shb, file, seq, data):
+    now_us = time.time_ns() // 1000
+    payload = udp_header(seq, len(data)) + data
+    pcapng.blocks.EnhancedPacket(
+        section=shb,
+        interface_id=0,
+        packet_data=payload,
+        timestamp_high=(now_us & 0xFFFFFFFF00000000) >> 32,
+        timestamp_low=(now_us & 0xFFFFFFFF),
+        captured_len=len(payload),
+        packet_len=len(payload),
+        endianness="<",
+    )._write(file)
+
+
+def encoder_path(encoder, file, seq, data):
+    file.write(encoder.encode(seq, data, time.time_ns() // 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=100_000, help="packets per measurement")
+    args = parser.parse_args()
+
+    shb = pcapng.blocks.SectionHeader(endianness="<")
+    shb.register_interface(pcapng.blocks.InterfaceDescription(endianness="<", interface_id=0, section=shb))
+    encoder = PacketEncoder()
+
+    # sanity check - both paths must produce the same bytes
+    a, b = io.BytesIO(), io.BytesIO()
+    pcapng.blocks.EnhancedPacket(section=shb, interface_id=0, packet_data=udp_header(7, len(FRAME)) + FRAME,
+        timestamp_high=0, timestamp_low=42, captured_len=len(FRAME) + 32, packet_len=len(FRAME) + 32, endianness="<")._write(a)
+    b.write(encoder.encode(7, FRAME, 42))
+    assert a.getvalue() == b.getvalue(), "encoders differ"
+
+    for name, fn, state in (("pcapng.EnhancedPacket", pcapng_path, shb), ("PacketEncoder", encoder_path, encoder)):
+        file = io.BytesIO()
+        seconds = min(timeit.repeat(lambda: fn(state, file, 1, FRAME), number=args.n, repeat=3))
+        print(f"{name:>24}: {seconds / args.n * 1e6:.2f} us/packet")
+
+
+if __name__ == "__main__":
+    main()
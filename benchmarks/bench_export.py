@@ -0,0 +1,67 @@
+"""
+Columnar export (`mavsniff export`) against decoding every message into a pymavlink object
+
+    python benchmarks/bench_export.py [--seconds 60] [--rate 10000] [--jobs 1 4]
+
+A synthetic recording of the given length is written to a temporary file. The baseline decodes
+every frame with `MAVLink.decode` and appends the objects to per-type lists - the loop analysts
+used to write by hand.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_suite import _recording
+from generator import DEFAULT_MIX
+from pymavlink import mavutil
+from mavsniff.export import export
+from mavsniff.utils.decap import Decapsulator
+from mavsniff.utils.pcap import open_reader
+
+
+def decode_objects(path: str) -> int:
+    mav = mavutil.mavlink.MAVLink(None)
+    messages = {}
+    with open(path, "rb") as file, open_reader(file) as reader:
+        decapsulate = Decapsulator(reader).frames
+        for _, interface_id, _, data in reader.records():
+            for frame in decapsulate(interface_id, data):
+                try:
+                    message = mav.decode(bytearray(frame))
+                except Exception:
+                    continue
+                messages.setdefault(message.get_type(), []).append(message)
+    return sum(len(values) for values in messages.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=60, help="length of the recording")
+    parser.add_argument("--rate", type=float, default=10000, help="packets per second in the recording")
+    parser.add_argument("--jobs", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    packets = int(args.rate * args.seconds)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "recording.pcapng")
+        with open(path, "wb") as file:
+            file.write(_recording(args.rate, args.seconds, {"mix": DEFAULT_MIX}).getbuffer())
+        print(f"{packets} packets, {os.path.getsize(path) >> 20} MiB, {os.cpu_count()} CPUs")
+        start = time.perf_counter()
+        decode_objects(path)
+        baseline = time.perf_counter() - start
+        print(f"{'objects':>12}: {baseline:6.2f}s, {packets / baseline:9.0f} packets/s")
+        for fmt in ("npz", "csv"):
+            for jobs in args.jobs:
+                start = time.perf_counter()
+                export(path, os.path.join(directory, f"export-{fmt}-{jobs}"), fmt, jobs=jobs)
+                elapsed = time.perf_counter() - start
+                print(f"{fmt:>4} {jobs:>2} jobs: {elapsed:6.2f}s, {packets / elapsed:9.0f} packets/s, speedup {baseline / elapsed:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark of reading packets from a pcapng recording
+
+    python benchmarks/bench_reader.py [-n 200000]  # with mavsniff installed (pip install -e .)
+
+Compares `pcapng.FileScanner` with `ip.get_payload` (the former `Replay.run`) against the
+memory-mapped `PcapngReader` on a generated recording.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pcapng
+
+from mavsniff.utils import ip
+from mavsniff.utils.pcap import PacketEncoder, PcapngReader
+
+FRAME = bytes.fromhex("fd1c000001010121000000000000000000000000000000000000000000000000000000000000a1b2")
+
+
+def generate(path: str, n: int):
+    shb = pcapng.blocks.SectionHeader(endianness="<")
+    shb.register_interface(pcapng.blocks.InterfaceDescription(endianness="<", interface_id=0, section=shb))
+    encoder = PacketEncoder()
+    with open(path, "wb") as f:
+        pcapng.FileWriter(f, shb)
+        for seq in range(n):
+            f.write(encoder.encode(seq, FRAME, 1_700_000_000_000_000 + seq * 1000))
+
+
+def read_scanner(path: str) -> int:
+    total = 0
+    with open(path, "rb") as f:
+        for block in pcapng.FileScanner(f):
+            if isinstance(block, pcapng.blocks.EnhancedPacket):
+                total += len(ip.get_payload(block.packet_data))
+    return total
+
+
+def read_mmap(path: str) -> int:
+    total = 0
+    with open(path, "rb") as f, PcapngReader(f) as reader:
+        for _, payload in reader:
+            total += len(ip.get_payload(payload))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=200_000, help="packets in the generated recording")
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".pcapng")
+    os.close(fd)
+    try:
+        generate(path, args.n)
+        print(f"recording: {args.n} packets, {os.path.getsize(path) / 1e6:.1f} MB")
+        results = []
+        for name, fn in (("pcapng.FileScanner", read_scanner), ("PcapngReader", read_mmap)):
+            start = time.perf_counter()
+            results.append(fn(path))
+            seconds = time.perf_counter() - start
+            print(f"{name:>20}: {seconds:.2f}s, {seconds / args.n * 1e6:.2f} us/packet")
+        assert results[0] == results[1], "readers returned different payloads"
+    finally:
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
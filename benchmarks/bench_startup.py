@@ -0,0 +1,66 @@
+"""
+Start-up cost of the CLI per command, from `python -X importtime`
+
+    python benchmarks/bench_startup.py [--runs 5] [--top 5] [--budget capture=250 ports=60]
+
+Every command is started with `--help` (which imports it but does nothing) several times; the best
+run's total import time and wall time are printed with the modules costing most. With budgets
+(milliseconds of import time per command) the script exits with 1 when a command goes over - for
+catching regressions of the lazy imports in CI.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mavsniff.__main__ import COMMANDS
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure(command: str) -> tuple:
+    """(wall seconds, total import microseconds, {module: self microseconds}) of one start"""
+    args = [sys.executable, "-X", "importtime", "-m", "mavsniff"] + ([command] if command else []) + ["--help"]
+    start = time.perf_counter()
+    result = subprocess.run(args, cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode:
+        raise RuntimeError(f"mavsniff {command} --help failed:\n{result.stderr}")
+    total, modules = 0, {}
+    for match in LINE.finditer(result.stderr):
+        own, cumulative, indent, module = int(match[1]), int(match[2]), match[3], match[4]
+        modules[module] = own
+        if len(indent) == 1: # top-level import
+            total += cumulative
+    return wall, total, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="starts per command (the best one counts)")
+    parser.add_argument("--top", type=int, default=5, help="most expensive modules printed per command")
+    parser.add_argument("--budget", nargs="*", default=[], help="COMMAND=MS limits of import time")
+    parser.add_argument("commands", nargs="*", default=[""] + list(COMMANDS), help="commands to start (default: all and the bare group)")
+    args = parser.parse_args()
+    budgets = {command: float(ms) for command, ms in (budget.split("=", 1) for budget in args.budget)}
+
+    over = []
+    for command in args.commands:
+        wall, total, modules = min((measure(command) for _ in range(args.runs)), key=lambda run: run[1])
+        heaviest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        print(f"{command or '(group)':>9}: imports {total / 1000:7.1f}ms, wall {wall * 1000:7.1f}ms; "
+              + ", ".join(f"{module} {own / 1000:.1f}ms" for module, own in heaviest))
+        if command in budgets and total / 1000 > budgets[command]:
+            over.append(f"{command}: {total / 1000:.1f}ms > {budgets[command]:g}ms")
+    if over:
+        print("over budget: " + "; ".join(over))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
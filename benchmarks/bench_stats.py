@@ -0,0 +1,43 @@
+"""
+Scaling of the offline analysis (`mavsniff stats`) with the number of worker processes
+
+    python benchmarks/bench_stats.py [--seconds 300] [--rate 10000] [--jobs 1 2 4 8]
+
+A synthetic recording of the given length is written to a temporary file and analyzed with each
+number of jobs; the speedup is relative to a single process.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_suite import _recording
+from generator import DEFAULT_MIX
+from mavsniff.analysis import analyze
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=300, help="length of the recording")
+    parser.add_argument("--rate", type=float, default=10000, help="packets per second in the recording")
+    parser.add_argument("--jobs", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix=".pcapng") as file:
+        file.write(_recording(args.rate, args.seconds, {"mix": DEFAULT_MIX}).getbuffer())
+        file.flush()
+        print(f"{int(args.rate * args.seconds)} packets, {os.path.getsize(file.name) >> 20} MiB, {os.cpu_count()} CPUs")
+        single = None
+        for jobs in args.jobs:
+            start = time.perf_counter()
+            analyze(file.name, jobs)
+            elapsed = time.perf_counter() - start
+            single = single or elapsed
+            print(f"{jobs:>3} jobs: {elapsed:6.2f}s, {args.rate * args.seconds / elapsed:9.0f} packets/s, speedup {single / elapsed:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
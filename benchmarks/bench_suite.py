@@ -0,0 +1,306 @@
+"""
+Throughput and latency benchmark of capture and replay over loopback transports
+
+    python benchmarks/bench_suite.py [--rate 2000] [--duration 5] [--transport tcp udp pty] \\
+        [--output results.json] [--compare baseline.json]  # with mavsniff installed (pip install -e .)
+
+Capture scenarios feed `Capture` (raw and decoded) with synthetic traffic from `generator.py`
+running in a child process over loopback TCP, UDP and a pty pair standing in for a serial line.
+Replay scenarios replay a synthetic recording in real time and as fast as possible to a receiver
+in a child process. Reported per scenario:
+
+  packets_per_s      sustained rate of captured/replayed packets
+  cpu_us_per_packet  CPU time of the mavsniff process per packet
+  drop_rate          share of sent packets that did not make it through
+  jitter_us          lateness of replayed packets (p50, p90, p99, max)
+
+Results are saved as JSON together with versions so runs of different versions can be compared.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pcapng
+
+from generator import TrafficGenerator, open_output, DEFAULT_MIX
+from mavsniff.capture import Capture
+from mavsniff.replay import Replay
+from mavsniff.utils.framer import Framer
+from mavsniff.utils.mav import mavlink
+from mavsniff.utils.pcap import PacketEncoder
+
+TRANSPORTS = ("tcp", "udp", "pty")
+DRAIN_TIME = 0.5 # seconds to let the capture catch up after the generator stops
+START_TIME = 0.2 # seconds to let the capture open its device
+NOMINAL_RATE = 10000 # packets per second in the replayed recording when the generator rate is unlimited
+
+
+def _free_port(kind=socket.SOCK_STREAM) -> int:
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _context():
+    return multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+
+
+def _generate(target, options: dict, rate: float, duration: float, results):
+    """Child process: send synthetic traffic to target (URI or file descriptor)"""
+    generator = TrafficGenerator(**options)
+    if isinstance(target, int):
+        def write(data):
+            view = memoryview(data)
+            while view:
+                view = view[os.write(target, view):]
+        close = lambda: None
+    else:
+        for _ in range(50): # wait for the capture to listen
+            try:
+                write, close = open_output(target)
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.05)
+    try:
+        generator.run(write, rate, duration)
+    finally:
+        close()
+    results.put(generator.sent)
+
+
+def _receive(target, expected: int, timeout: float, results):
+    """Child process: count valid MAVLink frames arriving from target (listening URI or file descriptor)"""
+    framer = Framer()
+    received = 0
+    deadline = time.monotonic() + timeout
+    if isinstance(target, int):
+        read = lambda: os.read(target, 65536)
+        os.set_blocking(target, False)
+    elif target.startswith("udp://"):
+        host, port = target[6:].rsplit(":", 1)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, int(port)))
+        sock.setblocking(False)
+        read = lambda: sock.recv(65536)
+    else:
+        host, port = target[6:].rsplit(":", 1)
+        sock = None
+        while sock is None and time.monotonic() < deadline:
+            try:
+                sock = socket.create_connection((host, int(port)))
+            except ConnectionRefusedError:
+                time.sleep(0.05)
+        sock.setblocking(False)
+        read = lambda: sock.recv(65536)
+    results.put("ready")
+    while received < expected and time.monotonic() < deadline:
+        try:
+            data = read()
+        except (BlockingIOError, InterruptedError):
+            time.sleep(0.0005)
+            continue
+        received += len(framer.feed(data))
+    results.put(received)
+
+
+def capture_scenario(transport: str, raw: bool, rate: float, duration: float, options: dict) -> dict:
+    context = _context()
+    results = context.Queue()
+    master = None
+    if transport == "pty":
+        master, slave = os.openpty()
+        device = mavlink(os.ttyname(slave), input=True, baud=115200)
+        target = master
+    elif transport == "tcp":
+        port = _free_port()
+        device = mavlink(f"tcp://127.0.0.1:{port}", input=True)
+        target = f"tcp://127.0.0.1:{port}"
+    else:
+        port = _free_port(socket.SOCK_DGRAM)
+        device = mavlink(f"udp://127.0.0.1:{port}", input=True)
+        target = f"udp://127.0.0.1:{port}"
+
+    with tempfile.TemporaryFile() as file:
+        capture = Capture(device, file, raw=raw)
+        thread = threading.Thread(target=capture.run)
+        thread.start()
+        time.sleep(START_TIME)
+        cpu = time.process_time()
+        start = time.perf_counter()
+        generator = context.Process(target=_generate, args=(target, options, rate, duration, results))
+        generator.start()
+        sent = results.get()
+        generator.join()
+        deadline = time.monotonic() + DRAIN_TIME * 4
+        last = -1
+        while capture.received != last and time.monotonic() < deadline: # wait until nothing more arrives
+            last = capture.received
+            time.sleep(DRAIN_TIME)
+        elapsed = time.perf_counter() - start - DRAIN_TIME
+        cpu = time.process_time() - cpu
+        capture.stop()
+        thread.join()
+    device.close()
+    if master is not None:
+        os.close(master)
+    captured = capture.received
+    return {
+        "sent": sent,
+        "captured": captured,
+        "packets_per_s": captured / elapsed,
+        "cpu_us_per_packet": cpu / max(captured, 1) * 1e6,
+        "drop_rate": max(0.0, 1 - captured / sent) if sent else 0.0,
+    }
+
+
+def _recording(rate: float, duration: float, options: dict) -> io.BytesIO:
+    generator = TrafficGenerator(**options)
+    buffer = io.BytesIO()
+    shb = pcapng.blocks.SectionHeader(endianness="<")
+    shb.register_interface(pcapng.blocks.InterfaceDescription(endianness="<", interface_id=0, section=shb))
+    pcapng.FileWriter(buffer, shb)
+    encoder = PacketEncoder()
+    start_us = 1_700_000_000_000_000
+    for n in range(int(rate * duration)):
+        buffer.write(encoder.encode(n, generator.next(), start_us + int(n * 1e6 / rate)))
+    buffer.seek(0)
+    return buffer
+
+
+def replay_scenario(transport: str, speed: float, rate: float, duration: float, options: dict) -> dict:
+    context = _context()
+    results = context.Queue()
+    options = dict(options, garbage=0.0) # garbage would not be recorded as packets anyway
+    rate = rate or NOMINAL_RATE
+    recording = _recording(rate, duration, options)
+    expected = int(rate * duration)
+    master = None
+    if transport == "pty":
+        master, slave = os.openpty()
+        target = master
+    elif transport == "tcp":
+        port = _free_port()
+        target = f"tcp://127.0.0.1:{port}"
+    else:
+        port = _free_port(socket.SOCK_DGRAM)
+        target = f"udp://127.0.0.1:{port}"
+
+    receiver = context.Process(target=_receive, args=(target, expected, duration / (speed or 1) + 10, results))
+    if transport == "tcp":
+        device = mavlink(target, input=True) # replay listens, the receiver connects
+        receiver.start()
+        while device.port is None: # accept the receiver's connection
+            device.recv(0)
+            time.sleep(0.01)
+    else:
+        receiver.start()
+        device = mavlink(os.ttyname(slave), input=True, baud=115200) if transport == "pty" else mavlink(target, input=False)
+    results.get() # receiver is ready
+    replay = Replay(device=device, file=recording, speed=speed)
+    cpu = time.process_time()
+    start = time.perf_counter()
+    replayed = replay.run()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    received = results.get()
+    receiver.join()
+    device.close()
+    if master is not None:
+        os.close(master)
+    jitter = replay.scheduler.jitter()
+    return {
+        "replayed": replayed,
+        "received": received,
+        "packets_per_s": replayed / elapsed,
+        "cpu_us_per_packet": cpu / max(replayed, 1) * 1e6,
+        "drop_rate": max(0.0, 1 - received / replayed) if replayed else 0.0,
+        "jitter_us": {("max" if p == 100 else f"p{p}"): lateness * 1e6 for p, lateness in jitter.items()},
+    }
+
+
+def _version() -> str:
+    try:
+        from importlib.metadata import version
+        return version("mavsniff")
+    except Exception:
+        pass
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict):
+    """Print relative change of every metric against a baseline run"""
+    print(f"\ncompared to {baseline.get('version')} ({baseline.get('time')}):")
+    for name, metrics in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        changes = []
+        for key in ("packets_per_s", "cpu_us_per_packet", "drop_rate"):
+            if old.get(key):
+                changes.append(f"{key} {(metrics[key] / old[key] - 1) * 100:+.1f}%")
+        if "jitter_us" in metrics and old.get("jitter_us", {}).get("p99"):
+            changes.append(f"jitter p99 {(metrics['jitter_us']['p99'] / old['jitter_us']['p99'] - 1) * 100:+.1f}%")
+        print(f"{name:>28}: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=2000, help="frames per second sent by the generator / in the recording (0 as fast as possible)")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per scenario")
+    parser.add_argument("--transport", nargs="+", choices=TRANSPORTS, default=[t for t in TRANSPORTS if t != "pty" or hasattr(os, "openpty")])
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="message mix NAME:rate,... (default: %(default)s)")
+    parser.add_argument("--v1", action="store_true", help="generate MAVLink 1 frames")
+    parser.add_argument("--signing", action="store_true", help="sign MAVLink 2 frames")
+    parser.add_argument("--garbage", type=float, default=0.0, help="probability of random bytes before a frame")
+    parser.add_argument("--output", "-o", help="save results as JSON")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    args = parser.parse_args()
+
+    options = {"mix": args.mix, "v1": args.v1, "signing": args.signing, "garbage": args.garbage}
+    results = {
+        "version": _version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": dict(options, rate=args.rate, duration=args.duration),
+        "scenarios": {},
+    }
+    scenarios = []
+    for transport in args.transport:
+        scenarios.append((f"capture-raw-{transport}", lambda t=transport: capture_scenario(t, True, args.rate, args.duration, options)))
+        scenarios.append((f"capture-decoded-{transport}", lambda t=transport: capture_scenario(t, False, args.rate, args.duration, options)))
+        scenarios.append((f"replay-{transport}", lambda t=transport: replay_scenario(t, 1.0, args.rate, args.duration, options)))
+        scenarios.append((f"replay-max-rate-{transport}", lambda t=transport: replay_scenario(t, 0, args.rate, args.duration, options)))
+    for name, scenario in scenarios:
+        metrics = scenario()
+        results["scenarios"][name] = metrics
+        line = f"{name:>28}: {metrics['packets_per_s']:9.0f} packets/s, {metrics['cpu_us_per_packet']:6.1f} us CPU/packet, drops {metrics['drop_rate'] * 100:.2f}%"
+        if metrics.get("jitter_us"):
+            line += f", jitter p99 {metrics['jitter_us']['p99']:.0f}us max {metrics['jitter_us']['max']:.0f}us"
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
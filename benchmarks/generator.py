@@ -0,0 +1,158 @@
+"""
+Synthetic MAVLink traffic generator
+
+    python benchmarks/generator.py -d udp://127.0.0.1:14550 --rate 1000 --duration 10 \\
+        --mix HEARTBEAT:1,ATTITUDE:50,RAW_IMU:50,GPS_RAW_INT:5 [--v1] [--signing] [--garbage 0.01]
+
+Frames of the message mix (name:relative rate) are prepared ahead for every sequence number, so
+sending costs only a write. Garbage injection puts random bytes between frames with the given
+probability; signing appends MAVLink 2 signatures (with a fixed key and timestamps).
+"""
+import argparse
+import os
+import random
+import socket
+import time
+
+DEFAULT_MIX = "HEARTBEAT:1,SYS_STATUS:1,ATTITUDE:50,RAW_IMU:50,GLOBAL_POSITION_INT:10,GPS_RAW_INT:5,STATUSTEXT:0.1"
+SIGNING_KEY = bytes(range(32))
+
+
+def _dialect(v1: bool):
+    if v1:
+        from pymavlink.dialects.v10 import ardupilotmega
+    else:
+        from pymavlink.dialects.v20 import ardupilotmega
+    return ardupilotmega
+
+
+def _sample(msgtype):
+    """Message of the type with all fields set to non-zero values (so v2 payloads are not truncated)"""
+    args = []
+    for fieldtype, length in zip(msgtype.fieldtypes, msgtype.array_lengths):
+        if fieldtype == "char":
+            args.append(b"x" * max(length, 1))
+        elif length:
+            args.append([1] * length)
+        else:
+            args.append(1)
+    return msgtype(*args)
+
+
+def parse_mix(mix: str) -> list:
+    """Parse `NAME:rate,...` into [(name, weight)]"""
+    weights = []
+    for item in mix.split(","):
+        name, _, weight = item.strip().partition(":")
+        weights.append((name.strip().upper(), float(weight or 1)))
+    return weights
+
+
+class TrafficGenerator:
+    """Produce frames of a message mix with increasing sequence numbers and optional garbage"""
+
+    def __init__(self, mix: str = DEFAULT_MIX, v1: bool = False, signing: bool = False, garbage: float = 0.0, seed: int = 0):
+        dialect = _dialect(v1)
+        names = {msgtype.msgname: msgtype for msgtype in dialect.mavlink_map.values()}
+        self.random = random.Random(seed)
+        self.garbage = garbage
+        self.names = []
+        self.weights = []
+        self.frames = [] # frames[type][seq]
+        for name, weight in parse_mix(mix):
+            if name not in names:
+                raise ValueError(f"unknown message {name}")
+            msgtype = names[name]
+            if v1 and msgtype.id > 255:
+                raise ValueError(f"{name} can not be sent with MAVLink 1")
+            mav = dialect.MAVLink(None, srcSystem=1, srcComponent=1)
+            if signing and not v1:
+                mav.signing.secret_key = SIGNING_KEY
+                mav.signing.sign_outgoing = True
+                mav.signing.timestamp = 1
+            message = _sample(msgtype)
+            frames = []
+            for seq in range(256):
+                mav.seq = seq
+                frames.append(bytes(message.pack(mav)))
+            self.names.append(name)
+            self.weights.append(weight)
+            self.frames.append(frames)
+        self.seq = 0
+        self.sent = 0 # valid frames
+        self.sent_bytes = 0
+        self.garbage_bytes = 0
+
+    def next(self) -> bytes:
+        """Bytes of the next frame (possibly preceded by garbage)"""
+        frames = self.random.choices(self.frames, self.weights)[0]
+        frame = frames[self.seq]
+        self.seq = (self.seq + 1) & 0xFF
+        self.sent += 1
+        self.sent_bytes += len(frame)
+        if self.garbage and self.random.random() < self.garbage:
+            junk = bytes(self.random.randrange(0, 0xfd) for _ in range(self.random.randint(1, 16))) # no magic bytes
+            self.garbage_bytes += len(junk)
+            return junk + frame
+        return frame
+
+    def run(self, write, rate: float, duration: float, chunk: int = 1) -> float:
+        """Call write with `chunk` frames at a time at rate frames/s for duration seconds; return the elapsed time"""
+        start = time.perf_counter()
+        deadline = start + duration
+        n = 0
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            due = start + n / rate if rate else now
+            if due > now:
+                time.sleep(min(due - now, 0.01))
+                continue
+            write(b"".join(self.next() for _ in range(chunk)))
+            n += chunk
+        return time.perf_counter() - start
+
+
+def open_output(uri: str):
+    """Return write(data) sending to tcp://host:port, udp://host:port or a file/pty path"""
+    if uri.startswith("tcp://"):
+        host, port = uri[6:].rsplit(":", 1)
+        sock = socket.create_connection((host, int(port)))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock.sendall, sock.close
+    if uri.startswith("udp://"):
+        host, port = uri[6:].rsplit(":", 1)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect((host, int(port)))
+        return sock.send, sock.close
+    fd = os.open(uri, os.O_WRONLY | os.O_NOCTTY)
+    def write(data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    return write, lambda: os.close(fd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-d", "--device", required=True, help="tcp://host:port, udp://host:port or a (pty) path")
+    parser.add_argument("--rate", type=float, default=1000, help="frames per second (0 as fast as possible)")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="message mix NAME:rate,... (default: %(default)s)")
+    parser.add_argument("--v1", action="store_true", help="send MAVLink 1 frames")
+    parser.add_argument("--signing", action="store_true", help="sign MAVLink 2 frames")
+    parser.add_argument("--garbage", type=float, default=0.0, help="probability of random bytes before a frame")
+    args = parser.parse_args()
+
+    generator = TrafficGenerator(args.mix, v1=args.v1, signing=args.signing, garbage=args.garbage)
+    write, close = open_output(args.device)
+    try:
+        elapsed = generator.run(write, args.rate, args.duration)
+    finally:
+        close()
+    print(f"sent {generator.sent} frames ({generator.sent_bytes} B, {generator.garbage_bytes} B of garbage) in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
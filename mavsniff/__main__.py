@@ -1,15 +1,44 @@
 import click
+import importlib
 import sys
 
-from .commands import capture, ports, replay, wsplugin
+# command name -> "module:function"; modules (and pymavlink, pcapng, pyserial they need) are imported only when their command runs
+COMMANDS = {
+    "capture": "mavsniff.commands.capture:capture",
+    "replay": "mavsniff.commands.replay:replay",
+    "proxy": "mavsniff.commands.proxy:proxy",
+    "index": "mavsniff.commands.index:index",
+    "stats": "mavsniff.commands.stats:stats",
+    "export": "mavsniff.commands.export:export",
+    "merge": "mavsniff.commands.merge:merge",
+    "slice": "mavsniff.commands.slice:slice_",
+    "split": "mavsniff.commands.split:split",
+    "wsplugin": "mavsniff.commands.wsplugin:wsplugin",
+    "ports": "mavsniff.commands.ports:ports",
+}
 
-@click.group()
+
+class LazyGroup(click.Group):
+    """Group importing the module of a command only when the command is looked up"""
+
+    def __init__(self, *args, lazy_commands: dict = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx) -> list:
+        return super().list_commands(ctx) + [name for name in self.lazy_commands if name not in self.commands]
+
+    def get_command(self, ctx, name):
+        if name not in self.commands and name in self.lazy_commands:
+            module, _, attribute = self.lazy_commands[name].partition(":")
+            self.add_command(getattr(importlib.import_module(module), attribute), name)
+        return super().get_command(ctx, name)
+
+
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS)
 def main():
     pass
 
-main.add_command(capture.capture)
-main.add_command(replay.replay)
-main.add_command(wsplugin.wsplugin)
-main.add_command(ports.ports)
 
-sys.exit(main())
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
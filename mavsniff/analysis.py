@@ -0,0 +1,271 @@
+import concurrent.futures
+import itertools
+import os
+
+from pymavlink import mavutil
+
+from mavsniff.utils.decap import Decapsulator
+from mavsniff.utils.framer import MAGIC_V1, MAGIC_V2, HEADER_LEN_V1, HEADER_LEN_V2
+from mavsniff.utils.metrics import Histogram
+from mavsniff.utils.pcap import CaptureReader, open_reader
+from mavsniff.utils.timing import BITS_PER_BYTE
+
+INTERVAL_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0) # seconds between packets of a stream
+MIN_CHUNK = 4 << 20 # bytes; smaller recordings are not worth splitting further
+CHUNKS_PER_JOB = 4 # more chunks than workers even out their different speeds
+
+
+def parse_fields(specs, dialect=None) -> dict:
+    """Parse `NAME.field` specs into {msgid: [(spec, field)]}; raise ValueError on unknown ones"""
+    dialect = dialect or mavutil.mavlink
+    names = {msgtype.msgname: msgtype for msgtype in dialect.mavlink_map.values()}
+    fields = {}
+    for spec in specs:
+        for item in spec.split(","):
+            name, _, field = item.strip().partition(".")
+            msgtype = names.get(name.upper())
+            if msgtype is None:
+                raise ValueError(f"unknown message {name}")
+            if field not in msgtype.fieldnames:
+                raise ValueError(f"{msgtype.msgname} has no field {field}")
+            fields.setdefault(msgtype.id, []).append((f"{msgtype.msgname}.{field}", field))
+    return fields
+
+
+class ChunkStats:
+    """
+    Aggregates of a contiguous run of packets of a recording.
+
+    Only MAVLink headers are read: packets and bytes per message ID, sequence numbers per
+    component, time between packets of every stream (msgid, sysid, compid) and bytes per time bin
+    of every interface. Fields of messages are decoded only when asked for (min/max/mean). First
+    and last sequence numbers and timestamps are kept so that a chunk can be merged with the one
+    following it as if they were scanned at once.
+    """
+
+    def __init__(self, bin_seconds: float = 1.0):
+        self.bin = bin_seconds
+        self.packets = 0
+        self.bytes = 0
+        self.other = 0 # packets without MAVLink frames
+        self.first_ts = None
+        self.last_ts = None
+        self.messages = {} # msgid -> [packets, bytes]
+        self.components = {} # (sysid << 8) | compid -> [first seq, last seq, received, lost]
+        self.streams = {} # (msgid << 16) | (sysid << 8) | compid -> [first timestamp, last timestamp]
+        self.intervals = {} # msgid -> Histogram of seconds between packets of its streams
+        self.link = {} # (interface_id, time bin) -> bytes
+        self.speeds = {} # interface_id -> bits per second (0 if unknown)
+        self.fields = {} # "NAME.field" -> [count, min, max, sum]
+
+    def scan(self, reader: CaptureReader, start: int = 0, end: int = None, fields: dict = None, dialect=None):
+        """Aggregate packets of blocks starting at offsets in [start, end)"""
+        messages, components, streams, intervals, link = self.messages, self.components, self.streams, self.intervals, self.link
+        decapsulate, bin_seconds = Decapsulator(reader).frames, self.bin
+        mav = (dialect or mavutil.mavlink).MAVLink(None) if fields else None
+        packets = size = other = 0
+        first_ts = last_ts = None
+        for offset, interface_id, timestamp, packet_data in reader.records(start):
+            if end is not None and offset >= end:
+                break
+            packets += 1
+            if first_ts is None:
+                first_ts = timestamp
+            last_ts = timestamp
+            frames = decapsulate(interface_id, packet_data) if packet_data else None
+            if not frames:
+                other += 1
+                continue
+            for frame in frames:
+                if frame[0] == MAGIC_V2 and len(frame) >= HEADER_LEN_V2:
+                    msgid = frame[7] | (frame[8] << 8) | (frame[9] << 16)
+                    component, seq = (frame[5] << 8) | frame[6], frame[4]
+                elif frame[0] == MAGIC_V1 and len(frame) >= HEADER_LEN_V1:
+                    msgid = frame[5]
+                    component, seq = (frame[3] << 8) | frame[4], frame[2]
+                else:
+                    continue
+                length = len(frame)
+                size += length
+                message = messages.get(msgid)
+                if message is None:
+                    message = messages[msgid] = [0, 0]
+                message[0] += 1
+                message[1] += length
+                counters = components.get(component)
+                if counters is None:
+                    components[component] = [seq, seq, 1, 0]
+                else:
+                    counters[3] += (seq - counters[1] - 1) & 0xFF
+                    counters[1] = seq
+                    counters[2] += 1
+                key = (msgid << 16) | component
+                stream = streams.get(key)
+                if stream is None:
+                    streams[key] = [timestamp, timestamp]
+                else:
+                    histogram = intervals.get(msgid)
+                    if histogram is None:
+                        histogram = intervals[msgid] = Histogram(INTERVAL_BOUNDS)
+                    histogram.observe(timestamp - stream[1])
+                    stream[1] = timestamp
+                time_bin = (interface_id, int(timestamp // bin_seconds))
+                link[time_bin] = link.get(time_bin, 0) + length
+                if fields and msgid in fields:
+                    self._decode(mav, frame, fields[msgid])
+        self.packets, self.bytes, self.other = packets, size, other
+        self.first_ts, self.last_ts = first_ts, last_ts
+        self.speeds = {interface_id: interface.speed for interface_id, interface in enumerate(reader.interfaces)}
+        return self
+
+    def _decode(self, mav, frame, fields: list):
+        try:
+            message = mav.decode(bytearray(frame))
+        except Exception:
+            return # bad CRC or truncated frame
+        for spec, field in fields:
+            value = getattr(message, field, None)
+            if not isinstance(value, (int, float)):
+                continue
+            counters = self.fields.get(spec)
+            if counters is None:
+                self.fields[spec] = [1, value, value, value]
+            else:
+                counters[0] += 1
+                counters[1] = min(counters[1], value)
+                counters[2] = max(counters[2], value)
+                counters[3] += value
+
+    def merge(self, later: "ChunkStats") -> "ChunkStats":
+        """Add aggregates of the chunk following this one in the recording"""
+        self.packets += later.packets
+        self.bytes += later.bytes
+        self.other += later.other
+        if self.first_ts is None:
+            self.first_ts = later.first_ts
+        if later.last_ts is not None:
+            self.last_ts = later.last_ts
+        for msgid, (packets, size) in later.messages.items():
+            message = self.messages.setdefault(msgid, [0, 0])
+            message[0] += packets
+            message[1] += size
+        for component, (first_seq, last_seq, received, lost) in later.components.items():
+            counters = self.components.get(component)
+            if counters is None:
+                self.components[component] = [first_seq, last_seq, received, lost]
+            else:
+                counters[3] += lost + ((first_seq - counters[1] - 1) & 0xFF) # gap across the chunk boundary
+                counters[1] = last_seq
+                counters[2] += received
+        for msgid, histogram in later.intervals.items():
+            self._intervals(msgid).merge(histogram)
+        for key, (first_ts, last_ts) in later.streams.items():
+            stream = self.streams.get(key)
+            if stream is None:
+                self.streams[key] = [first_ts, last_ts]
+            else:
+                self._intervals(key >> 16).observe(first_ts - stream[1])
+                stream[1] = last_ts
+        for time_bin, size in later.link.items():
+            self.link[time_bin] = self.link.get(time_bin, 0) + size
+        for interface_id, speed in later.speeds.items():
+            self.speeds[interface_id] = max(speed, self.speeds.get(interface_id, 0))
+        for spec, (count, low, high, total) in later.fields.items():
+            counters = self.fields.get(spec)
+            if counters is None:
+                self.fields[spec] = [count, low, high, total]
+            else:
+                counters[0] += count
+                counters[1] = min(counters[1], low)
+                counters[2] = max(counters[2], high)
+                counters[3] += total
+        return self
+
+    def _intervals(self, msgid: int) -> Histogram:
+        histogram = self.intervals.get(msgid)
+        if histogram is None:
+            histogram = self.intervals[msgid] = Histogram(INTERVAL_BOUNDS)
+        return histogram
+
+    def summary(self, dialect=None) -> dict:
+        """All aggregates as a JSON-serializable dictionary"""
+        dialect = dialect or mavutil.mavlink
+        duration = (self.last_ts - self.first_ts) if self.packets else 0.0
+        def name(msgid):
+            msgtype = dialect.mavlink_map.get(msgid)
+            return msgtype.msgname if msgtype is not None else str(msgid)
+        links = []
+        for interface_id in sorted({interface_id for interface_id, _ in self.link}):
+            bins = {time_bin: size for (iface, time_bin), size in self.link.items() if iface == interface_id}
+            first = min(bins)
+            rates = [bins.get(time_bin, 0) / self.bin for time_bin in range(first, max(bins) + 1)]
+            speed = self.speeds.get(interface_id, 0)
+            links.append({
+                "interface": interface_id,
+                "speed": speed,
+                "start": first * self.bin,
+                "bytes_per_s": rates,
+                "mean_bytes_per_s": sum(rates) / len(rates),
+                "peak_bytes_per_s": max(rates),
+                "peak_utilisation": max(rates) * BITS_PER_BYTE / speed if speed else None,
+            })
+        return {
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "other": self.other,
+            "start": self.first_ts,
+            "duration": duration,
+            "messages": [{
+                "msgid": msgid,
+                "name": name(msgid),
+                "packets": packets,
+                "bytes": size,
+                "packets_per_s": packets / duration if duration else None,
+                "intervals": self.intervals[msgid].snapshot() if msgid in self.intervals else None,
+            } for msgid, (packets, size) in sorted(self.messages.items())],
+            "components": [{
+                "sysid": component >> 8,
+                "compid": component & 0xFF,
+                "received": received,
+                "lost": lost,
+                "loss": lost / (received + lost),
+            } for component, (_, _, received, lost) in sorted(self.components.items())],
+            "link": links,
+            "fields": [{"field": spec, "count": count, "min": low, "max": high, "mean": total / count}
+                       for spec, (count, low, high, total) in self.fields.items()],
+        }
+
+
+def scan_chunk(path: str, start: int, end: int, bin_seconds: float = 1.0, fields: dict = None) -> ChunkStats:
+    """Aggregate packet blocks of a recording starting at offsets in [start, end) (runs in worker processes)"""
+    with open(path, "rb") as file, open_reader(file) as reader:
+        return ChunkStats(bin_seconds).scan(reader, start, end, fields)
+
+
+def split_chunks(path: str, jobs: int) -> list:
+    """`(start, end)` offsets of chunks of a recording for `jobs` worker processes, split at packet block boundaries"""
+    with open(path, "rb") as file, open_reader(file) as reader:
+        size = reader.base + len(reader.view)
+        parts = 1 if jobs == 1 else max(1, min(jobs * CHUNKS_PER_JOB, size // MIN_CHUNK))
+        offsets = reader.boundaries(parts) + [size]
+    return list(zip(offsets, offsets[1:]))
+
+
+def analyze(path: str, jobs: int = None, bin_seconds: float = 1.0, fields: dict = None) -> ChunkStats:
+    """
+    Aggregate a whole recording by scanning its chunks in parallel.
+
+    The file is split at packet block boundaries into chunks scanned by `jobs` worker processes
+    (all CPUs by default); their aggregates are merged in file order.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    chunks = split_chunks(path, jobs)
+    if len(chunks) == 1:
+        return scan_chunk(path, 0, None, bin_seconds, fields)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(chunks))) as pool:
+        results = pool.map(scan_chunk, itertools.repeat(path), *zip(*chunks),
+                           itertools.repeat(bin_seconds), itertools.repeat(fields))
+        total = next(results)
+        for stats in results:
+            total.merge(stats)
+    return total
@@ -1,101 +1,342 @@
 import io
-import pcapng
 import serial
 import time
-import struct
 
+import asyncio
 import signal
-import time
-import threading
 
 from pymavlink import mavutil
 from pymavlink.generator import mavparse
 
 from mavsniff.utils.log import logger
-from mavsniff.utils.ip import udp_header
+from mavsniff.utils.framer import Framer
+from mavsniff.utils.filter import MessageFilter
+from mavsniff.utils.metrics import Metrics
+from mavsniff.utils.pcap import PacketEncoder, section_header
+from mavsniff.utils.profiling import Profiler
+from mavsniff.utils.ring import RingBuffer, BLOCK
+from mavsniff.utils.segments import RotatingFile
+from mavsniff.utils.stamping import SOURCES, Stamper
+from mavsniff.utils.aio import Runner, wait_readable
+from mavsniff.utils.mav import drop_closed_connection
+from mavsniff.utils.timing import WallClock, clock
+
+RECV_SIZE = 4096 # read at most this many raw bytes at once
+MAX_MESSAGES = 64 # decode at most this many messages from one device before serving others
+WRITE_BATCH = 256 # max packets written to the file at once
+FLUSH_INTERVAL = 1.0 # seconds between file flushes
 
 
-class Capture:
-    """Capture reads Mavlink messages from a device and store them into a PCAPNG file"""
+class AsyncCapture:
+    """
+    Capture reads Mavlink messages from one or more devices and store them into a PCAPNG file.
 
-    def __init__(self, device: mavutil.mavfile, file: io.BytesIO):
-        self.device = device
+    Devices are read on the running event loop as their file descriptors become readable, the file
+    is written by a worker thread. Cancel the `run` task to stop capturing.
+    Messages rejected by the optional `message_filter` are counted but not stored.
+    When the file is a `RotatingFile` every segment starts with its own section and interface blocks.
+    Optional `metrics` get write latency from the writer thread and per-stream counters from the
+    writer (raw frames) or from the reader (decoded messages, by their original header); an optional
+    `profiler` gets the time spent in every stage of reading and writing.
+    Packets are stamped with the receive time of the chunk of bytes they came in (see `Stamper`) on
+    a wall clock anchored to the monotonic clock when the capture starts; every interface block
+    records the source of its timestamps in a comment.
+    """
+
+    def __init__(self, device: mavutil.mavfile, file: io.BytesIO, raw: bool = False, buffer_size: int = 4096, overflow: str = BLOCK,
+                 message_filter: MessageFilter = None, metrics: Metrics = None, profiler: Profiler = None):
+        # every device becomes one interface of the pcapng section; its index is the interface ID
+        self.devices = list(device) if isinstance(device, (list, tuple)) else [device]
+        self.device = self.devices[0]
         self.file = file
-        self.interface_id=0x00
-        self.done = False
-        self.sbh = pcapng.blocks.SectionHeader(msgid=0, endianness="<", options={
-            'shb_userappl': 'mavsniff',
-        })
-        self.sbh.register_interface(pcapng.blocks.InterfaceDescription(msdgid=0x01, endianness="<", interface_id=self.interface_id, section=self.sbh, options={
+        self.buffer_size = buffer_size # number of packets the reader can get ahead of the writer
+        self.overflow = overflow # what happens when the writer falls behind (see utils.ring)
+        self.message_filter = message_filter
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.source = self.counters
+        self.profiler = profiler
+        self.finished = False
+        # raw mode frames the byte stream without decoding messages and stores the original bytes
+        self.framers = [Framer() for _ in self.devices] if raw else None
+        self.encoder = PacketEncoder()
+        self.clock = WallClock()
+        self.stampers = [Stamper(device, self.clock) for device in self.devices]
+        self.interfaces = [{
             'if_name': device.address if ":" not in device.address else device.address.split(":")[1],
-            'if_txspeed': getattr(self.device, "baudrate", 0),
-            'if_rxspeed': getattr(self.device, "baudrate", 0),
-            'if_tsresol': struct.pack('<B', 6), # negative power of 10
-            # should we deal with timestamp resolution?
-        }))
-        signal.signal(signal.SIGINT, self.stop)
+            'if_description': device.address,
+            'if_txspeed': int(getattr(device, "baud", 0)), # pymavlink's serial keeps the rate in `baud`
+            'if_rxspeed': int(getattr(device, "baud", 0)),
+            'opt_comment': f"timestamps: {SOURCES[stamper.source]}",
+        } for device, stamper in zip(self.devices, self.stampers)]
+        self._reset()
 
-    def run(self, limit=-1, limit_invalid_packets=-1) -> dict:
-        """Store Mavlink messages into a PCAPNG file"""
-        self.writer = pcapng.FileWriter(self.file, self.sbh)
-        self.done = False
-        received = 0
-        parse_errors = 0
-        empty_messages = 0
-        bad_messages = 0
-        other_messages = 0
-
-        def report_stats():
-            while not self.done:
-                logger.info(f"captured {received}, not-parsed: {other_messages}, empty: {empty_messages}, bad: {bad_messages}")
-                time.sleep(1.0)
-        threading.Thread(target=report_stats).start()
-
-        while not self.done:
-            try:
-                msg = self.device.recv_msg()
-                parse_errors = 0
-                if msg is None:
-                    empty_messages += 1
-                    continue
-                if msg.get_type() == 'BAD_DATA':
-                    bad_messages += 1
+    def _reset(self):
+        self.limit_invalid_packets = -1
+        self.received = 0
+        self.written = 0
+        self.parse_errors = 0
+        self.empty_messages = 0
+        self.bad_messages = 0
+        self.other_messages = 0
+        self.filtered = 0
+        self.interface_packets = [0] * len(self.devices)
+        self.interface_bytes = [0] * len(self.devices)
+        self.readable_at = [None] * len(self.devices) # clock time a device was last found readable
+        self.space = None # future of readers waiting for the writer to free space in the full buffer
+        self.ring = RingBuffer(self.buffer_size, self.overflow)
+
+    async def run(self, limit=-1, limit_invalid_packets=-1) -> int:
+        """Store Mavlink messages into a PCAPNG file until cancelled, the limit is reached or a device closes"""
+        self.header = section_header(self.interfaces) # section and interface blocks starting every file (segment)
+        self._reset()
+        self.clock.anchor()
+        self.finished = False
+        self.limit_invalid_packets = limit_invalid_packets
+        if self.profiler is not None:
+            self.profiler.start()
+            self.profiler.enter_thread()
+        writer = asyncio.get_running_loop().run_in_executor(None, self._write_packets)
+        readers = [asyncio.ensure_future(self._read_packets(interface_id, limit)) for interface_id in range(len(self.devices))]
+        try:
+            done, _ = await asyncio.wait(readers, return_when=asyncio.FIRST_COMPLETED)
+            for reader in done:
+                reader.result()
+        finally:
+            for reader in readers:
+                reader.cancel()
+            await asyncio.gather(*readers, return_exceptions=True)
+            self.ring.close()
+            await writer
+            if self.profiler is not None:
+                self.profiler.finish()
+            self.finished = True
+        return self.written
+
+    def counters(self) -> dict:
+        """Snapshot of the global counters"""
+        return {
+            "captured": self.received,
+            "written": self.written,
+            "not_parsed": self.other_messages,
+            "empty": self.empty_messages,
+            "bad": self.bad_messages,
+            "filtered": self.filtered,
+            "buffered_max": self.ring.high_water,
+            "buffer_size": self.ring.capacity,
+            "dropped": self.ring.dropped,
+            "interfaces": [{"device": device.address, "packets": self.interface_packets[i], "bytes": self.interface_bytes[i]}
+                           for i, device in enumerate(self.devices)],
+        }
+
+    async def stats(self, interval: float = 1.0):
+        """Yield a snapshot of the counters every interval seconds until the capture finishes"""
+        while not self.finished:
+            yield self.counters()
+            await asyncio.sleep(interval)
+
+    async def _read_packets(self, interface_id: int, limit: int):
+        """Read packets from a device and hand them over to the writer"""
+        device = self.devices[interface_id]
+        read = self._read_raw if self.framers else self._read_decoded
+        profiler = self.profiler
+        woken = False # the device was readable before this read
+        try:
+            while True:
+                packets = read(interface_id)
+                if not packets:
+                    if woken:
+                        drop_closed_connection(device) # readable without data may be a closed connection
+                    if profiler is not None:
+                        started = clock()
+                    self.readable_at[interface_id] = await wait_readable(device.fd) # TCP server swaps listening socket for the connection so ask every time
+                    if profiler is not None:
+                        profiler.observe("sleep", started)
+                    woken = True
                     continue
-                received += 1
-                self._write_packet(received, msg.pack(self.device.mav))
-                if limit > 0 and received >= limit:
+                woken = False
+                for timestamp_us, data in packets:
+                    self.received += 1
+                    self.interface_packets[interface_id] += 1
+                    self.interface_bytes[interface_id] += len(data)
+                    item = (timestamp_us, interface_id, data)
+                    if self.ring.policy == BLOCK and len(self.ring) >= self.ring.capacity:
+                        await self._wait_for_space()
+                    self.ring.put(item)
+                    if limit > 0 and self.received >= limit:
+                        return
+                await asyncio.sleep(0) # do not starve other devices on a busy link
+        except serial.SerialException:
+            logger.info("serial line closed")
+
+    async def _wait_for_space(self):
+        """Wait until the writer takes packets out of the full buffer"""
+        # all readers run on this loop so nobody can fill the buffer between the check and put
+        loop = asyncio.get_running_loop()
+        while len(self.ring) >= self.ring.capacity and not self.ring.closed:
+            space = self.space
+            if space is None or space.done():
+                space = self.space = loop.create_future()
+            if len(self.ring) < self.ring.capacity: # the writer did not see the future yet
+                break
+            await space
+
+    def _space_freed(self):
+        """Wake up readers waiting for space (called by the writer thread)"""
+        space, self.space = self.space, None
+        if space is not None:
+            space.get_loop().call_soon_threadsafe(lambda: space.done() or space.set_result(None))
+
+    def _write_packets(self):
+        """Write packets from the ring buffer in batches until the reader finishes"""
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.enter_thread()
+        self.file.write(self.header)
+        batch_buffer = bytearray()
+        last_flush = time.monotonic()
+        rotating = isinstance(self.file, RotatingFile)
+        while True:
+            closed = self.ring.closed
+            batch = self.ring.get_batch(WRITE_BATCH)
+            if self.space is not None:
+                self._space_freed()
+            if rotating and self.file.should_rotate(len(self.header)):
+                self.file.rotate(self.header)
+                logger.info(f"writing into {self.file.name}")
+            if not batch:
+                if closed:
                     break
+                continue
+            if profiler is not None:
+                started = clock()
+            batch_buffer.clear()
+            for timestamp_us, interface_id, data in batch:
+                self.written += 1
+                batch_buffer += self.encoder.encode(self.written, data, timestamp_us, interface_id)
+            if profiler is not None:
+                started = profiler.observe("encode", started)
+            self.file.write(batch_buffer)
+            if self.metrics is not None:
+                self.metrics.observe_written(batch, self.clock.now_us(), count_frames=self.framers is not None)
+            now = time.monotonic()
+            if now - last_flush >= FLUSH_INTERVAL:
+                self.file.flush()
+                last_flush = now
+            if profiler is not None:
+                profiler.observe("write", started)
+        self.file.flush()
+        if profiler is not None:
+            profiler.leave_thread()
+
+    def _read_decoded(self, interface_id: int) -> list:
+        """Read messages using pymavlink parser and pack them back to bytes; return [(timestamp_us, bytes)]"""
+        device = self.devices[interface_id]
+        stamper = self.stampers[interface_id] # a message gets the stamp of the chunk that completed it
+        profiler = self.profiler
+        metrics = self.metrics
+        packets = []
+        for i in range(MAX_MESSAGES): # drain what the parser has buffered but keep other devices going
+            if profiler is not None:
+                started = clock()
+            try:
+                msg = device.recv_msg()
             except mavparse.MAVParseError:
-                parse_errors += 1
-                other_messages += 1
-                if limit_invalid_packets > 0 and parse_errors > limit_invalid_packets:
-                    raise RuntimeError("Too many invalid packets in a row")
+                self.other_messages += 1
+                self._invalid_packet()
                 continue
-            except serial.SerialException:
-                logger.info("serial line closed")
+            if profiler is not None:
+                profiler.observe("parse", started)
+            self.parse_errors = 0
+            if msg is None:
+                if i == 0:
+                    self.empty_messages += 1
                 break
-        return received
-
-    def _write_packet(self, seq:int, data: bytes):
-        """Write packet to the device"""
-        now_us = time.time_ns() // 1000
-        payload = udp_header(seq, len(data)) + data
-        self.writer.write_block(pcapng.blocks.EnhancedPacket(
-            section=self.sbh,
-            interface_id=self.interface_id,
-            packet_data=payload,
-            timestamp_high=(now_us & 0xFFFFFFFF00000000) >> 32,
-            timestamp_low=(now_us & 0xFFFFFFFF),
-            captured_len=len(payload),
-            packet_len=len(payload),
-            endianness="<",
-            # options={
-            #     'epb_flags': 0,
-            #     'epb_tsresol': 6, # negative power of 10
-            #     'epb_tsoffset': 0,
-            #     'epb_len': len(packet_bytes),
-            # },
-        ))
+            if msg.get_type() == 'BAD_DATA':
+                self.bad_messages += 1
+                continue
+            if self.message_filter and not self.message_filter.accepts_ids(msg.get_msgId(), msg.get_srcSystem(), msg.get_srcComponent()):
+                self.filtered += 1
+                continue
+            if metrics is not None: # packing replaces the header with our own sysid, compid and sequence
+                metrics.observe_message(msg.get_msgId(), msg.get_srcSystem(), msg.get_srcComponent(), msg.get_seq(), len(msg.get_msgbuf()))
+            if profiler is not None:
+                started = clock()
+                packets.append((stamper.timestamp_us, msg.pack(device.mav)))
+                profiler.observe("pack", started)
+            else:
+                packets.append((stamper.timestamp_us, msg.pack(device.mav)))
+        return packets
+
+    def _read_raw(self, interface_id: int) -> list:
+        """Read raw bytes from the device and split them into original MAVLink frames; return [(timestamp_us, bytes)]"""
+        profiler = self.profiler
+        if profiler is not None:
+            started = clock()
+        data = self._recv(interface_id)
+        if profiler is not None:
+            started = profiler.observe("read", started)
+        if not data:
+            self.empty_messages += 1
+            return ()
+        framer = self.framers[interface_id]
+        bad_data, unknown = framer.bad_data, framer.unknown
+        frames = framer.feed(data)
+        self.bad_messages += framer.bad_data - bad_data
+        self.other_messages += framer.unknown - unknown
+        if frames:
+            self.parse_errors = 0
+            if self.message_filter:
+                accepts = self.message_filter.accepts
+                count = len(frames)
+                frames = [frame for frame in frames if accepts(frame)]
+                self.filtered += count - len(frames)
+        elif framer.bad_data > bad_data:
+            self._invalid_packet()
+        if profiler is not None:
+            profiler.observe("parse", started)
+        timestamp_us = self.stampers[interface_id].timestamp_us # frames of a chunk share its receive time
+        return [(timestamp_us, frame) for frame in frames]
+
+    def _recv(self, interface_id: int) -> bytes:
+        """Read raw bytes available from the device"""
+        return self.devices[interface_id].recv(RECV_SIZE)
+
+    def _invalid_packet(self):
+        self.parse_errors += 1
+        if self.limit_invalid_packets > 0 and self.parse_errors > self.limit_invalid_packets:
+            raise RuntimeError("Too many invalid packets in a row")
+
+
+
+class Capture(AsyncCapture):
+    """Capture reads Mavlink messages from one or more devices and store them into a PCAPNG file (blocking)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.runner = Runner()
+        signal.signal(signal.SIGINT, self.stop)
+
+    def run(self, limit=-1, limit_invalid_packets=-1) -> int:
+        """Store Mavlink messages into a PCAPNG file until stopped"""
+        self.runner.run(self._run_and_report(limit, limit_invalid_packets))
+        return self.written
+
+    async def _run_and_report(self, limit: int, limit_invalid_packets: int):
+        async def report_stats():
+            last_bytes = [0] * len(self.devices)
+            async for stats in self.stats():
+                logger.info(f"captured {stats['captured']}, not-parsed: {stats['not_parsed']}, empty: {stats['empty']}, bad: {stats['bad']}, filtered: {stats['filtered']}, "
+                            f"buffered max: {stats['buffered_max']}/{stats['buffer_size']}, dropped: {stats['dropped']}")
+                if len(self.devices) > 1:
+                    logger.info(", ".join(f"{interface['device']}: {interface['packets']} packets, {interface['bytes'] - last_bytes[i]} B/s"
+                                          for i, interface in enumerate(stats['interfaces'])))
+                    last_bytes = [interface['bytes'] for interface in stats['interfaces']]
+        reporter = asyncio.ensure_future(report_stats())
+        try:
+            return await AsyncCapture.run(self, limit, limit_invalid_packets)
+        finally:
+            reporter.cancel()
 
     def stop(self, *args):
-        self.done = True
+        self.runner.stop()
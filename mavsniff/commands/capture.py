@@ -4,41 +4,138 @@ import logging
 from mavsniff.utils.log import logger
 from mavsniff.utils.mav import mavlink
 from mavsniff.capture import Capture
+from mavsniff.recorder import FlightRecorder, DEFAULT_RING_SIZE
+from mavsniff.utils import ring
+from mavsniff.utils.filter import MessageFilter
+from mavsniff.utils.segments import RotatingFile, COMPRESSIONS
+from mavsniff.utils.units import parse_size, parse_duration
+from mavsniff.utils.metrics import Metrics, start_reporters
+from mavsniff.utils.profiling import Profiler, MODES as PROFILE_MODES, DEFAULT_WINDOW as PROFILE_WINDOW
 
 
 as_pcapng = lambda f: f if "." in f else f + ".pcapng"
 
+
+def unit_parser(parse):
+    """Click callback converting an optional option value with a unit"""
+    def callback(ctx, param, value):
+        if value is None:
+            return None
+        try:
+            return parse(value)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+    return callback
+
+
+def parse_ring(value: str) -> tuple:
+    """Parse flight recorder window given as duration (120s, 5min, 1h) or size (64M) into (size, seconds)"""
+    unit = value.strip().lstrip("0123456789.").strip()
+    if unit.upper() == "M": # 64m would be either
+        raise ValueError(f"ambiguous unit in {value}; use min for minutes or MB for MiB")
+    if unit.upper() in ("S", "MIN", "H", "D"):
+        return DEFAULT_RING_SIZE, parse_duration(value)
+    return parse_size(value), None
+
+
 @click.command()
 @click.option("--file", "-f", required=True, help="pcap file to save the communication to")
-@click.option("--device", "-d", required=True, help="device URI (/dev/tty..., COMx on windows or udp://host:port, tcp://host:port))")
+@click.option("--device", "-d", required=True, multiple=True, help="device URI (/dev/tty..., COMx on windows or udp://host:port, tcp://host:port)); repeat to capture several devices at once")
 @click.option("--limit", "-l", default=-1, type=int, help="limit the number of read/written packets (default -1 unlimited)")
 @click.option("--verbose", "-v", is_flag=True, default=False, help="enable debug logging")
 @click.option("--mavlink-version", "-m", type=int, default=2, help="Set mavlink protocol version (options: 1,2; default: 2)")
 @click.option("--mavlink-dialect", "-n", help="Mavlink dialect (see pymavlink.dialects for possible values)")
 @click.option("--baud", "-b", type=int, help="Serial communication baud rate")
-def capture(device:str, file:str, limit:int, verbose:bool, mavlink_version:int, mavlink_dialect:str, **kwargs):
+@click.option("--raw", "-r", is_flag=True, default=False, help="store original frames without decoding messages (faster)")
+@click.option("--buffer-size", type=int, default=4096, show_default=True, help="number of packets buffered between reading and writing")
+@click.option("--overflow", type=click.Choice(ring.POLICIES), default=ring.BLOCK, show_default=True, help="what to do when the buffer is full")
+@click.option("--include", multiple=True, help="store only matching messages: msgid, message name, sysid=N or compid=N (repeatable, comma-separated)")
+@click.option("--exclude", multiple=True, help="drop matching messages: msgid, message name, sysid=N or compid=N (repeatable, comma-separated)")
+@click.option("--rotate-size", callback=unit_parser(parse_size), help="start a new file segment after this size (e.g. 512M)")
+@click.option("--rotate-interval", callback=unit_parser(parse_duration), help="start a new file segment after this time (e.g. 1h)")
+@click.option("--compress", type=click.Choice(tuple(COMPRESSIONS)), help="compress closed file segments in background")
+@click.option("--ring", callback=unit_parser(parse_ring), help="flight recorder: keep the last 120s (s/min/h/d) or 64MB (KB/MB/GB) in memory "
+              "and dump it into <file>-<time>.pcapng on SIGUSR1, trigger messages or exit")
+@click.option("--trigger-severity", type=int, default=3, show_default=True, help="dump on STATUSTEXT with this severity or worse (-1 disables)")
+@click.option("--status-trigger/--no-status-trigger", default=True, show_default=True, help="dump when HEARTBEAT system_status changes")
+@click.option("--metrics-port", type=int, help="serve Prometheus metrics at http://127.0.0.1:PORT/metrics")
+@click.option("--metrics-json", help="append metrics as JSON lines to this file every second (- for stdout)")
+@click.option("--profile", type=click.Choice(PROFILE_MODES), is_flag=False, flag_value="timers",
+              help="time every stage of the hot path (timers, the default) and also run cProfile or tracemalloc; report at exit")
+@click.option("--profile-window", type=float, default=PROFILE_WINDOW, show_default=True, help="seconds from the start profiled by cProfile or tracemalloc")
+@click.option("--profile-output", help="write the profiling report to this file too (cProfile statistics to FILE.prof)")
+def capture(device:tuple, file:str, limit:int, verbose:bool, mavlink_version:int, mavlink_dialect:str, raw:bool, buffer_size:int, overflow:str,
+            include:tuple, exclude:tuple, rotate_size:int, rotate_interval:float, compress:str, ring:tuple, trigger_severity:int,
+            status_trigger:bool, metrics_port:int, metrics_json:str, profile:str, profile_window:float, profile_output:str, **kwargs):
     """Capture mavlink communication from a serial device and store it into a pcapng file"""
     logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
 
-    pcapfile = None
+    if compress and not (rotate_size or rotate_interval):
+        logger.error("Compression needs --rotate-size or --rotate-interval")
+        return 1
+    if ring and (rotate_size or rotate_interval):
+        logger.error("Flight recorder (--ring) can not rotate files")
+        return 1
+
+    pcapfile = None # the flight recorder creates a file for every dump
     try:
-        pcapfile = open(as_pcapng(file), "wb")
+        if rotate_size or rotate_interval:
+            pcapfile = RotatingFile(as_pcapng(file), size=rotate_size, interval=rotate_interval, compression=compress)
+        elif not ring:
+            pcapfile = open(as_pcapng(file), "wb")
     except Exception as e:
         logger.error(f"Failed to open file {file}: {e}")
         return 1
 
-    mavconn = None
+    mavconns = []
     try:
-        mavconn = mavlink(device, input=True, version=mavlink_version, dialect=mavlink_dialect, **kwargs)
+        for uri in device:
+            mavconns.append(mavlink(uri, input=True, version=mavlink_version, dialect=mavlink_dialect, **kwargs))
     except Exception as e:
-        file.close()
-        logger.error(f"Failed to open file {file}: {e}")
+        if pcapfile:
+            pcapfile.close()
+        for mavconn in mavconns:
+            mavconn.close()
+        logger.error(f"Failed to open device {uri}: {e}")
         return 1
 
+    message_filter = None
+    if include or exclude:
+        try:
+            message_filter = MessageFilter(include, exclude) # after opening devices so the dialect is loaded
+        except ValueError as e:
+            if pcapfile:
+                pcapfile.close()
+            for mavconn in mavconns:
+                mavconn.close()
+            logger.error(f"Invalid filter: {e}")
+            return 1
+
+    metrics, reporters = None, []
+    profiler = Profiler(profile, profile_window) if profile else None
     try:
-        captured = Capture(device=mavconn, file=pcapfile).run(limit=limit)
+        if metrics_port is not None or metrics_json:
+            metrics = Metrics()
+            reporters = start_reporters(metrics, metrics_port, metrics_json)
+        if ring:
+            ring_size, window = ring
+            captured = FlightRecorder(device=mavconns, path=as_pcapng(file), ring_size=ring_size, window=window, severity=trigger_severity,
+                                      status_change=status_trigger, buffer_size=buffer_size, overflow=overflow,
+                                      message_filter=message_filter, metrics=metrics, profiler=profiler).run(limit=limit)
+        else:
+            captured = Capture(device=mavconns, file=pcapfile, raw=raw, buffer_size=buffer_size, overflow=overflow,
+                               message_filter=message_filter, metrics=metrics, profiler=profiler).run(limit=limit)
         logger.info(f"captured {captured} valid MAVLink packets")
         return 0
+    except OSError as e:
+        logger.error(f"Failed to start metrics reporting: {e}")
+        return 1
     finally:
-        pcapfile.close()
-        mavconn.close()
+        for reporter in reporters:
+            reporter.stop()
+        if profiler is not None and profiler.started is not None:
+            profiler.save(profile_output)
+        if pcapfile:
+            pcapfile.close()
+        for mavconn in mavconns:
+            mavconn.close()
@@ -0,0 +1,35 @@
+import click
+import logging
+
+from mavsniff.utils.log import logger
+from mavsniff.export import export as export_recording, parse_messages, FORMATS
+
+as_pcapng = lambda f: f if "." in f else f + ".pcapng"
+
+
+@click.command()
+@click.argument("file")
+@click.option("--format", "fmt", type=click.Choice(FORMATS), default="npz", show_default=True, help="NumPy arrays or CSV tables")
+@click.option("--messages", "-m", multiple=True, help="message types to export (repeatable, comma-separated; default: all)")
+@click.option("--output", "-o", help="stem of the output files (default: the recording's name)")
+@click.option("--jobs", "-j", type=int, help="number of worker processes (default: all CPUs)")
+@click.option("--verbose", "-v", is_flag=True, default=False, help="enable debug logging")
+def export(file, fmt, messages, output, jobs, verbose) -> int:
+    """Export decoded messages of a recording as columns per field (npz) or tables per message type (csv)"""
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
+    if jobs is not None and jobs < 1:
+        logger.error("Number of jobs must be positive")
+        return 1
+    try:
+        msgids = parse_messages(messages)
+    except ValueError as e:
+        logger.error(f"Invalid message: {e}")
+        return 1
+    path = as_pcapng(file)
+    stem = output or (path[:-len(".pcapng")] if path.endswith(".pcapng") else path)
+    try:
+        export_recording(path, stem, fmt, msgids, jobs)
+    except OSError as e:
+        logger.error(f"Failed to export {path}: {e}")
+        return 1
+    return 0
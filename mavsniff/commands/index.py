@@ -0,0 +1,26 @@
+import click
+import logging
+
+from mavsniff.utils.log import logger
+from mavsniff.index import Index, INDEX_SUFFIX
+
+as_pcapng = lambda f: f if "." in f else f + ".pcapng"
+
+@click.command()
+@click.option("--file", "-f", required=True, help="pcapng file to index")
+@click.option("--force", is_flag=True, default=False, help="rebuild the index even if it is up to date")
+@click.option("--verbose", "-v", is_flag=True, default=False, help="enable debug logging")
+def index(file, force, verbose) -> int:
+    """Build a sidecar index of a pcapng file for fast seeking during replay"""
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
+    path = as_pcapng(file)
+    try:
+        idx = None if force else Index.load(path)
+        if idx is None:
+            idx = Index.build(path)
+            idx.save(path)
+    except Exception as e:
+        logger.error(f"Failed to index file {path}: {e}")
+        return 1
+    logger.info(f"indexed {len(idx)} packets into {path + INDEX_SUFFIX}")
+    return 0
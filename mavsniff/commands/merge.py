@@ -0,0 +1,22 @@
+import click
+import logging
+
+from mavsniff.utils.log import logger
+from mavsniff.edit import merge as merge_recordings
+
+as_pcapng = lambda f: f if "." in f else f + ".pcapng"
+
+
+@click.command()
+@click.argument("files", nargs=-1, required=True)
+@click.option("--output", "-o", required=True, help="pcapng file to write")
+@click.option("--verbose", "-v", is_flag=True, default=False, help="enable debug logging")
+def merge(files, output, verbose) -> int:
+    """Merge pcapng recordings (or compressed segments) into one ordered by time, each source as its own interface"""
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
+    try:
+        merge_recordings([as_pcapng(file) for file in files], as_pcapng(output))
+    except OSError as e:
+        logger.error(f"Failed to merge: {e}")
+        return 1
+    return 0
@@ -0,0 +1,57 @@
+import click
+import logging
+
+from mavsniff.utils.log import logger
+from mavsniff.utils.mav import mavlink
+from mavsniff.proxy import Proxy
+from mavsniff.utils.metrics import Metrics, start_reporters
+
+as_pcapng = lambda f: f if "." in f else f + ".pcapng"
+
+
+@click.command()
+@click.option("--upstream", "-u", required=True, help="vehicle side device URI (/dev/tty..., COMx on windows or udp://host:port, tcp://host:port)")
+@click.option("--downstream", "-d", required=True, help="ground station side device URI (e.g. udp://0.0.0.0:14550 to accept a GCS)")
+@click.option("--file", "-f", required=True, help="pcap file to save both directions of the communication to")
+@click.option("--baud", "-b", type=int, help="Serial communication baud rate")
+@click.option("--limit", "-l", default=-1, type=int, help="limit the number of captured packets (default -1 unlimited)")
+@click.option("--verbose", "-v", is_flag=True, default=False, help="enable debug logging")
+@click.option("--metrics-port", type=int, help="serve Prometheus metrics at http://127.0.0.1:PORT/metrics")
+@click.option("--metrics-json", help="append metrics as JSON lines to this file every second (- for stdout)")
+def proxy(upstream, downstream, file, baud, limit, verbose, metrics_port, metrics_json) -> int:
+    """Forward MAVLink bytes between a vehicle and a ground station and capture both directions into a pcapng file"""
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
+    try:
+        pcapfile = open(as_pcapng(file), "wb")
+    except Exception as e:
+        logger.error(f"Failed to open file {file}: {e}")
+        return 1
+
+    mavconns = []
+    try:
+        for uri in (upstream, downstream):
+            mavconns.append(mavlink(uri, input=True, baud=baud))
+    except Exception as e:
+        pcapfile.close()
+        for mavconn in mavconns:
+            mavconn.close()
+        logger.error(f"Failed to open device {uri}: {e}")
+        return 1
+
+    metrics, reporters = None, []
+    try:
+        if metrics_port is not None or metrics_json:
+            metrics = Metrics()
+            reporters = start_reporters(metrics, metrics_port, metrics_json)
+        captured = Proxy(mavconns[0], mavconns[1], pcapfile, metrics=metrics).run(limit=limit)
+        logger.info(f"captured {captured} valid MAVLink packets")
+        return 0
+    except OSError as e:
+        logger.error(f"Failed to start metrics reporting: {e}")
+        return 1
+    finally:
+        for reporter in reporters:
+            reporter.stop()
+        pcapfile.close()
+        for mavconn in mavconns:
+            mavconn.close()
@@ -1,40 +1,116 @@
 import click
 import logging
+import os
 
 from mavsniff.utils.log import logger
 from mavsniff.utils.mav import mavlink
-from mavsniff.replay import Replay
+from mavsniff.replay import Replay, DEFAULT_COALESCE
+from mavsniff.utils.timing import DEFAULT_SPIN
+from mavsniff.utils.filter import MessageFilter
+from mavsniff.utils.segments import segment_paths
+from mavsniff.utils.metrics import Metrics, start_reporters
+from mavsniff.utils.profiling import Profiler, MODES as PROFILE_MODES, DEFAULT_WINDOW as PROFILE_WINDOW
 
 as_pcapng = lambda f: f if "." in f else f + ".pcapng"
 
+
+def as_seconds(ctx, param, value):
+    """Parse time offset given in seconds or as [HH:]MM:SS"""
+    if value is None:
+        return None
+    try:
+        seconds = 0.0
+        for part in value.split(":"):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    except ValueError:
+        raise click.BadParameter(f"{value} is neither seconds nor [HH:]MM:SS")
+
+
 @click.command()
-@click.option("--file", "-f", required=True, help="pcap file to read from")
-@click.option("--device", "-d", required=True, help="device URI (/dev/tty..., COMx on windows or udp://host:port, tcp://host:port)")
+@click.option("--file", "-f", required=True, help="pcap file to read from; a directory or glob pattern replays rotated (compressed) segments in order")
+@click.option("--device", "-d", required=True, multiple=True, help="device URI (/dev/tty..., COMx on windows or udp://host:port, tcp://host:port); repeat to replay to several devices at once")
 @click.option("--limit", "-l", default=-1, type=int, help="limit the number of read/written packets (default -1 unlimited)")
 @click.option("--verbose", "-v", is_flag=True, default=False, help="enable debug logging")
-def replay(file, device, verbose, limit) -> int:
+@click.option("--speed", "-s", type=float, default=1.0, show_default=True, help="replay speed multiplier (e.g. 0.5 or 10)")
+@click.option("--max-rate", is_flag=True, default=False, help="replay as fast as possible ignoring timestamps")
+@click.option("--spin-window", type=float, default=DEFAULT_SPIN, show_default=True, help="seconds of busy-waiting before each packet for precise timing")
+@click.option("--coalesce", type=float, default=DEFAULT_COALESCE, show_default=True, help="seconds within which due packets are written at once")
+@click.option("--baud", "-b", type=int, help="Serial communication baud rate; output is paced to the link capacity")
+@click.option("--start", callback=as_seconds, help="replay from this time of the recording (seconds or [HH:]MM:SS)")
+@click.option("--end", callback=as_seconds, help="replay until this time of the recording (seconds or [HH:]MM:SS)")
+@click.option("--include", multiple=True, help="replay only matching messages: msgid, message name, sysid=N or compid=N (repeatable, comma-separated)")
+@click.option("--exclude", multiple=True, help="drop matching messages: msgid, message name, sysid=N or compid=N (repeatable, comma-separated)")
+@click.option("--metrics-port", type=int, help="serve Prometheus metrics at http://127.0.0.1:PORT/metrics")
+@click.option("--metrics-json", help="append metrics as JSON lines to this file every second (- for stdout)")
+@click.option("--profile", type=click.Choice(PROFILE_MODES), is_flag=False, flag_value="timers",
+              help="time every stage of the hot path (timers, the default) and also run cProfile or tracemalloc; report at exit")
+@click.option("--profile-window", type=float, default=PROFILE_WINDOW, show_default=True, help="seconds from the start profiled by cProfile or tracemalloc")
+@click.option("--profile-output", help="write the profiling report to this file too (cProfile statistics to FILE.prof)")
+def replay(file, device, verbose, limit, speed, max_rate, spin_window, coalesce, baud, start, end, include, exclude, metrics_port, metrics_json,
+           profile, profile_window, profile_output) -> int:
     """Replay mavlink communication from a pcapng file to a (serial emulating) device"""
     logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
+    if speed <= 0:
+        logger.error("Speed must be positive (use --max-rate to replay as fast as possible)")
+        return 1
+    if start is not None and end is not None and end < start:
+        logger.error("End of the replayed window must not precede its start")
+        return 1
+    message_filter = None
+    if include or exclude:
+        try:
+            message_filter = MessageFilter(include, exclude)
+        except ValueError as e:
+            logger.error(f"Invalid filter: {e}")
+            return 1
 
     pcapfile = None
-    try:
-        pcapfile = open(as_pcapng(file), "rb")
-    except Exception as e:
-        logger.error(f"Failed to open file {file}: {e}")
-        return 1
+    segments = None
+    if os.path.isdir(file) or any(c in file for c in "*?["):
+        segments = segment_paths(file)
+        if not segments:
+            logger.error(f"No recording segments found in {file}")
+            return 1
+        logger.info(f"replaying {len(segments)} segments")
+    else:
+        try:
+            pcapfile = open(as_pcapng(file), "rb")
+        except Exception as e:
+            logger.error(f"Failed to open file {file}: {e}")
+            return 1
 
-    mavconn = None
+    mavconns = []
     try:
-        mavconn = mavlink(device, input=True)
+        for uri in device:
+            mavconns.append(mavlink(uri, input=True, baud=baud))
     except Exception as e:
-        pcapfile.close()
-        logger.error(f"Failed to open file {file}: {e}")
+        if pcapfile:
+            pcapfile.close()
+        for mavconn in mavconns:
+            mavconn.close()
+        logger.error(f"Failed to open device {uri}: {e}")
         return 1
 
+    metrics, reporters = None, []
+    profiler = Profiler(profile, profile_window) if profile else None
     try:
-        replayed = Replay(file=pcapfile, device=mavconn).run(limit=limit)
+        if metrics_port is not None or metrics_json:
+            metrics = Metrics()
+            reporters = start_reporters(metrics, metrics_port, metrics_json)
+        replayed = Replay(file=segments or pcapfile, device=mavconns, speed=0 if max_rate else speed, spin=spin_window, coalesce=coalesce, baud=baud,
+                          start=start or 0.0, end=end, message_filter=message_filter, metrics=metrics, profiler=profiler).run(limit=limit)
         logger.info(f"replayed {replayed} valid MAVLink packets")
         return 0
+    except OSError as e:
+        logger.error(f"Failed to start metrics reporting: {e}")
+        return 1
     finally:
-        pcapfile.close()
-        mavconn.close()
\ No newline at end of file
+        for reporter in reporters:
+            reporter.stop()
+        if profiler is not None and profiler.started is not None:
+            profiler.save(profile_output)
+        if pcapfile:
+            pcapfile.close()
+        for mavconn in mavconns:
+            mavconn.close()
\ No newline at end of file
@@ -0,0 +1,30 @@
+import click
+import logging
+
+from mavsniff.utils.log import logger
+from mavsniff.commands.replay import as_seconds
+from mavsniff.edit import slice_recording
+
+as_pcapng = lambda f: f if "." in f else f + ".pcapng"
+
+
+@click.command("slice")
+@click.argument("file")
+@click.option("--output", "-o", required=True, help="pcapng file to write")
+@click.option("--start", callback=as_seconds, help="copy from this time of the recording (seconds or [HH:]MM:SS)")
+@click.option("--end", callback=as_seconds, help="copy until this time of the recording (seconds or [HH:]MM:SS)")
+@click.option("--skip", type=int, default=0, help="skip this many packets (after --start)")
+@click.option("--count", "-c", type=int, help="copy at most this many packets")
+@click.option("--verbose", "-v", is_flag=True, default=False, help="enable debug logging")
+def slice_(file, output, start, end, skip, count, verbose) -> int:
+    """Cut a part of a pcapng recording by time and/or packet count"""
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
+    if start is not None and end is not None and end < start:
+        logger.error("End of the slice must not precede its start")
+        return 1
+    try:
+        slice_recording(as_pcapng(file), as_pcapng(output), start, end, skip, count)
+    except OSError as e:
+        logger.error(f"Failed to slice {file}: {e}")
+        return 1
+    return 0
@@ -0,0 +1,25 @@
+import click
+import logging
+
+from mavsniff.utils.log import logger
+from mavsniff.edit import split as split_recording, SPLIT_BY
+
+as_pcapng = lambda f: f if "." in f else f + ".pcapng"
+
+
+@click.command()
+@click.argument("file")
+@click.option("--by", type=click.Choice(SPLIT_BY), default="sysid", show_default=True, help="split by MAVLink system ID or by interface")
+@click.option("--output", "-o", help="stem of the output files (default: the recording's name)")
+@click.option("--verbose", "-v", is_flag=True, default=False, help="enable debug logging")
+def split(file, by, output, verbose) -> int:
+    """Split a pcapng recording into files per system ID or interface"""
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
+    path = as_pcapng(file)
+    stem = output or (path[:-len(".pcapng")] if path.endswith(".pcapng") else path)
+    try:
+        split_recording(path, stem, by)
+    except OSError as e:
+        logger.error(f"Failed to split {path}: {e}")
+        return 1
+    return 0
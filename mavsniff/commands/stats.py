@@ -0,0 +1,73 @@
+import click
+import json
+import logging
+
+from mavsniff.utils.log import logger
+from mavsniff.analysis import analyze, parse_fields
+
+as_pcapng = lambda f: f if "." in f else f + ".pcapng"
+
+
+@click.command()
+@click.argument("file")
+@click.option("--jobs", "-j", type=int, help="number of worker processes (default: all CPUs)")
+@click.option("--json", "as_json", is_flag=True, default=False, help="print the statistics as JSON")
+@click.option("--field", multiple=True, help="decode and summarize a message field NAME.field (repeatable, comma-separated)")
+@click.option("--bin", "bin_seconds", type=float, default=1.0, show_default=True, help="seconds per bin of link utilisation")
+@click.option("--verbose", "-v", is_flag=True, default=False, help="enable debug logging")
+def stats(file, jobs, as_json, field, bin_seconds, verbose) -> int:
+    """Message rates, sequence gaps, inter-arrival times and link utilisation of a pcapng file"""
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)
+    if bin_seconds <= 0 or (jobs is not None and jobs < 1):
+        logger.error("Bin and number of jobs must be positive")
+        return 1
+    try:
+        fields = parse_fields(field)
+    except ValueError as e:
+        logger.error(f"Invalid field: {e}")
+        return 1
+    path = as_pcapng(file)
+    try:
+        summary = analyze(path, jobs, bin_seconds, fields).summary()
+    except OSError as e:
+        logger.error(f"Failed to read {path}: {e}")
+        return 1
+    if as_json:
+        click.echo(json.dumps(summary, indent=2))
+    else:
+        print_table(summary)
+    return 0
+
+
+def _median_interval(intervals: dict) -> str:
+    """Upper bound of the bucket holding the median inter-arrival time"""
+    if not intervals or not intervals["count"]:
+        return "-"
+    seen = 0
+    for bound, count in intervals["buckets"].items():
+        seen += count
+        if seen * 2 >= intervals["count"]:
+            return f"<{bound * 1000:g}ms" if bound != float("inf") else "long"
+    return "-"
+
+
+def print_table(summary: dict):
+    click.echo(f"{summary['packets']} packets ({summary['other']} without MAVLink), "
+               f"{summary['bytes']} B of MAVLink in {summary['duration']:.1f}s")
+    click.echo(f"\n{'msgid':>7} {'name':<32} {'packets':>9} {'bytes':>10} {'rate/s':>9} {'interval':>9}")
+    for message in summary["messages"]:
+        rate = f"{message['packets_per_s']:.2f}" if message["packets_per_s"] is not None else "-"
+        click.echo(f"{message['msgid']:>7} {message['name']:<32} {message['packets']:>9} {message['bytes']:>10} "
+                   f"{rate:>9} {_median_interval(message['intervals']):>9}")
+    click.echo(f"\n{'sysid':>5} {'compid':>6} {'received':>9} {'lost':>7} {'loss':>7}")
+    for component in summary["components"]:
+        click.echo(f"{component['sysid']:>5} {component['compid']:>6} {component['received']:>9} "
+                   f"{component['lost']:>7} {component['loss'] * 100:>6.2f}%")
+    for link in summary["link"]:
+        utilisation = f", peak {link['peak_utilisation'] * 100:.1f}% of {link['speed']} bit/s" if link["peak_utilisation"] is not None else ""
+        click.echo(f"\ninterface {link['interface']}: mean {link['mean_bytes_per_s']:.0f} B/s, "
+                   f"peak {link['peak_bytes_per_s']:.0f} B/s{utilisation}")
+    if summary["fields"]:
+        click.echo(f"\n{'field':<40} {'count':>9} {'min':>12} {'max':>12} {'mean':>12}")
+        for field in summary["fields"]:
+            click.echo(f"{field['field']:<40} {field['count']:>9} {field['min']:>12.6g} {field['max']:>12.6g} {field['mean']:>12.6g}")
@@ -1,5 +1,13 @@
 import click
+import concurrent.futures
+import contextlib
+import hashlib
+import importlib.util
+import io
+import os
 import os.path
+import re
+import shutil
 import sys
 import pymavlink
 
@@ -19,8 +27,80 @@ mavlink_proto && not icmp
 WIN_PATH = "%APPDATA%\\Wireshark\\plugins"
 LIN_PATH = "~/.local/lib/wireshark/plugins"
 OSX_PATH = "%APPDIR%/Contents/PlugIns/wireshark"
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mavsniff", "wsplugin") # generated dissectors by content hash
+
+# newer pymavlink dropped MAVLink 0.9
+VERSIONS = tuple(getattr(mavparse, name) for name in ("PROTOCOL_0_9", "PROTOCOL_1_0", "PROTOCOL_2_0") if hasattr(mavparse, name))
+INCLUDE = re.compile(rb"<include>\s*(.*?)\s*</include>")
+
+
+def definition(dialect: str, version: str) -> Path:
+    """XML definition of a dialect - shipped next to the generated dialects by pip packages, in message_definitions by source checkouts"""
+    package = "v20" if version == mavparse.PROTOCOL_2_0 else "v10"
+    for path in (Path(pymavlink.__file__).parent / "dialects" / package / f"{dialect}.xml",
+                 Path(mavgen.__file__).parent.parent / "message_definitions" / "v1.0" / f"{dialect}.xml"):
+        if path.exists():
+            return path.resolve()
+    raise click.ClickException(f"Unknown dialect {dialect}")
+
+
+def definitions(roots: list) -> list:
+    """XML files of dialects with all files they include"""
+    files, pending = [], list(roots)
+    while pending:
+        path = pending.pop(0)
+        if path in files:
+            continue
+        files.append(path)
+        pending += [(path.parent / include.decode()).resolve() for include in INCLUDE.findall(path.read_bytes())]
+    return files
+
+
+def cache_key(dialects: tuple, version: str, files: list) -> str:
+    """Hash of everything the generated dissector depends on"""
+    key = hashlib.sha256(f"{pymavlink.__version__}\0{version}\0{','.join(dialects)}\0".encode())
+    for path in sorted(files, key=lambda path: path.name):
+        key.update(path.name.encode() + b"\0" + hashlib.sha256(path.read_bytes()).digest())
+    return key.hexdigest()
+
+
+def validate(path: str) -> str:
+    """Check an XML definition against the MAVLink schema (in a worker process); return the error or None"""
+    from lxml import etree
+    with open(mavgen.schemaFile, "rb") as file:
+        schema = etree.parse(file)
+    for element in schema.iterfind('xs:attribute[@name="units"]', schema.getroot().nsmap):
+        element.set("type", "xs:string") # units are not checked strictly
+    try:
+        etree.XMLSchema(schema).assertValid(etree.parse(path))
+    except etree.DocumentInvalid as e:
+        return f"{path}: {e.error_log}"
+    return None
+
+
+def generate(roots: list, files: list, version: str, output: Path):
+    """
+    Generate the dissector of dialects into output.
+
+    The definitions are validated against the schema by worker processes in parallel while mavgen
+    parses them and generates the dissector here - it is a single file built from all definitions
+    and parsing takes a fraction of generating it. Without lxml nothing gets validated (mavgen
+    does not validate either) so no workers are started.
+    """
+    log = io.StringIO()
+    with contextlib.ExitStack() as stack:
+        validations = ()
+        if importlib.util.find_spec("lxml") is not None:
+            pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=min(len(files), os.cpu_count() or 1)))
+            validations = pool.map(validate, [str(path) for path in files])
+        with contextlib.redirect_stdout(log):
+            generated = mavgen.mavgen(mavgen.Opts(str(output), wire_protocol=version, language="wlua", validate=False),
+                                      [str(path) for path in roots])
+        errors = [error for error in validations if error]
+    if errors or not generated or not output.exists():
+        click.echo(log.getvalue() + "\n".join(errors), err=True)
+        raise click.ClickException(f"Failed to generate {output.name}")
 
-VERSIONS = (mavparse.PROTOCOL_0_9, mavparse.PROTOCOL_1_0, mavparse.PROTOCOL_2_0)
 
 @click.command()
 @click.option('--wireshark-plugin-dir', default=None, help="Wireshark plugin directory")
@@ -46,7 +126,7 @@ def wsplugin(dialects, version, wireshark_plugin_dir, override, delete) -> int:
         elif sys.platform == "darwin":
             wireshark_plugin_dir = os.path.expandvars(OSX_PATH)
         else:
-            wireshark_plugin_dir = os.path.expandvars(LIN_PATH)
+            wireshark_plugin_dir = os.path.expanduser(LIN_PATH)
     click.echo(f"[INFO] Using wireshark plugin directory: {wireshark_plugin_dir}")
 
     wireshark_plugin_path = Path(wireshark_plugin_dir)
@@ -76,19 +156,30 @@ def wsplugin(dialects, version, wireshark_plugin_dir, override, delete) -> int:
         click.echo(f"[ERROR] Use --override to overwrite it")
         return 1
 
-    opts = mavgen.Opts(plugin_name, wire_protocol=version, language="wlua")
-    mavgen.mavgen(opts, (
-        Path(mavgen.__file__).parent / f"../message_definitions/v1.0/{dialect}.xml" for dialect in dialects
-    ))
-
-    if not plugin_file.exists():
-        click.echo(f"[ERROR] Failed to generate {plugin_file}")
-        return 1
-
-    Path(plugin_name).replace(plugin_file)
+    roots = list(dict.fromkeys(definition(dialect, version) for dialect in dialects))
+    files = definitions(roots)
+    key = cache_key(dialects, version, files)
+    cached = Path(CACHE_DIR) / f"{key}.lua"
+    if cached.exists():
+        click.echo(f"[INFO] Using cached {cached}")
+    else:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        partial = cached.with_name(f"{key}.{os.getpid()}.lua")
+        try:
+            generate(roots, files, version, partial)
+            os.replace(partial, cached)
+        finally:
+            if partial.exists():
+                partial.unlink()
+
+    if plugin_file.exists() and plugin_file.read_bytes() == cached.read_bytes():
+        click.echo(f"[INFO] {plugin_file} is up to date")
+        return 0
+    shutil.copyfile(cached, plugin_file)
     version_file.write_text(
 f"""Pymavlink version: {pymavlink.__version__}
 Built at: {datetime.now()}
 Dialects: {dialects}
+Cache key: {key}
 """)
-    click.echo(f"Created {plugin_file}")
\ No newline at end of file
+    click.echo(f"Created {plugin_file}")
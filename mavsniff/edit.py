@@ -0,0 +1,167 @@
+import contextlib
+import heapq
+import itertools
+import os
+
+from mavsniff.index import Index
+from mavsniff.utils.decap import Decapsulator
+from mavsniff.utils.framer import frame_ids
+from mavsniff.utils.log import logger
+from mavsniff.utils.pcap import PacketEncoder, open_reader, section_header
+from mavsniff.utils.segments import open_segment
+
+WRITE_BUFFER = 1 << 20 # bytes buffered by every output file
+SPLIT_BY = ("sysid", "interface")
+OTHER = "other" # split key of packets without a MAVLink frame
+
+
+class Source:
+    """
+    Packets of one recording (possibly a compressed segment) with the interfaces they came from.
+
+    Interfaces are known once the blocks preceding the first packet are read - which happens when
+    the source is opened. Packets of interfaces described later in the file are attributed to the
+    first interface.
+    """
+
+    def __init__(self, path: str, start: int = 0):
+        self.path = path
+        self.file = open_segment(path)
+        self.reader = open_reader(self.file)
+        records = self.reader.records(start)
+        first = next(records, None)
+        self.records = records if first is None else itertools.chain((first,), records)
+        self.interfaces = list(self.reader.interfaces)
+
+    def close(self):
+        self.reader.close()
+        self.file.close()
+
+    def interface_options(self) -> list:
+        """IDB options of the interfaces for `section_header` (a single default one if there are none)"""
+        name = os.path.basename(self.path)
+        if not self.interfaces:
+            return [{"link_type": 0, "if_name": name, "if_description": self.path}]
+        return [{
+            "link_type": interface.link_type,
+            "if_name": interface.name or (name if len(self.interfaces) == 1 else f"{name}#{interface_id}"),
+            "if_description": f"{self.path}: {interface.description or interface_id}",
+            "if_txspeed": interface.speed,
+            "if_rxspeed": interface.speed,
+        } for interface_id, interface in enumerate(self.interfaces)]
+
+    def packets(self, base: int = 0):
+        """Yield `(timestamp, interface_id, payload)` with interface IDs shifted by base"""
+        for _, interface_id, timestamp, data in self.records:
+            yield timestamp, base + self.interface(interface_id), data
+
+    def interface(self, interface_id: int) -> int:
+        return interface_id if interface_id < len(self.interfaces) else 0
+
+
+def _timestamp_us(timestamp: float) -> int:
+    return int(round(timestamp * 1e6))
+
+
+def merge(paths: list, output: str) -> int:
+    """
+    Merge recordings into one ordered by timestamps; return the number of packets.
+
+    Every interface of every source becomes an interface of the output. Sources are read
+    simultaneously with a k-way heap merge so memory does not grow with their size.
+    """
+    encoder = PacketEncoder()
+    written = 0
+    with contextlib.ExitStack() as stack:
+        sources = []
+        for path in paths:
+            sources.append(Source(path))
+            stack.callback(sources[-1].close)
+        interfaces, streams = [], []
+        for source in sources:
+            base = len(interfaces)
+            interfaces += source.interface_options()
+            streams.append(source.packets(base))
+        with open(output, "wb", buffering=WRITE_BUFFER) as file:
+            file.write(section_header(interfaces))
+            for timestamp, interface_id, data in heapq.merge(*streams, key=lambda packet: packet[0]):
+                file.write(encoder.encode_packet(data, _timestamp_us(timestamp), interface_id))
+                written += 1
+    logger.info(f"merged {written} packets of {len(paths)} recordings into {output}")
+    return written
+
+
+def slice_recording(path: str, output: str, start: float = None, end: float = None, skip: int = 0, count: int = None) -> int:
+    """
+    Copy packets within [start, end] seconds from the first packet, skipping `skip` of them and
+    copying at most `count`; return the number of packets.
+
+    The start is found by the sidecar index when there is an up-to-date one.
+    """
+    offset, first_ts = 0, None
+    if start:
+        index = Index.load(path)
+        if index is not None and len(index):
+            first_ts = index.timestamps[0]
+            row = index.seek(first_ts + start)
+            offset = index.offsets[row] if row < len(index) else index.size
+    encoder = PacketEncoder()
+    written = 0
+    source = Source(path, offset)
+    try:
+        with open(output, "wb", buffering=WRITE_BUFFER) as file:
+            file.write(section_header(source.interface_options()))
+            for _, interface_id, timestamp, data in source.records:
+                if first_ts is None:
+                    first_ts = timestamp
+                if start and timestamp < first_ts + start:
+                    continue
+                if end is not None and timestamp > first_ts + end:
+                    break
+                if skip:
+                    skip -= 1
+                    continue
+                if count is not None and written >= count:
+                    break
+                file.write(encoder.encode_packet(data, _timestamp_us(timestamp), source.interface(interface_id)))
+                written += 1
+    finally:
+        source.close()
+    logger.info(f"sliced {written} packets into {output}")
+    return written
+
+
+def split(path: str, stem: str, by: str = "sysid") -> dict:
+    """
+    Split a recording into `<stem>-<by><key>.pcapng` files by MAVLink system ID or interface; return
+    {key: path}. Packets without a MAVLink frame go to `<stem>-other.pcapng` when splitting by sysid.
+
+    Output files are opened as their first packet comes so memory does not depend on the size of
+    the recording (only on the number of outputs).
+    """
+    if by not in SPLIT_BY:
+        raise ValueError(f"unknown split {by}; choices: {SPLIT_BY}")
+    encoder = PacketEncoder()
+    paths = {}
+    with contextlib.ExitStack() as stack:
+        source = Source(path)
+        stack.callback(source.close)
+        interfaces = source.interface_options()
+        decapsulator = Decapsulator(source.reader)
+        files = {}
+        for _, interface_id, timestamp, data in source.records:
+            interface_id = source.interface(interface_id)
+            if by == "interface":
+                key = interface_id
+            else:
+                frames = decapsulator.frames(interface_id, data) if data else None
+                ids = frame_ids(frames[0]) if frames else None
+                key = ids[1] if ids else OTHER
+            file = files.get(key)
+            if file is None:
+                paths[key] = f"{stem}-{by}{key}.pcapng" if key != OTHER else f"{stem}-{OTHER}.pcapng"
+                file = files[key] = stack.enter_context(open(paths[key], "wb", buffering=WRITE_BUFFER))
+                file.write(section_header([interfaces[interface_id]] if by == "interface" else interfaces))
+            file.write(encoder.encode_packet(data, _timestamp_us(timestamp), 0 if by == "interface" else interface_id))
+    logger.info(f"split {path} into {len(paths)} files")
+    return paths
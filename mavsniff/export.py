@@ -0,0 +1,241 @@
+import concurrent.futures
+import csv
+import os
+import re
+import shutil
+import struct
+import tempfile
+import zipfile
+
+from pymavlink import mavutil
+
+from mavsniff.analysis import split_chunks
+from mavsniff.utils.decap import Decapsulator
+from mavsniff.utils.framer import MAGIC_V1, MAGIC_V2, HEADER_LEN_V1, HEADER_LEN_V2, _crc_function
+from mavsniff.utils.log import logger
+from mavsniff.utils.pcap import CaptureReader, open_reader
+
+FORMATS = ("npz", "csv")
+BATCH = 4096 # frames of a message type decoded and written at once
+# struct codes of MAVLink fields -> NumPy dtypes (MAVLink payloads are little-endian)
+DTYPES = {"b": "|i1", "B": "|u1", "h": "<i2", "H": "<u2", "i": "<i4", "I": "<u4", "q": "<i8", "Q": "<u8",
+          "f": "<f4", "d": "<f8", "c": "|S1"}
+# underscored so they never clash with fields (FOLLOW_TARGET and HIGH_LATENCY2 have a `timestamp`)
+HEADER_COLUMNS = (("_timestamp", "<f8", ()), ("_sysid", "|u1", ()), ("_compid", "|u1", ()))
+
+
+def parse_messages(specs, dialect=None) -> set:
+    """Parse comma-separated message names into a set of message IDs (None for all); raise ValueError on unknown ones"""
+    dialect = dialect or mavutil.mavlink
+    names = {msgtype.msgname: msgid for msgid, msgtype in dialect.mavlink_map.items()}
+    msgids = set()
+    for spec in specs or ():
+        for name in spec.split(","):
+            if not name.strip():
+                continue
+            msgid = names.get(name.strip().upper())
+            if msgid is None:
+                raise ValueError(f"unknown message {name.strip()}")
+            msgids.add(msgid)
+    return msgids or None
+
+
+class Layout:
+    """
+    Columns of a message type and where they are in its (zero-padded) payload.
+
+    Fields are ordered as declared in the dialect, not as sent. Char arrays are a single string
+    column, other arrays a column with a second dimension.
+    """
+
+    def __init__(self, msgtype):
+        self.name = msgtype.msgname
+        self.crc_extra = msgtype.crc_extra
+        self.unpacker = msgtype.unpacker
+        self.size = msgtype.unpacker.size
+        items = re.findall(r"(\d*)([a-zA-Z])", self.unpacker.format.lstrip("<"))
+        wire = {} # field -> (offset, size, dtype, shape, index in the unpacked tuple)
+        offset = index = 0
+        for field, length, (count, code) in zip(msgtype.ordered_fieldnames, msgtype.array_lengths, items):
+            size = struct.calcsize(f"<{count}{code}")
+            values = 1 if code == "s" else int(count or 1)
+            dtype = f"|S{count or 1}" if code == "s" else DTYPES[code]
+            wire[field] = (offset, size, dtype, (length,) if length and code != "s" else (), index, values)
+            offset += size
+            index += values
+        self.fields = [(field,) + wire[field] for field in msgtype.fieldnames]
+        self.columns = list(HEADER_COLUMNS) + [(field, dtype, shape) for field, _, _, dtype, shape, _, _ in self.fields]
+
+    def csv_header(self) -> list:
+        header = [name for name, _, _ in HEADER_COLUMNS]
+        for field, _, _, _, shape, _, _ in self.fields:
+            header += [f"{field}[{i}]" for i in range(shape[0])] if shape else [field]
+        return header
+
+    def csv_rows(self, timestamps, sysids, compids, payloads):
+        """Rows of decoded values; strings lose their trailing NUL bytes"""
+        strings = [index for _, _, _, dtype, _, index, _ in self.fields if dtype.startswith("|S")]
+        for timestamp, sysid, compid, values in zip(timestamps, sysids, compids, self.unpacker.iter_unpack(b"".join(payloads))):
+            if strings:
+                values = list(values)
+                for index in strings:
+                    values[index] = values[index].rstrip(b"\0").decode("utf-8", "replace")
+            row = [repr(timestamp), sysid, compid]
+            for _, _, _, _, _, index, count in self.fields:
+                row += values[index:index + count]
+            yield row
+
+
+def npy_header(dtype: str, shape: tuple) -> bytes:
+    """Header of a version 1.0 .npy file with C-ordered data"""
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (dtype, shape)
+    header += " " * (63 - (10 + len(header)) % 64) + "\n" # data aligned to 64 bytes
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def _part(directory: str, chunk: int, msgid: int, column: int = None) -> str:
+    if column is None:
+        return os.path.join(directory, f"{chunk:05d}-{msgid}.csv")
+    return os.path.join(directory, f"{chunk:05d}-{msgid}-{column}.bin")
+
+
+class ChunkExport:
+    """
+    Messages of a contiguous run of packets written into part files of a directory.
+
+    Frames are collected per message type and decoded in batches of `BATCH`: for npz every column
+    gets the bytes sliced out of the payloads (already in the little-endian layout NumPy reads),
+    for csv the payloads are unpacked by the message's struct. Memory is bounded by the batch size
+    times the number of message types. Frames that are truncated or fail the CRC check (they are
+    passed on as captured, e.g. from Wireshark recordings) are counted in `invalid` and skipped.
+    """
+
+    def __init__(self, directory: str, chunk: int = 0, fmt: str = "npz", msgids: set = None, dialect=None):
+        self.directory = directory
+        self.chunk = chunk
+        self.format = fmt
+        self.msgids = msgids
+        self.dialect = dialect or mavutil.mavlink
+        self.crc = _crc_function(self.dialect)
+        self.invalid = 0 # frames skipped as truncated or corrupt
+        self.layouts = {} # msgid -> Layout (None for message IDs not exported)
+        self.pending = {} # msgid -> [timestamps, sysids, compids, payloads]
+        self.rows = {} # msgid -> rows written
+
+    def scan(self, reader: CaptureReader, start: int = 0, end: int = None):
+        """Export messages of blocks starting at offsets in [start, end)"""
+        decapsulate = Decapsulator(reader).frames
+        layouts, pending, crc = self.layouts, self.pending, self.crc
+        for offset, interface_id, timestamp, packet_data in reader.records(start):
+            if end is not None and offset >= end:
+                break
+            for frame in (decapsulate(interface_id, packet_data) if packet_data else ()):
+                if frame[0] == MAGIC_V2 and len(frame) >= HEADER_LEN_V2:
+                    msgid, sysid, compid, header_len = frame[7] | (frame[8] << 8) | (frame[9] << 16), frame[5], frame[6], HEADER_LEN_V2
+                elif frame[0] == MAGIC_V1 and len(frame) >= HEADER_LEN_V1:
+                    msgid, sysid, compid, header_len = frame[5], frame[3], frame[4], HEADER_LEN_V1
+                else:
+                    continue
+                layout = layouts.get(msgid, False)
+                if layout is False:
+                    layout = layouts[msgid] = self._layout(msgid)
+                if layout is None:
+                    continue
+                crc_end = header_len + frame[1]
+                if len(frame) < crc_end + 2 or crc(frame[1:crc_end], layout.crc_extra) != frame[crc_end] | (frame[crc_end + 1] << 8):
+                    self.invalid += 1
+                    continue
+                batch = pending.get(msgid)
+                if batch is None:
+                    batch = pending[msgid] = [[], bytearray(), bytearray(), []]
+                payload = bytes(frame[header_len:header_len + min(frame[1], layout.size)])
+                batch[0].append(timestamp)
+                batch[1].append(sysid)
+                batch[2].append(compid)
+                batch[3].append(payload if len(payload) == layout.size else payload.ljust(layout.size, b"\0")) # v2 trims trailing zeros
+                if len(batch[0]) >= BATCH:
+                    self._flush(msgid)
+        for msgid in list(pending):
+            self._flush(msgid)
+        return self
+
+    def _layout(self, msgid: int) -> Layout:
+        msgtype = self.dialect.mavlink_map.get(msgid)
+        if msgtype is None or (self.msgids is not None and msgid not in self.msgids):
+            return None
+        return Layout(msgtype)
+
+    def _flush(self, msgid: int):
+        timestamps, sysids, compids, payloads = self.pending.pop(msgid)
+        layout = self.layouts[msgid]
+        if self.format == "csv":
+            with open(_part(self.directory, self.chunk, msgid), "a", newline="") as file:
+                csv.writer(file).writerows(layout.csv_rows(timestamps, sysids, compids, payloads))
+        else:
+            columns = [struct.pack(f"<{len(timestamps)}d", *timestamps), sysids, compids]
+            columns += [b"".join([payload[offset:offset + size] for payload in payloads]) for _, offset, size, _, _, _, _ in layout.fields]
+            for column, data in enumerate(columns):
+                with open(_part(self.directory, self.chunk, msgid, column), "ab") as file:
+                    file.write(data)
+        self.rows[msgid] = self.rows.get(msgid, 0) + len(timestamps)
+
+
+def export_chunk(path: str, start: int, end: int, directory: str, chunk: int, fmt: str, msgids: set = None) -> dict:
+    """Export messages of packet blocks starting at offsets in [start, end) into part files; return {msgid: rows} (runs in worker processes)"""
+    with open(path, "rb") as file, open_reader(file) as reader:
+        exported = ChunkExport(directory, chunk, fmt, msgids).scan(reader, start, end)
+    if exported.invalid:
+        logger.warning(f"skipped {exported.invalid} truncated or corrupt frames")
+    return exported.rows
+
+
+def export(path: str, output: str, fmt: str = "npz", msgids: set = None, jobs: int = None) -> dict:
+    """
+    Export decoded messages of a recording into columns; return {message name: rows}.
+
+    npz writes one array per field named `NAME.field` plus `NAME._timestamp`, `NAME._sysid` and
+    `NAME._compid` into `<output>.npz`; csv writes a `<output>-NAME.csv` table per message type.
+    Chunks of the recording are exported by `jobs` worker processes (all CPUs by default) into
+    temporary part files that are then concatenated in file order - the arrays are never held in
+    memory.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt}; choices: {FORMATS}")
+    jobs = jobs or os.cpu_count() or 1
+    chunks = split_chunks(path, jobs)
+    rows = {}
+    with tempfile.TemporaryDirectory(prefix="mavsniff-export-") as directory:
+        if len(chunks) == 1:
+            results = [export_chunk(path, 0, None, directory, 0, fmt, msgids)]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(chunks))) as pool:
+                results = list(pool.map(export_chunk, *zip(*[(path, start, end, directory, chunk, fmt, msgids)
+                                                             for chunk, (start, end) in enumerate(chunks)])))
+        for result in results:
+            for msgid, count in result.items():
+                rows[msgid] = rows.get(msgid, 0) + count
+        layouts = {msgid: Layout(mavutil.mavlink.mavlink_map[msgid]) for msgid in sorted(rows)}
+        if fmt == "npz":
+            target = output if output.endswith(".npz") else output + ".npz"
+            with zipfile.ZipFile(target, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+                for msgid, layout in layouts.items():
+                    for column, (name, dtype, shape) in enumerate(layout.columns):
+                        with archive.open(f"{layout.name}.{name}.npy", "w", force_zip64=True) as entry:
+                            entry.write(npy_header(dtype, (rows[msgid],) + shape))
+                            _concatenate(entry, [_part(directory, chunk, msgid, column) for chunk in range(len(chunks))])
+            logger.info(f"exported {sum(rows.values())} messages of {len(layouts)} types into {target}")
+        else:
+            for msgid, layout in layouts.items():
+                target = f"{output}-{layout.name}.csv"
+                with open(target, "w", newline="") as file:
+                    csv.writer(file).writerow(layout.csv_header())
+                    _concatenate(file, [_part(directory, chunk, msgid) for chunk in range(len(chunks))], binary=False)
+            logger.info(f"exported {sum(rows.values())} messages of {len(layouts)} types into {output}-*.csv")
+    return {layout.name: rows[msgid] for msgid, layout in layouts.items()}
+
+
+def _concatenate(target, parts: list, binary: bool = True):
+    for part in parts:
+        if os.path.exists(part):
+            with open(part, "rb" if binary else "r", newline=None if binary else "") as source:
+                shutil.copyfileobj(source, target, 1 << 20)
@@ -0,0 +1,129 @@
+import array
+import bisect
+import os
+import struct
+import sys
+
+from mavsniff.utils.log import logger
+from mavsniff.utils.decap import Decapsulator
+from mavsniff.utils.framer import frame_ids
+from mavsniff.utils.pcap import open_reader
+
+INDEX_SUFFIX = ".idx"
+NO_MSGID = 0xFFFFFFFF # msgid of packets that do not carry a MAVLink frame
+
+
+class Index:
+    """
+    Sidecar index of a pcapng (or pcap) recording - one row per packet (with the IDs of its first frame).
+
+    Rows are kept column-wise in arrays: block offset, timestamp (seconds), msgid, sysid and compid.
+    The sidecar file `<recording>.idx` stores size and mtime of the recording it was built from
+    and gets rebuilt when they do not match. Whether timestamps never decrease is found while
+    building and stored along so seeking can bisect without checking all timestamps again.
+    """
+
+    _header = struct.Struct("<8sIQQQI") # magic, version, recording size, recording mtime (ns), rows, flags
+    MAGIC = b"MAVSIDX\0"
+    VERSION = 2
+    ORDERED = 0x1 # flag of timestamps that never decrease
+
+    def __init__(self):
+        self.offsets = array.array('Q')
+        self.timestamps = array.array('d')
+        self.msgids = array.array('I')
+        self.sysids = array.array('B')
+        self.compids = array.array('B')
+        self.size = 0
+        self.mtime_ns = 0
+        self.ordered = True # timestamps never decrease (the clock did not go back during capture)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def build(cls, path: str) -> "Index":
+        """Scan the recording and index all its packets"""
+        index = cls()
+        stat = os.stat(path)
+        index.size, index.mtime_ns = stat.st_size, stat.st_mtime_ns
+        with open(path, "rb") as file, open_reader(file) as reader:
+            decapsulator = Decapsulator(reader)
+            last_timestamp = float("-inf")
+            for offset, interface_id, timestamp, packet_data in reader.records():
+                if timestamp < last_timestamp:
+                    index.ordered = False
+                last_timestamp = timestamp
+                frames = decapsulator.frames(interface_id, packet_data) if packet_data else None
+                ids = frame_ids(frames[0]) if frames else None
+                msgid, sysid, compid = ids or (NO_MSGID, 0, 0)
+                index.offsets.append(offset)
+                index.timestamps.append(timestamp)
+                index.msgids.append(msgid)
+                index.sysids.append(sysid)
+                index.compids.append(compid)
+        return index
+
+    @classmethod
+    def load(cls, path: str) -> "Index":
+        """Load the sidecar index of a recording; None if it is missing, corrupt or out of date"""
+        try:
+            stat = os.stat(path)
+            with open(path + INDEX_SUFFIX, "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        if len(data) < cls._header.size:
+            return None
+        magic, version, size, mtime_ns, rows, flags = cls._header.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION or size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            return None
+        index = cls()
+        index.size, index.mtime_ns = size, mtime_ns
+        index.ordered = bool(flags & cls.ORDERED)
+        pos = cls._header.size
+        for column in index._columns():
+            length = rows * column.itemsize
+            if pos + length > len(data):
+                return None
+            column.frombytes(data[pos:pos + length])
+            if sys.byteorder == "big":
+                column.byteswap()
+            pos += length
+        return index
+
+    def save(self, path: str):
+        """Write the index next to the recording"""
+        with open(path + INDEX_SUFFIX, "wb") as file:
+            file.write(self._header.pack(self.MAGIC, self.VERSION, self.size, self.mtime_ns, len(self),
+                                          self.ORDERED if self.ordered else 0))
+            for column in self._columns():
+                if sys.byteorder == "big":
+                    column = array.array(column.typecode, column)
+                    column.byteswap()
+                file.write(column.tobytes())
+
+    @classmethod
+    def open(cls, path: str) -> "Index":
+        """Load the index of a recording, building and saving it first if needed"""
+        index = cls.load(path)
+        if index is None:
+            logger.info(f"indexing {path}")
+            index = cls.build(path)
+            try:
+                index.save(path)
+            except OSError as e:
+                logger.warning(f"Failed to save index of {path}: {e}")
+        return index
+
+    def seek(self, timestamp: float) -> int:
+        """Row of the first packet recorded at or after timestamp (len(self) if there is none)"""
+        if self.ordered:
+            return bisect.bisect_left(self.timestamps, timestamp)
+        for row, ts in enumerate(self.timestamps): # clock went backwards during capture
+            if ts >= timestamp:
+                return row
+        return len(self)
+
+    def _columns(self):
+        return (self.offsets, self.timestamps, self.msgids, self.sysids, self.compids)
@@ -0,0 +1,95 @@
+from pymavlink import mavutil
+
+from mavsniff.capture import Capture, RECV_SIZE
+from mavsniff.utils.log import logger
+from mavsniff.utils.mav import has_peer
+from mavsniff.utils.metrics import Histogram
+from mavsniff.utils.stamping import KERNEL
+from mavsniff.utils.timing import clock
+
+UPSTREAM = 0 # interface of bytes coming from the upstream device (vehicle) and forwarded downstream
+DOWNSTREAM = 1 # interface of bytes coming from the downstream device (GCS) and forwarded upstream
+FORWARD_BOUNDS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1) # seconds
+
+
+class Proxy(Capture):
+    """
+    Forward raw bytes between an upstream (vehicle) and a downstream (ground station) device while
+    capturing both directions.
+
+    Bytes are written to the other device as soon as they are read - before they get framed for
+    the capture and without decoding anything. Every direction is an interface of the pcapng file
+    named after where the bytes go. The added latency of a hop is measured per direction - from the
+    kernel receive time of socket data (or the time the device was found readable, or the read
+    started) until the bytes are written to the other side. Bytes count as forwarded only when the
+    other side has a peer to deliver them to (UDP and TCP servers get one by being contacted).
+    """
+
+    def __init__(self, upstream: mavutil.mavfile, downstream: mavutil.mavfile, file, **kwargs):
+        kwargs["raw"] = True
+        super().__init__([upstream, downstream], file, **kwargs)
+        for interface_id, (source, target) in enumerate((("upstream", "downstream"), ("downstream", "upstream"))):
+            self.interfaces[interface_id]["if_name"] = f"{source} -> {target}"
+            self.interfaces[interface_id]["if_description"] = f"{self.devices[interface_id].address} -> {self.devices[1 - interface_id].address}"
+        self.latency = [Histogram(FORWARD_BOUNDS), Histogram(FORWARD_BOUNDS)]
+        self.latency_max = [0.0, 0.0]
+        self.forwarded = [0, 0] # bytes
+        self.undelivered = [0, 0] # bytes read while the other side had no peer
+        self.forward_errors = [0, 0]
+
+    def _recv(self, interface_id: int) -> bytes:
+        """Read raw bytes and forward them to the other device right away"""
+        started = self.readable_at[interface_id] or clock() # waiting for the loop to serve a readable device counts
+        self.readable_at[interface_id] = None
+        data = self.devices[interface_id].recv(RECV_SIZE)
+        if not data:
+            return data
+        target = self.devices[1 - interface_id]
+        if not has_peer(target):
+            self.undelivered[interface_id] += len(data)
+            return data
+        try:
+            result = target.write(data)
+        except OSError as e:
+            self.forward_errors[interface_id] += 1
+            logger.debug(f"Failed to forward {len(data)} B to {target.address}: {e}")
+            return data
+        if result == -1 or not has_peer(target): # pymavlink swallows most errors: serial returns -1, TCP drops the client
+            self.forward_errors[interface_id] += 1
+            return data
+        latency = clock() - started
+        stamper = self.stampers[interface_id]
+        if stamper.source == KERNEL: # the kernel stamped the bytes before the device became readable
+            latency = max(latency, (self.clock.now_us() - stamper.timestamp_us) / 1e6)
+        self.latency[interface_id].observe(latency)
+        if latency > self.latency_max[interface_id]:
+            self.latency_max[interface_id] = latency
+        self.forwarded[interface_id] += len(data)
+        return data
+
+    def counters(self) -> dict:
+        counters = super().counters()
+        for interface_id, direction in ((UPSTREAM, "upstream"), (DOWNSTREAM, "downstream")):
+            latency = self.latency[interface_id]
+            counters[f"forwarded_from_{direction}"] = self.forwarded[interface_id]
+            counters[f"undelivered_from_{direction}"] = self.undelivered[interface_id]
+            counters[f"forward_errors_from_{direction}"] = self.forward_errors[interface_id]
+            counters[f"forward_latency_p50_from_{direction}"] = latency.quantile(0.5)
+            counters[f"forward_latency_p99_from_{direction}"] = latency.quantile(0.99)
+            counters[f"forward_latency_max_from_{direction}"] = self.latency_max[interface_id]
+        return counters
+
+    def run(self, limit=-1, limit_invalid_packets=-1) -> int:
+        try:
+            return super().run(limit, limit_invalid_packets)
+        finally:
+            self.report_latency()
+
+    def report_latency(self):
+        for interface_id in (UPSTREAM, DOWNSTREAM):
+            latency = self.latency[interface_id]
+            if not latency.count:
+                continue
+            logger.info(f"{self.interfaces[interface_id]['if_name']}: forwarded {self.forwarded[interface_id]} B, latency "
+                        f"p50 <{latency.quantile(0.5) * 1e6:.0f}us, p99 <{latency.quantile(0.99) * 1e6:.0f}us, "
+                        f"max {self.latency_max[interface_id] * 1e6:.0f}us")
@@ -0,0 +1,116 @@
+import signal
+import threading
+
+from pymavlink import mavutil
+
+from mavsniff.capture import Capture, WRITE_BATCH
+from mavsniff.utils.log import logger
+from mavsniff.utils.framer import MAGIC_V1, MAGIC_V2, HEADER_LEN_V1, HEADER_LEN_V2
+from mavsniff.utils.ring import FrameRing
+from mavsniff.utils.segments import segment_path
+
+DEFAULT_RING_SIZE = 64 << 20 # bytes of frames kept in memory
+DUMP_CHUNK = 1 << 20 # bytes of encoded blocks written to the dump file at once
+HEARTBEAT_STATUS = 7 # offset of system_status in HEARTBEAT payload
+UNKNOWN_STATUS = 0xFF
+
+
+class FlightRecorder(Capture):
+    """
+    Capture keeping only the most recent frames in memory and dumping them into a pcapng file on demand.
+
+    Frames go into a fixed-size `FrameRing` instead of a file. The window (limited to the last
+    `window` seconds if given) is dumped into `<stem>-<time>.pcapng` on SIGUSR1, on a STATUSTEXT
+    with severity at most `severity` (-1 disables it), on a change of HEARTBEAT system_status of
+    any component (with `status_change`) and when the capture ends. The ring is emptied after a dump.
+    The ring always keeps the original frames (raw capture): triggers need the sysid and compid
+    they were sent with and dumps should hold what was received.
+    """
+
+    def __init__(self, device: mavutil.mavfile, path: str, ring_size: int = DEFAULT_RING_SIZE, window: float = None,
+                 severity: int = mavutil.mavlink.MAV_SEVERITY_ERROR, status_change: bool = True, **kwargs):
+        kwargs["raw"] = True
+        super().__init__(device, None, **kwargs)
+        self.stem = path[:-len(".pcapng")] if path.endswith(".pcapng") else path
+        self.frames = FrameRing(ring_size)
+        self.window = window
+        self.severity = severity
+        self.status_change = status_change
+        self.dump_requested = threading.Event()
+        self.dumps = [] # paths of written dumps
+        if hasattr(signal, "SIGUSR1"): # not on Windows
+            signal.signal(signal.SIGUSR1, self.trigger)
+
+    def trigger(self, *args):
+        """Request a dump of the ring (safe to call from signal handlers and other threads)"""
+        self.dump_requested.set()
+
+    def _write_packets(self):
+        """Keep packets from the ring buffer in the frame ring and dump it when triggered"""
+        self.frames.clear()
+        self.statuses = bytearray([UNKNOWN_STATUS]) * 65536 # last system_status by sysid and compid
+        self.last_timestamp = 0
+        while True:
+            closed = self.ring.closed
+            batch = self.ring.get_batch(WRITE_BATCH)
+            for timestamp_us, interface_id, data in batch:
+                self.written += 1
+                self.frames.put(timestamp_us, interface_id, data)
+                self.last_timestamp = timestamp_us
+                if self._is_trigger(data):
+                    self.dump_requested.set()
+            if self.metrics is not None:
+                self.metrics.observe([data for _, _, data in batch])
+            if self.dump_requested.is_set():
+                self.dump_requested.clear()
+                self.dump()
+            if not batch and closed:
+                break
+        self.dump()
+
+    def _is_trigger(self, frame: bytes) -> bool:
+        """Whether a frame is an error STATUSTEXT or a HEARTBEAT with changed system_status"""
+        if frame[0] == MAGIC_V2 and len(frame) >= HEADER_LEN_V2:
+            msgid, sysid, compid, start = frame[7] | (frame[8] << 8) | (frame[9] << 16), frame[5], frame[6], HEADER_LEN_V2
+        elif frame[0] == MAGIC_V1 and len(frame) >= HEADER_LEN_V1:
+            msgid, sysid, compid, start = frame[5], frame[3], frame[4], HEADER_LEN_V1
+        else:
+            return False
+        payload_len = frame[1] # v2 payloads are truncated of trailing zeros
+        if msgid == mavutil.mavlink.MAVLINK_MSG_ID_STATUSTEXT:
+            severity = frame[start] if payload_len else 0
+            if severity <= self.severity:
+                logger.info(f"dump triggered by STATUSTEXT with severity {severity}")
+                return True
+        elif msgid == mavutil.mavlink.MAVLINK_MSG_ID_HEARTBEAT and self.status_change:
+            status = frame[start + HEARTBEAT_STATUS] if payload_len > HEARTBEAT_STATUS else 0
+            component = (sysid << 8) | compid
+            previous, self.statuses[component] = self.statuses[component], status
+            if previous != UNKNOWN_STATUS and previous != status:
+                logger.info(f"dump triggered by system status change {previous} -> {status} of {sysid}:{compid}")
+                return True
+        return False
+
+    def dump(self) -> str:
+        """Write the frames from the ring into a new pcapng file and empty the ring; return its path"""
+        if not len(self.frames):
+            return None
+        oldest = self.last_timestamp - int(self.window * 1e6) if self.window else 0
+        path = segment_path(self.stem)
+        dumped = 0
+        with open(path, "wb") as file:
+            file.write(self.header)
+            buffer = bytearray()
+            for timestamp_us, interface_id, data in self.frames:
+                if timestamp_us < oldest:
+                    continue
+                dumped += 1
+                buffer += self.encoder.encode(dumped, data, timestamp_us, interface_id)
+                if len(buffer) >= DUMP_CHUNK:
+                    file.write(buffer)
+                    buffer.clear()
+            file.write(buffer)
+        self.frames.clear()
+        self.dumps.append(path)
+        logger.info(f"dumped {dumped} packets into {path}")
+        return path
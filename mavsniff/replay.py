@@ -1,85 +1,412 @@
+import array
+import asyncio
 import io
-import pcapng
+import os
 import signal
 import threading
-import time
 
 from pymavlink import mavutil
 
+from mavsniff.index import Index
 from mavsniff.utils.log import logger
-from mavsniff.utils import ip
+from mavsniff.utils.decap import Decapsulator
+from mavsniff.utils.filter import MessageFilter
+from mavsniff.utils.metrics import Metrics
+from mavsniff.utils.pcap import CaptureReader, open_reader
+from mavsniff.utils.profiling import Profiler
+from mavsniff.utils.ring import RingBuffer, BLOCK, DROP_OLDEST
+from mavsniff.utils.segments import open_segment
+from mavsniff.utils.timing import Scheduler, LinkPacer, DEFAULT_SPIN, clock, percentiles
+from mavsniff.utils import timing
+from mavsniff.utils.aio import Runner, sleep_until
 
+DEFAULT_COALESCE = 0.001 # seconds
+MAX_BATCH = 64 # packets written at once at most
+OUTPUT_QUEUE = 1024 # batches an output may fall behind before its oldest ones are dropped (or the replay waits)
 
-INTERFACE_MAGIC = 0x00000001
-PACKET_MAGIC = 0x00000006
-SECTION_MAGIC = 0x0A0D0D0A
 
+def write_packets(device: mavutil.mavfile, packets: list, datagrams: bool):
+    """Write a batch of packets at once (one by one to keep datagram boundaries)"""
+    if datagrams:
+        for packet in packets:
+            device.write(packet)
+    elif len(packets) == 1:
+        device.write(packets[0])
+    else:
+        device.write(b"".join(packets))
 
-class Replay:
-    def __init__(self, device: mavutil.mavfile, file: io.BytesIO):
-        self.file = file
+
+class Output(threading.Thread):
+    """
+    Writer thread of one of several replay targets.
+
+    Batches scheduled by the replay queue up without blocking it, so a slow (serial) device does not
+    delay the others; when the device falls `OUTPUT_QUEUE` batches behind the oldest ones get dropped
+    (with a warning). Replays without timing pass the `BLOCK` overflow instead - there is no schedule
+    to keep, so the replay waits for the slowest device rather than losing its packets.
+    Lateness of every packet is measured when it is actually written to this device.
+    """
+
+    def __init__(self, device: mavutil.mavfile, baud: int = None, spin: float = DEFAULT_SPIN, overflow: str = DROP_OLDEST):
+        super().__init__(name=f"mavsniff-replay-{device.address}", daemon=True)
         self.device = device
-        self.done = False
-        signal.signal(signal.SIGINT, self.stop)
+        self.datagrams = isinstance(device, (mavutil.mavudp, mavutil.mavmcast))
+        self.pacer = LinkPacer(baud) if baud else None
+        self.spin = spin
+        self.queue = RingBuffer(OUTPUT_QUEUE, overflow)
+        self.lateness = array.array('d')
+        self.lateness_sum = 0.0
+        self.lateness_max = 0.0
+        self.written = 0
+        self.error = None
 
-    def run(self, limit=-1) -> int:
-        """Replay a PCAPNG file to a device"""
-        scanner = pcapng.FileScanner(self.file)
-        # Resolution is handled in the mavlink library - timestamp is in seconds
-        # resolution seems to be constant for all packets in a file
-        # self.resolution_ts = interface_description.timestamp_resolution
-        self.last_packet_ts = time.time()
-        self.last_sent_ts = 0.0
-        self.done = False
-        written = 0
-        empty = 0
-        non_data = 0
-        sleep_time = 0.0
-        proceed = lambda: not self.done and (limit < 0 or written < limit)
-
-        def report_stats():
-            while proceed():
-                logger.info(f"replayed {written}, empty: {empty}, unknown: {non_data}, slept: {sleep_time:.2}s")
-                time.sleep(1.0)
-        threading.Thread(target=report_stats).start()
-
-        for packet in scanner:
-            if self.done:
+    def put(self, due: list, packets: list, timed: bool):
+        dropped = self.queue.dropped
+        self.queue.put((due if timed else None, packets))
+        if not dropped and self.queue.dropped:
+            logger.warning(f"{self.device.address} can not keep up; its oldest batches get dropped")
+
+    def full(self) -> bool:
+        """Whether putting a batch would block (all batches are put by the replay so it can not fill up meanwhile)"""
+        return self.queue.policy == BLOCK and len(self.queue) >= self.queue.capacity
+
+    def run(self):
+        while True:
+            closed = self.queue.closed
+            for due, packets in self.queue.get_batch(MAX_BATCH):
+                if self.error is not None:
+                    continue # keep draining so the replay goes on for the other outputs
+                try:
+                    if self.pacer:
+                        queued = 0.0 # since the batch was taken
+                        for group in self.pacer.split(packets):
+                            size = sum(len(packet) for packet in group)
+                            delay = self.pacer.delay(size)
+                            if delay > 0:
+                                timing.sleep_until(clock() + delay, self.spin)
+                                queued += delay
+                            self.pacer.consume(size, queued, len(group))
+                            write_packets(self.device, group, self.datagrams)
+                    else:
+                        write_packets(self.device, packets, self.datagrams)
+                except Exception as e:
+                    self.error = e
+                    logger.error(f"Failed to write to {self.device.address}: {e}")
+                    continue
+                self.written += len(packets)
+                if due is not None:
+                    now = clock()
+                    lateness = [now - packet_due for packet_due in due]
+                    self.lateness.extend(lateness)
+                    self.lateness_sum += sum(lateness)
+                    self.lateness_max = max(self.lateness_max, max(lateness))
+            if closed and not len(self.queue):
                 break
-            if packet is None:
-                empty += 1
-                continue
-            if packet.magic_number != PACKET_MAGIC:
-                non_data += 1
-                continue
-            if not packet.packet_data:
-                empty += 1
-                continue
-            if packet.packet_data[0] in (0xfe, 0xfd): # mavlink magic bytes (0xfe "v1.0", 0xfd "v2.0")
-                sleep_time += self._send_in_timely_manner(packet.timestamp, packet.packet_data)
-            elif ip.is_packet(packet.packet_data):
-                sleep_time += self._send_in_timely_manner(packet.timestamp, ip.get_payload(packet.packet_data))
+
+    def close(self):
+        """Stop accepting batches; the thread finishes after writing the queued ones"""
+        self.queue.close()
+
+    def counters(self) -> dict:
+        return {
+            "device": self.device.address,
+            "written": self.written,
+            "queued": len(self.queue),
+            "dropped_batches": self.queue.dropped,
+            "lateness_mean": self.lateness_sum / len(self.lateness) if self.lateness else None,
+            "lateness_max": self.lateness_max,
+        }
+
+
+class AsyncReplay:
+    """
+    Replay sends packets from a PCAPNG (or classic pcap) file to a device keeping their original timing.
+
+    MAVLink frames are taken out of packets of any supported link type (see `utils.decap`) so
+    captures made by Wireshark or tcpdump replay as well as mavsniff's own ones.
+
+    Several devices can be given at once: the file is read and scheduled once and every batch is
+    handed to an `Output` writer thread per device (serial ones paced by `baud`) which keeps its
+    own lateness statistics.
+
+    The file is either an open file or a list of paths of recording segments (see
+    `utils.segments`) replayed one after another as one recording.
+
+    Waiting happens on the running event loop (with a short busy-wait for precision).
+    Cancel the `run` task to stop replaying.
+
+    Only packets between `start` and `end` seconds from the beginning of the recording are replayed;
+    files on disk seek to `start` using their sidecar index (built on first use). Packets rejected
+    by the optional `message_filter` are skipped and counted. Optional `metrics` get per-stream
+    counters and lateness of the replayed packets; an optional `profiler` gets the time spent
+    reading, decapsulating, waiting and writing.
+    """
+
+    def __init__(self, device: mavutil.mavfile, file: io.BytesIO, speed: float = 1.0, spin: float = DEFAULT_SPIN, coalesce: float = DEFAULT_COALESCE, baud: int = None,
+                 start: float = 0.0, end: float = None, message_filter: MessageFilter = None, metrics: Metrics = None, profiler: Profiler = None):
+        self.file = file
+        self.devices = list(device) if isinstance(device, (list, tuple)) else [device]
+        self.device = self.devices[0]
+        self.outputs = []
+        self.speed = speed # 0 replays as fast as possible
+        self.spin = spin
+        self.coalesce = coalesce # packets due within this many seconds are written together
+        self.datagrams = isinstance(self.device, (mavutil.mavudp, mavutil.mavmcast))
+        self.baud = baud # shape output to the capacity of a link with this baud rate
+        self.start = start
+        self.end = end
+        self.message_filter = message_filter
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.source = self.counters
+        self.profiler = profiler
+        self.finished = False
+        self.written = 0
+        self.empty = 0
+        self.non_data = 0
+        self.filtered = 0
+        self.sleep_time = 0.0
+
+    async def run(self, limit=-1) -> int:
+        """Replay a PCAPNG file to a device"""
+        # Resolution is handled in the reader - timestamp is in seconds
+        self.scheduler = Scheduler(self.speed, self.spin)
+        self.pacer = LinkPacer(self.baud) if self.baud and len(self.devices) == 1 else None
+        if len(self.devices) > 1:
+            overflow = DROP_OLDEST if self.speed else BLOCK
+            self.outputs = [Output(device, self.baud if isinstance(device, mavutil.mavserial) else None, self.spin, overflow)
+                            for device in self.devices]
+            for output in self.outputs:
+                output.start()
+        self.finished = False
+        self.written = 0
+        self.empty = 0
+        self.non_data = 0
+        self.filtered = 0
+        self.sleep_time = 0.0
+
+        batch = [] # payloads due within the coalescing window, written at once
+        batch_due = []
+        taken = 0
+        done = False
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
+            profiler.enter_thread()
+        offset, first_ts = self._seek()
+        files = self._files(offset)
+        try:
+            async for file, offset in files:
+                with open_reader(file) as reader:
+                    decapsulator = Decapsulator(reader)
+                    if profiler is not None:
+                        started = clock()
+                    for _, interface_id, timestamp, packet_data in reader.records(offset):
+                        if profiler is not None: # records skipped below go on right after an observation so it starts the next read
+                            started = profiler.observe("read", started)
+                        if first_ts is None:
+                            first_ts = timestamp
+                        if timestamp < first_ts + self.start:
+                            continue
+                        if self.end is not None and timestamp > first_ts + self.end:
+                            done = True
+                            break
+                        if not packet_data:
+                            self.empty += 1
+                            continue
+                        payloads = decapsulator.frames(interface_id, packet_data)
+                        if profiler is not None:
+                            started = profiler.observe("parse", started)
+                        if not payloads:
+                            self.non_data += 1
+                            logger.debug(f"unknown packet: {bytes(packet_data[:10])}...")
+                            if profiler is not None:
+                                started = clock()
+                            continue
+                        if self.baud and taken == 0:
+                            self._check_link_speed(reader)
+                        due = self.scheduler.due(timestamp)
+                        for payload in payloads:
+                            if self.message_filter and not self.message_filter.accepts(payload):
+                                self.filtered += 1
+                                continue
+                            if batch and (due - batch_due[0] > self.coalesce or len(batch) >= MAX_BATCH):
+                                self.sleep_time += await self._send_in_timely_manner(batch_due, batch)
+                                batch, batch_due = [], []
+                            batch.append(payload)
+                            batch_due.append(due)
+                            taken += 1
+                            if limit > 0 and taken >= limit:
+                                done = True
+                                break
+                        if done:
+                            break
+                        if profiler is not None:
+                            started = clock()
+                if done:
+                    break
+            if batch: # payloads outlive their closed reader until they are dropped
+                self.sleep_time += await self._send_in_timely_manner(batch_due, batch)
+        finally:
+            await files.aclose()
+            await self._close_outputs()
+            if profiler is not None:
+                profiler.finish()
+            self.finished = True
+            self._report_timing()
+        return self.written
+
+    def counters(self) -> dict:
+        """Snapshot of the global counters"""
+        return {
+            "replayed": self.written,
+            "empty": self.empty,
+            "unknown": self.non_data,
+            "filtered": self.filtered,
+            "slept": self.sleep_time,
+            **({"outputs": [output.counters() for output in self.outputs]} if self.outputs else {}),
+        }
+
+    async def stats(self, interval: float = 1.0):
+        """Yield a snapshot of the counters every interval seconds until the replay finishes"""
+        while not self.finished:
+            yield self.counters()
+            await asyncio.sleep(interval)
+
+    async def _send_in_timely_manner(self, due: list, packets: list) -> float:
+        """Write packets to the device when the first one is due; return time spent waiting"""
+        profiler = self.profiler
+        if profiler is not None:
+            started = clock()
+        if self.speed:
+            waited = await sleep_until(due[0], self.spin)
+        else:
+            waited = 0.0
+            await asyncio.sleep(0) # let other tasks run and cancellation arrive
+        if profiler is not None:
+            started = profiler.observe("sleep", started)
+        if self.outputs:
+            for output in self.outputs:
+                if output.full(): # as fast as the slowest device
+                    await asyncio.get_running_loop().run_in_executor(None, output.put, due, packets, bool(self.speed))
+                else:
+                    output.put(due, packets, bool(self.speed))
+        elif self.pacer:
+            queued = 0.0 # since the batch was due
+            for group in self.pacer.split(packets):
+                size = sum(len(packet) for packet in group)
+                delay = self.pacer.delay(size)
+                if delay > 0:
+                    if profiler is not None:
+                        started = profiler.observe("write", started)
+                    waited += await sleep_until(clock() + delay, self.spin)
+                    queued += delay
+                    if profiler is not None:
+                        started = profiler.observe("sleep", started)
+                self.pacer.consume(size, queued, len(group))
+                write_packets(self.device, group, self.datagrams)
+        else:
+            write_packets(self.device, packets, self.datagrams)
+        if profiler is not None:
+            profiler.observe("write", started)
+        self.written += len(packets)
+        lateness = [self.scheduler.record(packet_due) for packet_due in due]
+        if self.metrics is not None:
+            self.metrics.observe(packets)
+            if self.speed:
+                self.metrics.lateness.observe_all(lateness)
+        return waited
+
+    async def _close_outputs(self):
+        """Let outputs write everything queued and wait for them"""
+        loop = asyncio.get_running_loop()
+        for output in self.outputs:
+            output.close()
+        for output in self.outputs:
+            await loop.run_in_executor(None, output.join)
+
+    def _report_timing(self):
+        jitter = self.scheduler.jitter()
+        if jitter:
+            logger.info(("scheduling" if self.outputs else "timing") + " jitter "
+                        + ", ".join(f"p{p}: {lateness * 1e6:.0f}us" for p, lateness in jitter.items() if p < 100)
+                        + f", max: {jitter[100] * 1e6:.0f}us")
+        for output in self.outputs:
+            jitter = percentiles(output.lateness)
+            if jitter:
+                logger.info(f"{output.device.address}: wrote {output.written}, jitter "
+                            + ", ".join(f"p{p}: {lateness * 1e6:.0f}us" for p, lateness in jitter.items() if p < 100)
+                            + f", max: {jitter[100] * 1e6:.0f}us")
             else:
-                non_data += 1
-                logger.debug(f"unknown packet: {packet.packet_data[:10]}...")
-                continue
-            written += 1
-            if limit > 0 and written >= limit:
-                break
-        self.done = True
-        return written
-
-    def _send_in_timely_manner(self, timestamp: float, packet_data: bytes) -> float:
-        """Replay a packet to the device"""
-        packet_ts_delta: float = timestamp - self.last_packet_ts
-        since_last_sent: float = time.time() - self.last_sent_ts
-        sleep_time = (packet_ts_delta - since_last_sent)
-        if sleep_time > 0.00001:
-            time.sleep(sleep_time)
-        self.device.write(packet_data)
-        self.last_sent_ts = time.time()
-        self.last_packet_ts = timestamp
-        return sleep_time if sleep_time > 0.00001 else 0.0
+                logger.info(f"{output.device.address}: wrote {output.written}")
+            if output.queue.dropped:
+                logger.warning(f"{output.device.address}: dropped {output.queue.dropped} batches")
+        delays = percentiles(self.pacer.delays) if self.pacer else {}
+        if delays:
+            logger.info("link queueing delay " + ", ".join(f"p{p}: {delay * 1e3:.1f}ms" for p, delay in delays.items() if p < 100)
+                        + f", max: {delays[100] * 1e3:.1f}ms")
+
+    async def _files(self, offset: int):
+        """Yield files to replay with offsets to start at; next segment is opened while the previous one plays"""
+        if not isinstance(self.file, (list, tuple)):
+            yield self.file, offset
+            return
+        loop = asyncio.get_running_loop()
+        pending = loop.run_in_executor(None, open_segment, self.file[0]) if self.file else None
+        try:
+            for i in range(len(self.file)):
+                file = await pending
+                pending = loop.run_in_executor(None, open_segment, self.file[i + 1]) if i + 1 < len(self.file) else None
+                try:
+                    yield file, 0
+                finally:
+                    file.close()
+        finally:
+            if pending is not None:
+                pending.add_done_callback(lambda future: future.cancelled() or future.exception() or future.result().close())
+
+    def _seek(self) -> tuple:
+        """Offset of the first packet to replay and timestamp of the beginning of the recording (None if unknown)"""
+        if not self.start or isinstance(self.file, (list, tuple)):
+            return 0, None
+        path = getattr(self.file, "name", None)
+        if not isinstance(path, str) or not os.path.isfile(path):
+            return 0, None # not a file on disk - packets before start get skipped while reading
+        index = Index.open(path)
+        if not len(index):
+            return 0, None
+        row = index.seek(index.timestamps[0] + self.start)
+        return (index.offsets[row] if row < len(index) else index.size), index.timestamps[0]
+
+    def _check_link_speed(self, reader: CaptureReader):
+        """Warn when the recording comes from a faster link than the target"""
+        speed = max((interface.speed for interface in reader.interfaces), default=0)
+        if speed > self.baud:
+            logger.warning(f"recorded link ({speed} baud) is faster than the target ({self.baud} baud); packets will be delayed")
+
+
+class Replay(AsyncReplay):
+    """Replay sends packets from a PCAPNG file to a device keeping their original timing (blocking)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.runner = Runner()
+        signal.signal(signal.SIGINT, self.stop)
+
+    def run(self, limit=-1) -> int:
+        """Replay a PCAPNG file to a device until stopped"""
+        self.runner.run(self._run_and_report(limit))
+        return self.written
+
+    async def _run_and_report(self, limit: int):
+        async def report_stats():
+            async for stats in self.stats():
+                logger.info(f"replayed {stats['replayed']}, empty: {stats['empty']}, unknown: {stats['unknown']}, filtered: {stats['filtered']}, slept: {stats['slept']:.2}s")
+        reporter = asyncio.ensure_future(report_stats())
+        try:
+            return await AsyncReplay.run(self, limit)
+        finally:
+            reporter.cancel()
 
     def stop(self, *args):
-        self.done = True
+        self.runner.stop()
@@ -0,0 +1,73 @@
+import asyncio
+
+from mavsniff.utils.timing import clock, DEFAULT_SPIN
+
+POLL_INTERVAL = 0.005 # seconds between reads of devices that can not be waited for
+
+
+async def wait_readable(fd: int) -> float:
+    """Wait until the file descriptor has data; return the clock time it was found readable (devices without descriptor are polled)"""
+    if fd is None: # e.g. serial ports on Windows
+        await asyncio.sleep(POLL_INTERVAL)
+        return clock()
+    loop = asyncio.get_running_loop()
+    readable = loop.create_future()
+    loop.add_reader(fd, lambda: readable.done() or readable.set_result(clock()))
+    try:
+        return await readable
+    finally:
+        loop.remove_reader(fd)
+
+
+async def sleep_until(deadline: float, spin: float = DEFAULT_SPIN) -> float:
+    """Sleep on the event loop until spin seconds before the deadline then busy-wait; return the time spent waiting"""
+    now = began = clock()
+    remaining = deadline - now
+    if remaining > spin:
+        await asyncio.sleep(remaining - spin)
+    else:
+        await asyncio.sleep(0) # let other tasks run and cancellation arrive
+    now = clock()
+    while now < deadline:
+        now = clock()
+    return now - began
+
+
+class Runner:
+    """
+    Run an async engine on a private event loop in a blocking manner.
+
+    `stop` may be called from other threads or from a signal handler - it cancels the running task,
+    or the next one when nothing runs yet.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.task = None
+        self.stopped = False
+
+    def run(self, coro):
+        """Run the coroutine until it finishes or gets stopped; return its result (None when stopped)"""
+        self.loop = asyncio.SelectorEventLoop() # engines wait for file descriptors with add_reader
+        try:
+            self.task = self.loop.create_task(coro)
+            if self.stopped:
+                self.task.cancel()
+            try:
+                return self.loop.run_until_complete(self.task)
+            except asyncio.CancelledError:
+                return None
+        finally:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+            self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+        loop, task = self.loop, self.task
+        if loop is None or task is None:
+            return
+        try:
+            loop.call_soon_threadsafe(task.cancel)
+        except RuntimeError:
+            pass # the loop has already finished
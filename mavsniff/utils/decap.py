@@ -0,0 +1,265 @@
+import struct
+
+from mavsniff.utils.framer import MAGIC_V1, MAGIC_V2, HEADER_LEN_V1, HEADER_LEN_V2, SIGNATURE_LEN, IFLAG_SIGNED
+
+# link types of interfaces (https://www.tcpdump.org/linktypes.html)
+LINKTYPE_NULL = 0 # BSD loopback - 4 bytes of address family in host byte order (mavsniff and QGroundControl)
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101 # bare IPv4/IPv6 packets
+LINKTYPE_LOOP = 108 # OpenBSD loopback - address family in network byte order
+LINKTYPE_LINUX_SLL = 113 # Linux "any" device
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+DLT_RAW = (12, 14) # values of LINKTYPE_RAW on some platforms
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+AF_INET = 2
+AF_INET6 = (10, 24, 28, 30) # Linux, NetBSD/OpenBSD, FreeBSD, macOS
+PROTO_TCP = 6
+PROTO_UDP = 17
+IPV6_EXTENSIONS = (0, 43, 60) # hop-by-hop, routing, destination options - skipped to get to the transport header
+IPV6_FRAGMENT = 44
+TCP_SYN = 0x02
+TCP_FIN = 0x01
+TCP_RST = 0x04
+MAX_STREAM_BUFFER = 1 << 16 # bytes of an unfinished frame kept per TCP flow before resynchronizing
+MAGICS = (MAGIC_V1, MAGIC_V2)
+
+
+def frame_length(data, pos: int = 0) -> int:
+    """Length of the MAVLink frame starting at pos (0 if there is no magic byte, None if the header is incomplete)"""
+    magic = data[pos]
+    if magic == MAGIC_V2:
+        if pos + 3 > len(data):
+            return None
+        return HEADER_LEN_V2 + data[pos + 1] + 2 + (SIGNATURE_LEN if data[pos + 2] & IFLAG_SIGNED else 0)
+    if magic == MAGIC_V1:
+        if pos + 2 > len(data):
+            return None
+        return HEADER_LEN_V1 + data[pos + 1] + 2
+    return 0
+
+
+def split_frames(data) -> tuple:
+    """
+    Split bytes into MAVLink frames by their length fields; return `(frames, consumed)`.
+
+    Bytes before a magic byte are skipped; an incomplete frame at the end is not consumed. Frames
+    are slices of data (or data itself). CRCs are not checked.
+    """
+    end = len(data)
+    if end and data[0] in MAGICS and frame_length(data) == end: # the common case - one frame per packet
+        return [data], end
+    frames = []
+    pos = 0
+    while pos < end:
+        length = frame_length(data, pos)
+        if length == 0:
+            pos += 1
+            while pos < end and data[pos] not in MAGICS:
+                pos += 1
+            continue
+        if length is None or pos + length > end:
+            break
+        frames.append(data[pos:pos + length])
+        pos += length
+    return frames, pos
+
+
+def _null(packet, order: str = "little"):
+    """IP version and offset of a packet with a loopback header"""
+    if len(packet) < 5:
+        return None, 0
+    family = int.from_bytes(packet[:4], order)
+    if family == AF_INET:
+        return 4, 4
+    if family in AF_INET6:
+        return 6, 4
+    family = int.from_bytes(packet[:4], "big" if order == "little" else "little") # written on a host of the other byte order
+    if family == AF_INET:
+        return 4, 4
+    if family in AF_INET6:
+        return 6, 4
+    return None, 0
+
+
+def _loop(packet):
+    return _null(packet, "big")
+
+
+def _ethertype(ethertype: int) -> int:
+    return 4 if ethertype == ETHERTYPE_IPV4 else 6 if ethertype == ETHERTYPE_IPV6 else None
+
+
+def _ethernet(packet):
+    offset = 12
+    while offset + 2 <= len(packet):
+        ethertype = (packet[offset] << 8) | packet[offset + 1]
+        if ethertype not in ETHERTYPE_VLAN:
+            return _ethertype(ethertype), offset + 2
+        offset += 4 # skip VLAN tag
+    return None, 0
+
+
+def _linux_sll(packet):
+    if len(packet) < 16:
+        return None, 0
+    return _ethertype((packet[14] << 8) | packet[15]), 16
+
+
+def _linux_sll2(packet):
+    if len(packet) < 20:
+        return None, 0
+    return _ethertype((packet[0] << 8) | packet[1]), 20
+
+
+def _raw(packet):
+    return (packet[0] >> 4 if len(packet) and packet[0] >> 4 in (4, 6) else None), 0
+
+
+# link type -> function(packet) returning (IP version or None, offset of the IP header)
+LINK_LAYERS = {
+    LINKTYPE_NULL: _null,
+    LINKTYPE_ETHERNET: _ethernet,
+    LINKTYPE_RAW: _raw,
+    LINKTYPE_LOOP: _loop,
+    LINKTYPE_LINUX_SLL: _linux_sll,
+    LINKTYPE_LINUX_SLL2: _linux_sll2,
+    LINKTYPE_IPV4: lambda packet: (4, 0),
+    LINKTYPE_IPV6: lambda packet: (6, 0),
+    **{link_type: _raw for link_type in DLT_RAW},
+}
+# link types padding short frames - only their packets get trimmed to the IP total length
+PADDED_LINKS = (LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL, LINKTYPE_LINUX_SLL2)
+
+
+class Decapsulator:
+    """
+    Extract MAVLink frames from captured packets of any supported link type.
+
+    The link layer of every interface is decoded by a function chosen once from its link type
+    (`LINK_LAYERS`); IPv4/IPv6 packets carrying UDP or TCP are unwrapped and their payloads split
+    into frames (one datagram may carry several). TCP payloads are reassembled per flow so frames
+    split across segments are recovered; retransmitted bytes are dropped and a missing segment
+    restarts the flow at the next one. Datagrams have to start with a magic byte; a truncated frame
+    at their end is passed on unchanged. Packets of unknown link types are taken as bare frames.
+    Fragmented IP packets are not reassembled.
+
+    mavsniff's own captures (loopback + IPv4 + UDP with a single frame) take a short fast path.
+    """
+
+    _seq = struct.Struct(">I") # TCP sequence number
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.interfaces = None # reader's interfaces the handlers were made for
+        self.handlers = []
+        self.flows = {} # addresses and ports -> [next sequence number, buffered bytes]
+        self.fragments = 0 # skipped fragments of IP packets
+        self.gaps = 0 # missing TCP segments
+
+    def frames(self, interface_id: int, packet) -> list:
+        """MAVLink frames carried by a packet of the interface (empty when there are none)"""
+        if self.reader.interfaces is not self.interfaces or interface_id >= len(self.handlers):
+            self._prepare()
+        return self.handlers[interface_id if interface_id < len(self.handlers) else 0](packet)
+
+    def _prepare(self):
+        self.interfaces = self.reader.interfaces
+        self.handlers = [self._handler(interface.link_type) for interface in self.interfaces] or [self._handler(LINKTYPE_NULL)]
+
+    def _handler(self, link_type: int):
+        link_layer = LINK_LAYERS.get(link_type)
+        if link_layer is None:
+            return self._bare
+        trim = link_type in PADDED_LINKS
+        network = self._network
+        if link_type == LINKTYPE_NULL:
+            def handler(packet):
+                # fast path: AF_INET loopback + IPv4 with 20 B header + UDP with a single frame
+                if packet[:5] == b"\x02\x00\x00\x00\x45" and len(packet) > 33 and packet[13] == PROTO_UDP and packet[32] in MAGICS \
+                        and frame_length(packet, 32) == len(packet) - 32:
+                    return [packet[32:]]
+                version, offset = link_layer(packet)
+                return network(packet, version, offset, trim) if version else self._bare(packet)
+            return handler
+        def handler(packet):
+            version, offset = link_layer(packet)
+            return network(packet, version, offset, trim) if version else self._bare(packet)
+        return handler
+
+    @staticmethod
+    def _bare(packet) -> list:
+        """Frames of a datagram starting with a magic byte; trailing bytes of a truncated frame are kept as they are"""
+        if not len(packet) or packet[0] not in MAGICS:
+            return []
+        frames, consumed = split_frames(packet)
+        if consumed < len(packet):
+            frames.append(packet[consumed:])
+        return frames
+
+    def _network(self, packet, version: int, offset: int, trim: bool) -> list:
+        """Frames of an IP packet starting at offset"""
+        if version == 4:
+            if offset + 20 > len(packet):
+                return []
+            header_len = (packet[offset] & 0x0F) * 4
+            if (packet[offset + 6] & 0x3F) or packet[offset + 7]: # more fragments or fragment offset
+                self.fragments += 1
+                return []
+            protocol = packet[offset + 9]
+            addresses = packet[offset + 12:offset + 20]
+            end = offset + ((packet[offset + 2] << 8) | packet[offset + 3]) if trim else len(packet)
+            offset += header_len
+        else:
+            if offset + 40 > len(packet):
+                return []
+            protocol = packet[offset + 6]
+            addresses = packet[offset + 8:offset + 40]
+            end = offset + 40 + ((packet[offset + 4] << 8) | packet[offset + 5]) if trim else len(packet)
+            offset += 40
+            while protocol in IPV6_EXTENSIONS and offset + 8 <= len(packet):
+                protocol, offset = packet[offset], offset + (packet[offset + 1] + 1) * 8
+            if protocol == IPV6_FRAGMENT:
+                self.fragments += 1
+                return []
+        end = min(end, len(packet))
+        if protocol == PROTO_UDP:
+            return self._bare(packet[offset + 8:end]) if offset + 8 <= end else []
+        if protocol == PROTO_TCP and offset + 20 <= end:
+            return self._tcp(packet, offset, end, addresses)
+        return []
+
+    def _tcp(self, packet, offset: int, end: int, addresses) -> list:
+        """Frames completed by a TCP segment of its flow"""
+        key = bytes(addresses) + bytes(packet[offset:offset + 4]) # addresses and ports
+        seq = self._seq.unpack_from(packet, offset + 4)[0]
+        flags = packet[offset + 13]
+        payload = packet[offset + (packet[offset + 12] >> 4) * 4:end]
+        flow = self.flows.get(key)
+        if flags & TCP_SYN:
+            seq = (seq + 1) & 0xFFFFFFFF
+            flow = self.flows[key] = [seq, bytearray()]
+        frames = []
+        if payload:
+            if flow is None:
+                flow = self.flows[key] = [seq, bytearray()] # joined an established connection
+            behind = (flow[0] - seq) & 0xFFFFFFFF
+            if behind >= 0x80000000: # a segment is missing - the buffered frame can not be completed
+                self.gaps += 1
+                flow[1].clear()
+                behind = 0
+            if behind < len(payload): # retransmitted bytes were already taken
+                flow[1] += payload[behind:]
+                flow[0] = (seq + len(payload)) & 0xFFFFFFFF
+            frames, consumed = split_frames(flow[1])
+            frames = [bytes(frame) for frame in frames] # the buffer gets reused
+            del flow[1][:consumed]
+            if len(flow[1]) > MAX_STREAM_BUFFER:
+                flow[1].clear()
+        if flags & (TCP_FIN | TCP_RST) and flow is not None:
+            del self.flows[key]
+        return frames
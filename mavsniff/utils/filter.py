@@ -0,0 +1,91 @@
+from pymavlink import mavutil
+
+from mavsniff.utils.framer import MAGIC_V1, MAGIC_V2, HEADER_LEN_V1, HEADER_LEN_V2
+
+FIELDS = ("msgid", "sysid", "compid")
+MSGID_TABLE_SIZE = 1 << 16 # message IDs above are rare - they are looked up in sets
+
+
+def parse_terms(specs, dialect=None) -> list:
+    """
+    Parse filter terms into (field, value) pairs.
+
+    A term is a message ID or name (`27`, `RAW_IMU`) or `field=value` with field being one of
+    msgid, name, sysid or compid. Several terms can be given comma-separated in one spec.
+    """
+    dialect = dialect or mavutil.mavlink
+    names = {msgtype.msgname: msgid for msgid, msgtype in dialect.mavlink_map.items()}
+    terms = []
+    for spec in specs:
+        for term in spec.split(","):
+            term = term.strip()
+            if not term:
+                continue
+            field, _, value = term.rpartition("=")
+            field = field.strip().lower() or ("msgid" if value.strip().isdigit() else "name")
+            value = value.strip()
+            if field == "name":
+                if value.upper() not in names:
+                    raise ValueError(f"unknown message name {value}")
+                terms.append(("msgid", names[value.upper()]))
+                continue
+            if field not in FIELDS:
+                raise ValueError(f"unknown filter field {field}; choices: msgid, name, sysid, compid")
+            try:
+                number = int(value, 0)
+            except ValueError:
+                raise ValueError(f"{field} must be a number, got {value}")
+            if not 0 <= number < (1 << 24 if field == "msgid" else 256):
+                raise ValueError(f"{field} {number} is out of range")
+            terms.append((field, number))
+    return terms
+
+
+class MessageFilter:
+    """
+    Accept or reject MAVLink frames by message ID, system ID and component ID read from the raw header.
+
+    Terms are compiled into lookup tables (one per field) telling whether a value passes. A frame
+    passes when every field passes: the field matches some include term (if there are any for
+    the field) and no exclude term. Data that are not MAVLink frames always pass.
+    """
+
+    def __init__(self, include=(), exclude=(), dialect=None):
+        include = parse_terms(include, dialect)
+        exclude = parse_terms(exclude, dialect)
+        tables = {}
+        self.wide_msgids = {} # verdicts for message IDs that do not fit the table
+        for field in FIELDS:
+            included = {value for f, value in include if f == field}
+            excluded = {value for f, value in exclude if f == field}
+            size = MSGID_TABLE_SIZE if field == "msgid" else 256
+            table = bytearray(b"\x00" if included else b"\x01") * size
+            for value in included:
+                if value < size:
+                    table[value] = 1
+            for value in excluded:
+                if value < size:
+                    table[value] = 0
+            tables[field] = table
+            if field == "msgid":
+                self.wide_default = not included
+                self.wide_msgids = {value: value in included and value not in excluded for value in included | excluded if value >= size}
+        self.msgid_ok, self.sysid_ok, self.compid_ok = tables["msgid"], tables["sysid"], tables["compid"]
+
+    def accepts_ids(self, msgid: int, sysid: int, compid: int) -> bool:
+        """Whether a message with these IDs passes the filter"""
+        if msgid < MSGID_TABLE_SIZE:
+            if not self.msgid_ok[msgid]:
+                return False
+        elif not self.wide_msgids.get(msgid, self.wide_default):
+            return False
+        return bool(self.sysid_ok[sysid] and self.compid_ok[compid])
+
+    def accepts(self, frame: bytes) -> bool:
+        """Whether a raw frame passes the filter (only its header is read)"""
+        size = len(frame)
+        if size >= HEADER_LEN_V2 and frame[0] == MAGIC_V2:
+            return self.accepts_ids(frame[7] | (frame[8] << 8) | (frame[9] << 16), frame[5], frame[6])
+        if size >= HEADER_LEN_V1 and frame[0] == MAGIC_V1:
+            return self.accepts_ids(frame[5], frame[3], frame[4])
+        return True
@@ -0,0 +1,124 @@
+from pymavlink import mavutil
+
+MAGIC_V1 = 0xfe
+MAGIC_V2 = 0xfd
+HEADER_LEN_V1 = 6
+HEADER_LEN_V2 = 10
+SIGNATURE_LEN = 13
+IFLAG_SIGNED = 0x01
+
+
+def crc_extras(dialect=None) -> dict:
+    """Map message ID to its CRC_EXTRA byte for the (currently loaded) pymavlink dialect"""
+    dialect = dialect or mavutil.mavlink
+    return {msgid: msgtype.crc_extra for msgid, msgtype in dialect.mavlink_map.items()}
+
+
+def _crc_function(dialect=None):
+    """Return fn(data, crc_extra) -> int computing MAVLink X.25 checksum"""
+    dialect = dialect or mavutil.mavlink
+    mcrf4xx = getattr(dialect, "mcrf4xx", None)
+    if mcrf4xx is not None:
+        return lambda data, extra: mcrf4xx(bytes((extra,)), mcrf4xx(data, 0xffff))
+    x25crc = dialect.x25crc
+    def crc(data, extra):
+        c = x25crc(bytes(data))
+        c.accumulate(bytes((extra,)))
+        return c.crc
+    return crc
+
+
+class Framer:
+    """
+    Streaming MAVLink v1/v2 framer that splits raw bytes into frames without decoding them.
+
+    Frames are located by the magic byte, checked by length and CRC (with CRC_EXTRA) and
+    returned as the exact bytes received - including sequence numbers and signatures.
+    Frames of message IDs unknown to the dialect cannot be verified so they are counted and skipped.
+    """
+
+    def __init__(self, dialect=None):
+        self.buf = bytearray()
+        self.crc_extras = crc_extras(dialect)
+        self.crc = _crc_function(dialect)
+        self.bad_data = 0  # number of discarded byte runs (same meaning as pymavlink's BAD_DATA)
+        self.unknown = 0  # candidate frames with message ID not known to the dialect
+        self._in_garbage = False
+
+    def feed(self, data: bytes) -> list:
+        """Add received bytes and return a list of complete frames found so far"""
+        buf = self.buf
+        buf += data
+        frames = []
+        i = 0
+        end = len(buf)
+        while i < end:
+            magic = buf[i]
+            if magic != MAGIC_V1 and magic != MAGIC_V2:
+                j = self._next_magic(buf, i + 1)
+                self._discard()
+                if j < 0:
+                    i = end
+                    break
+                i = j
+                continue
+            if magic == MAGIC_V2:
+                if end - i < 3:
+                    break
+                header_len = HEADER_LEN_V2
+                flags = buf[i + 2]
+                frame_len = header_len + buf[i + 1] + 2 + (SIGNATURE_LEN if flags & IFLAG_SIGNED else 0)
+                if flags & ~IFLAG_SIGNED:
+                    self._discard()
+                    i += 1
+                    continue
+            else:
+                if end - i < 2:
+                    break
+                header_len = HEADER_LEN_V1
+                frame_len = header_len + buf[i + 1] + 2
+            if end - i < frame_len:
+                break
+            if header_len == HEADER_LEN_V2:
+                msgid = buf[i + 7] | (buf[i + 8] << 8) | (buf[i + 9] << 16)
+            else:
+                msgid = buf[i + 5]
+            crc_end = i + header_len + buf[i + 1]
+            extra = self.crc_extras.get(msgid)
+            if extra is None:
+                self.unknown += 1
+                i += 1
+                continue
+            if self.crc(memoryview(buf)[i + 1:crc_end], extra) != buf[crc_end] | (buf[crc_end + 1] << 8):
+                self._discard()
+                i += 1
+                continue
+            frames.append(bytes(buf[i:i + frame_len]))
+            self._in_garbage = False
+            i += frame_len
+        del buf[:i]
+        return frames
+
+    def _discard(self):
+        if not self._in_garbage:
+            self.bad_data += 1
+            self._in_garbage = True
+
+    @staticmethod
+    def _next_magic(buf: bytearray, start: int) -> int:
+        v1 = buf.find(MAGIC_V1, start)
+        v2 = buf.find(MAGIC_V2, start)
+        if v1 < 0:
+            return v2
+        if v2 < 0:
+            return v1
+        return min(v1, v2)
+
+
+def frame_ids(frame: bytes) -> tuple:
+    """Read (msgid, sysid, compid) from the header of a raw frame; None if it is not a MAVLink frame"""
+    if len(frame) >= HEADER_LEN_V2 and frame[0] == MAGIC_V2:
+        return frame[7] | (frame[8] << 8) | (frame[9] << 16), frame[5], frame[6]
+    if len(frame) >= HEADER_LEN_V1 and frame[0] == MAGIC_V1:
+        return frame[5], frame[3], frame[4]
+    return None
@@ -39,3 +39,12 @@ def get_payload(packet: bytes) -> bytes:
     # add UDP or TCP header length
     hl += 8 # hard-code UDP header length
     return packet[hl+4:]
+
+
+def get_mavlink(packet: bytes) -> bytes:
+    """Get MAVLink data from a captured packet (bare frame or UDP packet); None for other packets"""
+    if len(packet) and packet[0] in (0xfe, 0xfd): # mavlink magic bytes (0xfe "v1.0", 0xfd "v2.0")
+        return packet
+    if is_packet(packet):
+        return get_payload(packet)
+    return None
@@ -1,3 +1,10 @@
+import contextlib
+import importlib
+import importlib.util
+import io
+import os
+import socket
+
 from pymavlink import mavutil
 from pymavlink.generator import mavparse
 
@@ -8,6 +15,50 @@ ParseError = mavparse.MAVParseError
 # HACK: fixup - do not fill RAM with mavlink messages when sniffing
 mavutil.add_message = lambda messages, mtype, msg: None
 
+DIALECT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "mavsniff", "dialects") # dialects generated from XML definitions
+
+_dialects = {} # (dialect, wire protocol) -> module
+
+def load_dialect(dialect:str=None):
+    """
+    Make a dialect current for pymavlink and return its module; resolved once per process
+    @param dialect: MAVLink dialect (default: the current one - MAVLINK_DIALECT)
+    Dialects pymavlink does not ship generated are generated into DIALECT_CACHE once and reused by later runs.
+    """
+    dialect = dialect or mavutil.current_dialect
+    protocol = mavparse.PROTOCOL_2_0 if "MAVLINK20" in os.environ else mavparse.PROTOCOL_1_0
+    module = _dialects.get((dialect, protocol))
+    if module is None:
+        package = "v20" if protocol == mavparse.PROTOCOL_2_0 else "v10"
+        try:
+            module = importlib.import_module(f"pymavlink.dialects.{package}.{dialect}")
+        except ImportError:
+            module = _generate_dialect(dialect, protocol, package)
+        _dialects[(dialect, protocol)] = module
+    if mavutil.mavlink is not module:
+        mavutil.mavlink, mavutil.current_dialect = module, dialect
+    return module
+
+def _generate_dialect(dialect:str, protocol:str, package:str):
+    from pymavlink.generator import mavgen
+    definitions = os.path.join(os.path.dirname(mavgen.__file__), "..", "message_definitions", "v1.0")
+    xml = next((path for path in (os.path.join(os.path.dirname(mavutil.__file__), "dialects", package, dialect + ".xml"),
+                                  os.path.join(definitions, dialect + ".xml")) if os.path.exists(path)), None)
+    if xml is None:
+        raise ValueError(f"unknown dialect {dialect}")
+    path = os.path.join(DIALECT_CACHE, package, dialect + ".py")
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(xml):
+        logger.info(f"generating dialect {dialect} into {path}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            generated = mavgen.mavgen(mavgen.Opts(path, protocol, language="Python3"), [xml])
+        if not generated:
+            raise ValueError(f"failed to generate dialect {dialect} from {xml}")
+    spec = importlib.util.spec_from_file_location(f"mavsniff_dialect_{package}_{dialect}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
 def mavlink(uri:str, input:bool, version:int=2, dialect:str=None, **kwargs) -> mavutil.mavfile:
     """
     Create mavlink IO device
@@ -29,7 +80,9 @@ def mavlink(uri:str, input:bool, version:int=2, dialect:str=None, **kwargs) -> m
         uri = ":".join(uri.split("://", 1)) # pymavlink expects `udp:localhost:14550` instead of `udp://localhost:14550`
 
     logger.debug(f"creating mavlink device: {uri}")
-    m = mavutil.mavlink_connection(uri, input=input, dialect=dialect, **clean(kwargs))
+    if dialect is not None:
+        load_dialect(dialect) # instead of pymavlink re-importing it for every device
+    m = mavutil.mavlink_connection(uri, input=input, **clean(kwargs))
     if m is None:
         return None
 
@@ -39,6 +92,42 @@ def mavlink(uri:str, input:bool, version:int=2, dialect:str=None, **kwargs) -> m
         m.WIRE_PROTOCOL_VERSION = mavparse.PROTOCOL_1_0 if version == 1 else mavparse.PROTOCOL_2_0
     return m
 
+def drop_closed_connection(device: mavutil.mavfile) -> bool:
+    """
+    Make a TCP server device accept a new client when the current one has disconnected.
+
+    pymavlink keeps reading the closed socket (getting no data) so waiting for it would never block.
+    """
+    port = getattr(device, "port", None)
+    if not isinstance(device, mavutil.mavtcpin) or port is None:
+        return False
+    try:
+        if port.recv(1, socket.MSG_PEEK):
+            return False
+    except (BlockingIOError, InterruptedError):
+        return False
+    except OSError:
+        pass # connection reset
+    port.close()
+    device.port = None
+    device.fd = device.listen.fileno()
+    logger.info(f"client of {device.address} disconnected")
+    return True
+
+
+def has_peer(device: mavutil.mavfile) -> bool:
+    """
+    Whether bytes written to the device go anywhere.
+
+    UDP servers learn their peers from what they receive and TCP servers wait for a client - until
+    then pymavlink drops written bytes without telling.
+    """
+    if getattr(device, "udp_server", False):
+        return bool(device.clients)
+    if isinstance(device, (mavutil.mavtcp, mavutil.mavtcpin)):
+        return device.port is not None
+    return True
+
 def clean(kwargs:dict) -> dict:
     """Remove None values from a dictionary"""
     return {k: v for k, v in kwargs.items() if v is not None}
\ No newline at end of file
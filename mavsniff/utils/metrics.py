@@ -0,0 +1,258 @@
+import array
+import bisect
+import json
+import sys
+import threading
+import time
+
+from pymavlink import mavutil
+
+from mavsniff.utils.framer import MAGIC_V1, MAGIC_V2, HEADER_LEN_V1, HEADER_LEN_V2
+from mavsniff.utils.log import logger
+
+LATENCY_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5) # seconds
+
+
+class Histogram:
+    """Counts of observed values in buckets with fixed upper bounds (the last bucket is unbounded)"""
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = array.array('Q', bytes(8 * (len(self.bounds) + 1)))
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def observe_all(self, values: list):
+        bounds, counts, bucket = self.bounds, self.counts, bisect.bisect_left
+        for value in values:
+            counts[bucket(bounds, value)] += 1
+        self.sum += sum(values)
+        self.count += len(values)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (inf for the last bucket, None when empty)"""
+        if not self.count:
+            return None
+        seen = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return bound
+        return float("inf")
+
+    def merge(self, other: "Histogram"):
+        """Add counts of another histogram with the same bounds"""
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def snapshot(self) -> dict:
+        return {"buckets": dict(zip(self.bounds + (float("inf"),), self.counts)), "sum": self.sum, "count": self.count}
+
+
+class Metrics:
+    """
+    Per-stream counters of MAVLink traffic updated from a single thread without locking.
+
+    Packets and bytes are counted per message ID and system ID; sequence numbers are tracked per
+    component (sysid, compid) and every skipped number counts as a lost packet. Latency of writing
+    captured packets and lateness of replayed packets go into histograms. Frames re-packed by
+    pymavlink do not carry the original header (decoded capture) so their messages are counted by
+    `observe_message` with the values pymavlink parsed instead. Other threads (HTTP
+    endpoint, JSON lines reporter) only read the counters so a snapshot may be slightly inconsistent.
+    `source` is a function returning the engine's global counters to be exported along.
+    """
+
+    def __init__(self, dialect=None):
+        self.dialect = dialect or mavutil.mavlink
+        self.streams = {} # (msgid << 8) | sysid -> [packets, bytes]
+        # per component (sysid << 8) | compid
+        self.last_seq = bytearray(65536)
+        self.seq_received = array.array('Q', bytes(8 * 65536))
+        self.seq_lost = array.array('Q', bytes(8 * 65536))
+        self.write_latency = Histogram()
+        self.lateness = Histogram()
+        self.source = None
+
+    def observe(self, frames: list):
+        """Count raw MAVLink frames (other data are ignored)"""
+        streams, last_seq, received, lost = self.streams, self.last_seq, self.seq_received, self.seq_lost
+        for frame in frames:
+            if frame[0] == MAGIC_V2 and len(frame) >= HEADER_LEN_V2:
+                key = ((frame[7] | (frame[8] << 8) | (frame[9] << 16)) << 8) | frame[5]
+                component, seq = (frame[5] << 8) | frame[6], frame[4]
+            elif frame[0] == MAGIC_V1 and len(frame) >= HEADER_LEN_V1:
+                key = (frame[5] << 8) | frame[3]
+                component, seq = (frame[3] << 8) | frame[4], frame[2]
+            else:
+                continue
+            stream = streams.get(key)
+            if stream is None:
+                stream = streams[key] = [0, 0]
+            stream[0] += 1
+            stream[1] += len(frame)
+            if received[component]:
+                missing = (seq - last_seq[component] - 1) & 0xFF
+                if missing:
+                    lost[component] += missing
+            received[component] += 1
+            last_seq[component] = seq
+
+    def observe_message(self, msgid: int, sysid: int, compid: int, seq: int, size: int):
+        """Count a message by the header it was received with"""
+        key, component = (msgid << 8) | sysid, (sysid << 8) | compid
+        stream = self.streams.get(key)
+        if stream is None:
+            stream = self.streams[key] = [0, 0]
+        stream[0] += 1
+        stream[1] += size
+        if self.seq_received[component]:
+            self.seq_lost[component] += (seq - self.last_seq[component] - 1) & 0xFF
+        self.seq_received[component] += 1
+        self.last_seq[component] = seq
+
+    def observe_written(self, batch: list, now_us: int, count_frames: bool = True):
+        """Count a batch of `(timestamp_us, interface_id, frame)` written at now_us (only its latency without `count_frames`)"""
+        if count_frames:
+            self.observe([frame for _, _, frame in batch])
+        self.write_latency.observe_all([(now_us - timestamp_us) * 1e-6 for timestamp_us, _, _ in batch])
+
+    def _name(self, msgid: int) -> str:
+        msgtype = self.dialect.mavlink_map.get(msgid)
+        return msgtype.msgname if msgtype is not None else str(msgid)
+
+    def snapshot(self) -> dict:
+        """All counters as a JSON-serializable dictionary"""
+        return {
+            "time": time.time(),
+            "engine": self.source() if self.source else {},
+            "streams": [{"msgid": key >> 8, "name": self._name(key >> 8), "sysid": key & 0xFF, "packets": packets, "bytes": size}
+                        for key, (packets, size) in list(self.streams.items())],
+            "components": [{"sysid": key >> 8, "compid": key & 0xFF, "received": received, "lost": self.seq_lost[key]}
+                           for key, received in enumerate(self.seq_received) if received],
+            "write_latency": self.write_latency.snapshot(),
+            "lateness": self.lateness.snapshot(),
+        }
+
+    def prometheus(self) -> str:
+        """Counters in Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        for key, value in snapshot["engine"].items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines += [f"# TYPE mavsniff_{key} gauge", f"mavsniff_{key} {value}"]
+        for metric, field in (("packets", "packets"), ("bytes", "bytes")):
+            lines.append(f"# TYPE mavsniff_{metric}_total counter")
+            for stream in snapshot["streams"]:
+                lines.append(f'mavsniff_{metric}_total{{msgid="{stream["msgid"]}",name="{stream["name"]}",sysid="{stream["sysid"]}"}} {stream[field]}')
+        for metric, field in (("seq_received", "received"), ("seq_lost", "lost")):
+            lines.append(f"# TYPE mavsniff_{metric}_total counter")
+            for component in snapshot["components"]:
+                lines.append(f'mavsniff_{metric}_total{{sysid="{component["sysid"]}",compid="{component["compid"]}"}} {component[field]}')
+        for metric, histogram in (("write_latency_seconds", self.write_latency), ("replay_lateness_seconds", self.lateness)):
+            if not histogram.count:
+                continue
+            lines.append(f"# TYPE mavsniff_{metric} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.bounds + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f'mavsniff_{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines += [f"mavsniff_{metric}_sum {histogram.sum}", f"mavsniff_{metric}_count {histogram.count}"]
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer(threading.Thread):
+    """Serve metrics in Prometheus text format at http://127.0.0.1:<port>/metrics from a daemon thread"""
+
+    def __init__(self, metrics: Metrics, port: int, host: str = "127.0.0.1"):
+        import http.server # only when metrics are served; it pulls in email and ssl
+        super().__init__(name="mavsniff-metrics", daemon=True)
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?")[0] not in ("/", "/metrics"):
+                    handler.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass # do not spam the console with every scrape
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class JsonLinesReporter(threading.Thread):
+    """Append a snapshot of metrics with rates since the previous one as a JSON line to a file ("-" for stdout) every interval seconds"""
+
+    def __init__(self, metrics: Metrics, path: str, interval: float = 1.0):
+        super().__init__(name="mavsniff-metrics-json", daemon=True)
+        self.metrics = metrics
+        self.file = sys.stdout if path == "-" else open(path, "a")
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.previous = {}
+        self.previous_time = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+        self.report()
+
+    def report(self):
+        snapshot = self.metrics.snapshot()
+        elapsed = snapshot["time"] - self.previous_time if self.previous_time else None
+        for stream in snapshot["streams"]:
+            key = (stream["msgid"], stream["sysid"])
+            packets, size = self.previous.get(key, (0, 0))
+            self.previous[key] = (stream["packets"], stream["bytes"])
+            if elapsed:
+                stream["packets_per_s"] = (stream["packets"] - packets) / elapsed
+                stream["bytes_per_s"] = (stream["bytes"] - size) / elapsed
+        self.previous_time = snapshot["time"]
+        try:
+            self.file.write(json.dumps(snapshot) + "\n")
+            self.file.flush()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to write metrics: {e}")
+            self.stopped.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+def start_reporters(metrics: Metrics, port: int = None, json_path: str = None) -> list:
+    """Start the HTTP endpoint and/or JSON lines reporter; return them so they can be stopped"""
+    reporters = []
+    try:
+        if port is not None:
+            reporters.append(MetricsServer(metrics, port))
+            logger.info(f"serving metrics at http://127.0.0.1:{reporters[-1].port}/metrics")
+        if json_path:
+            reporters.append(JsonLinesReporter(metrics, json_path))
+    except Exception:
+        for reporter in reporters:
+            reporter.server.server_close()
+        raise
+    for reporter in reporters:
+        reporter.start()
+    return reporters
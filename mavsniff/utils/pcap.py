@@ -0,0 +1,405 @@
+import io
+import mmap
+import struct
+
+import pcapng
+
+from mavsniff.utils.ip import udp_header
+
+EPB_MAGIC = 0x00000006
+EPB_HEADER_LEN = 28 # type, total length, interface, timestamp high/low, captured and packet length
+UDP_HEADER_LEN = len(udp_header(0, 0))
+MAX_FRAME_LEN = 280 # MAVLink v2 with full payload and signature
+
+
+class PacketEncoder:
+    """
+    Encode Enhanced Packet Blocks with a MAVLink frame wrapped in mavsniff's UDP header.
+
+    The block is built in a preallocated buffer from a template - only lengths, sequence number
+    and timestamp get patched for every packet. Output is byte-identical to python-pcapng's
+    `EnhancedPacket` without options.
+    """
+
+    _epb = struct.Struct("<IIIIIII")
+    _ip = struct.Struct(">HH") # IP total length + identification
+    _udp = struct.Struct(">H") # UDP length
+    _trailer = struct.Struct("<I")
+
+    def __init__(self, interface_id: int = 0):
+        self.interface_id = interface_id
+        self._allocate(MAX_FRAME_LEN)
+
+    def _allocate(self, max_data_len: int):
+        self.buffer = bytearray(EPB_HEADER_LEN + UDP_HEADER_LEN + max_data_len + 3 + 4)
+        self.buffer[EPB_HEADER_LEN:EPB_HEADER_LEN + UDP_HEADER_LEN] = udp_header(0, 0)
+        self.view = memoryview(self.buffer)
+        self.max_data_len = max_data_len
+
+    def encode(self, seq: int, data: bytes, timestamp_us: int, interface_id: int = None) -> memoryview:
+        """Return a view of the encoded block, valid until the next call to encode"""
+        dl = len(data)
+        if dl > self.max_data_len:
+            self._allocate(dl)
+        buffer = self.buffer
+        captured_len = UDP_HEADER_LEN + dl
+        padded_len = (captured_len + 3) & ~3
+        total_len = EPB_HEADER_LEN + padded_len + 4
+        self._epb.pack_into(buffer, 0, EPB_MAGIC, total_len,
+            self.interface_id if interface_id is None else interface_id,
+            timestamp_us >> 32, timestamp_us & 0xFFFFFFFF, captured_len, captured_len)
+        self._ip.pack_into(buffer, EPB_HEADER_LEN + 6, (20 + dl) & 0xFFFF, seq & 0xFFFF)
+        self._udp.pack_into(buffer, EPB_HEADER_LEN + UDP_HEADER_LEN - 4, dl & 0xFFFF)
+        start = EPB_HEADER_LEN + UDP_HEADER_LEN
+        buffer[start:start + dl] = data
+        for i in range(start + dl, EPB_HEADER_LEN + padded_len):
+            buffer[i] = 0
+        self._trailer.pack_into(buffer, EPB_HEADER_LEN + padded_len, total_len)
+        return self.view[:total_len]
+
+    def encode_packet(self, packet: bytes, timestamp_us: int, interface_id: int = None) -> bytes:
+        """Return a block carrying an already encapsulated packet (e.g. copied from another recording)"""
+        captured_len = len(packet)
+        padding = -captured_len & 3
+        total_len = EPB_HEADER_LEN + captured_len + padding + 4
+        return b"".join((
+            self._epb.pack(EPB_MAGIC, total_len, self.interface_id if interface_id is None else interface_id,
+                           timestamp_us >> 32, timestamp_us & 0xFFFFFFFF, captured_len, captured_len),
+            packet, bytes(padding), self._trailer.pack(total_len)))
+
+
+def section_header(interfaces: list) -> bytes:
+    """
+    Section header and interface description blocks starting every file written by mavsniff.
+
+    `interfaces` are dictionaries of IDB options (if_name, if_description, if_txspeed...) optionally
+    with `link_type`; timestamps of all interfaces are in microseconds.
+    """
+    shb = pcapng.blocks.SectionHeader(msgid=0, endianness="<", options={
+        'shb_userappl': 'mavsniff',
+    })
+    for interface_id, options in enumerate(interfaces):
+        options = dict(options)
+        link_type = options.pop("link_type", 0)
+        options['if_tsresol'] = struct.pack('<B', 6) # negative power of 10
+        shb.register_interface(pcapng.blocks.InterfaceDescription(msdgid=0x01, endianness="<", interface_id=interface_id, section=shb,
+                                                                  link_type=link_type, options=options))
+    header = io.BytesIO()
+    pcapng.FileWriter(header, shb)
+    return header.getvalue()
+
+
+SHB_MAGIC = 0x0A0D0D0A
+IDB_MAGIC = 0x00000001
+SPB_MAGIC = 0x00000003
+IF_NAME = 2
+IF_DESCRIPTION = 3
+IF_SPEED = 8
+IF_TSRESOL = 9
+IF_TSOFFSET = 14
+IF_TXSPEED = 16
+IF_RXSPEED = 17
+
+
+class Interface:
+    """Properties of an interface (IDB) needed to read its packets"""
+
+    def __init__(self, link_type: int, snap_len: int, resolution: float = 1e-6, offset: int = 0):
+        self.link_type = link_type
+        self.snap_len = snap_len
+        self.resolution = resolution # seconds per timestamp unit
+        self.offset = offset # seconds to add to every timestamp
+        self.speed = 0 # bits per second of the captured link (if_speed/if_txspeed/if_rxspeed) or 0 if unknown
+        self.name = None # if_name
+        self.description = None # if_description
+
+
+DEFAULT_INTERFACE = Interface(link_type=0, snap_len=0)
+STREAM_CHUNK = 1 << 20 # bytes read at once from files that can not be mapped
+
+
+class CaptureReader:
+    """
+    Memory-mapped capture file yielding packets without copying them.
+
+    The file is memory-mapped (in-memory files are read through their buffer) and payloads are
+    memoryviews into the mapping - valid only until the reader is closed. Files that can not be
+    mapped (compressed segments, pipes) are streamed: `view` holds the chunk being read that
+    starts at file offset `base`, so memory stays bounded by the chunk size. Reading starts at the
+    current position of the file; offsets of packets are file offsets either way. `interfaces`
+    describe the links packets were captured on.
+    """
+
+    def __init__(self, file):
+        self.mmap = None
+        self.stream = None # file read in chunks as packets are iterated
+        try:
+            self.base = file.tell() # file offset of the view
+        except (AttributeError, OSError):
+            self.base = 0 # pipes do not tell
+        if isinstance(getattr(file, "raw", file), io.FileIO): # decompressing files give the fileno of the compressed one
+            try:
+                self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                pass # empty files and pipes can not be mapped
+        if self.mmap is not None:
+            self.view = memoryview(self.mmap)[self.base:]
+        elif hasattr(file, "getbuffer"):
+            self.view = memoryview(file.getbuffer())[self.base:]
+        else:
+            self.stream = file
+            self.view = memoryview(b"")
+        self.interfaces = []
+        self.skipped = 0 # number of blocks that do not carry packets
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.view.release()
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                pass # some payload is still referenced; the mapping is freed with it
+
+    def __iter__(self):
+        for _, _, timestamp, payload in self.records():
+            yield timestamp, payload
+
+    def _more(self, pos: int, size: int) -> int:
+        """
+        Read on from a streamed file so `size` bytes from `pos` of the view are available; return
+        the position they moved to. Payloads yielded before keep the chunk they point into.
+        """
+        if self.stream is None:
+            return pos
+        rest = self.view[pos:]
+        chunks = [bytes(rest)]
+        available = len(rest)
+        while available < size:
+            data = self.stream.read(max(size - available, STREAM_CHUNK))
+            if not data:
+                break
+            chunks.append(data)
+            available += len(data)
+        if len(chunks) == 1:
+            return pos
+        self.base += pos
+        self.view = memoryview(b"".join(chunks))
+        return 0
+
+    def records(self, start: int = 0):
+        """Yield `(offset, interface_id, timestamp, payload)` of every packet starting at a packet offset (implemented by every format)"""
+        raise NotImplementedError
+
+    def boundaries(self, parts: int) -> list:
+        """Offsets of packets splitting the file into about `parts` chunks (always starting where reading starts); streams are not split"""
+        return [self.base]
+
+
+class PcapngReader(CaptureReader):
+    """
+    Iterate over packets of a pcapng file as `(timestamp, payload)` without copying them.
+
+    Sections of both endiannesses, per-interface `if_tsresol` and `if_tsoffset`, Enhanced and
+    Simple Packet Blocks are supported; other blocks are skipped.
+    """
+
+    def records(self, start: int = 0):
+        """
+        Yield `(offset, interface_id, timestamp, payload)` of every packet block.
+
+        Reading can start at the offset of a packet block (see `mavsniff.index`). Blocks before it
+        are walked by their headers only - packets are skipped but every section and interface block
+        is read so the packets use the byte order, interfaces and resolution of their own section.
+        """
+        view, end = self.view, len(self.view)
+        pos = 0
+        byte_order = "<"
+        header = struct.Struct("<II")
+        epb = struct.Struct("<IIIII")
+        spb = struct.Struct("<I")
+        timestamp = 0.0
+        while True:
+            if pos + 12 > end:
+                pos = self._more(pos, 12)
+                view, end = self.view, len(self.view)
+                if pos + 12 > end:
+                    break
+            block_type, block_len = header.unpack_from(view, pos)
+            if block_type == SHB_MAGIC: # palindrome - readable before knowing the byte order
+                byte_order = "<" if view[pos + 8:pos + 12] == b"\x4d\x3c\x2b\x1a" else ">"
+                header = struct.Struct(byte_order + "II")
+                epb = struct.Struct(byte_order + "IIIII")
+                spb = struct.Struct(byte_order + "I")
+                block_len = header.unpack_from(view, pos)[1]
+                self.interfaces = []
+            if pos + block_len > end:
+                pos = self._more(pos, block_len)
+                view, end = self.view, len(self.view)
+            if block_len < 12 or pos + block_len > end:
+                break # truncated file
+            if self.base + pos < start and (block_type == EPB_MAGIC or block_type == SPB_MAGIC):
+                pos += block_len
+                continue
+            if block_type == EPB_MAGIC:
+                interface_id, ts_high, ts_low, captured_len, _ = epb.unpack_from(view, pos + 8)
+                interface = self.interfaces[interface_id] if interface_id < len(self.interfaces) else DEFAULT_INTERFACE
+                timestamp = ((ts_high << 32) | ts_low) * interface.resolution + interface.offset
+                yield self.base + pos, interface_id, timestamp, view[pos + 28:pos + 28 + min(captured_len, block_len - 32)]
+            elif block_type == SPB_MAGIC:
+                # simple packets have no timestamp - they inherit the previous packet's one
+                packet_len = spb.unpack_from(view, pos + 8)[0]
+                captured_len = min(packet_len, block_len - 16)
+                if self.interfaces and self.interfaces[0].snap_len:
+                    captured_len = min(captured_len, self.interfaces[0].snap_len)
+                yield self.base + pos, 0, timestamp, view[pos + 12:pos + 12 + captured_len]
+            elif block_type == IDB_MAGIC:
+                self.interfaces.append(self._interface(view[pos:pos + block_len], byte_order))
+                self.skipped += 1
+            else:
+                self.skipped += 1
+            pos += block_len
+
+    def boundaries(self, parts: int) -> list:
+        """
+        Offsets of packet blocks splitting the file into about `parts` chunks (always starting where reading starts).
+
+        Blocks are found near the even split points by their type, 4-byte alignment and a total
+        length matching the trailer - for this block and the one following it, in either byte order.
+        """
+        view, end = self.view, len(self.view)
+        if self.stream is not None:
+            return [self.base]
+        offsets = [0]
+        for part in range(1, parts):
+            pos = max(offsets[-1] + 1, end * part // parts)
+            pos = self._find_block(view, (pos + 3) & ~3, end)
+            if pos is None:
+                break
+            if pos > offsets[-1]:
+                offsets.append(pos)
+        return [self.base + offset for offset in offsets]
+
+    @staticmethod
+    def _find_block(view: memoryview, pos: int, end: int) -> int:
+        while pos + 12 <= end:
+            for byte_order in "<>": # sections of a file may differ
+                block_type, block_len = struct.unpack_from(byte_order + "II", view, pos)
+                if block_type in (EPB_MAGIC, SPB_MAGIC) and PcapngReader._valid_block(view, pos, end, byte_order):
+                    following = pos + block_len
+                    if following == end or PcapngReader._valid_block(view, following, end, byte_order):
+                        return pos
+            pos += 4
+        return None
+
+    @staticmethod
+    def _valid_block(view: memoryview, pos: int, end: int, byte_order: str) -> bool:
+        if pos + 12 > end:
+            return False
+        block_type, block_len = struct.unpack_from(byte_order + "II", view, pos)
+        return (block_type in (EPB_MAGIC, SPB_MAGIC, IDB_MAGIC, SHB_MAGIC) and block_len >= 12 and block_len % 4 == 0
+                and pos + block_len <= end and struct.unpack_from(byte_order + "I", view, pos + block_len - 4)[0] == block_len)
+
+    @staticmethod
+    def _interface(block: memoryview, byte_order: str) -> Interface:
+        link_type, _, snap_len = struct.unpack_from(byte_order + "HHI", block, 8)
+        interface = Interface(link_type, snap_len)
+        pos, end = 16, len(block) - 4
+        while pos + 4 <= end:
+            code, length = struct.unpack_from(byte_order + "HH", block, pos)
+            if code == 0:
+                break
+            value = block[pos + 4:pos + 4 + length]
+            if code == IF_NAME:
+                interface.name = bytes(value).decode(errors="replace")
+            elif code == IF_DESCRIPTION:
+                interface.description = bytes(value).decode(errors="replace")
+            elif code == IF_TSRESOL and length >= 1:
+                resol = value[0]
+                interface.resolution = 2.0 ** -(resol & 0x7f) if resol & 0x80 else 10.0 ** -resol
+            elif code == IF_TSOFFSET and length >= 8:
+                interface.offset = struct.unpack_from(byte_order + "q", value)[0]
+            elif code in (IF_SPEED, IF_TXSPEED, IF_RXSPEED) and length >= 8:
+                interface.speed = max(interface.speed, struct.unpack_from(byte_order + "Q", value)[0])
+            pos += 4 + ((length + 3) & ~3)
+        return interface
+
+
+PCAP_MAGICS = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6), b"\xa1\xb2\xc3\xd4": (">", 1e-6), # microsecond timestamps
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9), b"\xa1\xb2\x3c\x4d": (">", 1e-9), # nanosecond timestamps
+}
+PCAP_HEADER_LEN = 24
+PCAP_RECORD_LEN = 16
+
+
+class PcapReader(CaptureReader):
+    """
+    Iterate over packets of a classic libpcap file (as written by tcpdump) as `(timestamp, payload)`.
+
+    Files of both byte orders with micro- or nanosecond timestamps are supported; all packets
+    belong to a single interface with the file's link type.
+    """
+
+    def records(self, start: int = 0):
+        self._more(0, PCAP_HEADER_LEN)
+        view, end = self.view, len(self.view)
+        if end < PCAP_HEADER_LEN or bytes(view[:4]) not in PCAP_MAGICS:
+            return
+        byte_order, resolution = PCAP_MAGICS[bytes(view[:4])]
+        snap_len, link_type = struct.unpack_from(byte_order + "II", view, 16)
+        self.interfaces = [Interface(link_type & 0x0FFFFFFF, snap_len, resolution)] # upper bits carry FCS length
+        record = struct.Struct(byte_order + "IIII")
+        pos = max(start - self.base, PCAP_HEADER_LEN) if self.stream is None else PCAP_HEADER_LEN # streams are read through to start
+        while True:
+            if pos + PCAP_RECORD_LEN > end:
+                pos = self._more(pos, PCAP_RECORD_LEN)
+                view, end = self.view, len(self.view)
+                if pos + PCAP_RECORD_LEN > end:
+                    break
+            seconds, fraction, captured_len, _ = record.unpack_from(view, pos)
+            record_len = PCAP_RECORD_LEN + captured_len
+            if pos + record_len > end:
+                pos = self._more(pos, record_len)
+                view, end = self.view, len(self.view)
+                if pos + record_len > end:
+                    break # truncated file
+            if self.base + pos >= start:
+                yield self.base + pos, 0, seconds + fraction * resolution, view[pos + PCAP_RECORD_LEN:pos + record_len]
+            pos += record_len
+
+    def boundaries(self, parts: int) -> list:
+        """
+        Offsets of records splitting the file into about `parts` chunks (always starting where reading starts).
+
+        Records carry no marker to search for near the split points so their headers are hopped
+        over from the start - reading a length per record, not the packets.
+        """
+        view, end = self.view, len(self.view)
+        if self.stream is not None or end < PCAP_HEADER_LEN or bytes(view[:4]) not in PCAP_MAGICS:
+            return [self.base]
+        length = struct.Struct(PCAP_MAGICS[bytes(view[:4])][0] + "I")
+        offsets = [0]
+        pos = PCAP_HEADER_LEN
+        for part in range(1, parts):
+            split = end * part // parts
+            while pos < split and pos + PCAP_RECORD_LEN <= end:
+                pos += PCAP_RECORD_LEN + length.unpack_from(view, pos + 8)[0]
+            if pos + PCAP_RECORD_LEN > end:
+                break
+            if pos > offsets[-1]:
+                offsets.append(pos)
+        return [self.base + offset for offset in offsets]
+
+
+def open_reader(file) -> CaptureReader:
+    """Reader of a pcapng or classic pcap file (told apart by the magic number)"""
+    position = file.tell()
+    magic = file.read(4)
+    file.seek(position)
+    return PcapReader(file) if magic in PCAP_MAGICS else PcapngReader(file)
@@ -0,0 +1,142 @@
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import tracemalloc
+
+from mavsniff.utils.log import logger
+from mavsniff.utils.metrics import Histogram
+from mavsniff.utils.timing import clock
+
+STAGES = ("read", "parse", "pack", "encode", "write", "sleep")
+STAGE_BOUNDS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                0.0025, 0.005, 0.01, 0.025, 0.1, 1.0) # seconds
+MODES = ("timers", "cprofile", "tracemalloc")
+SHARED_PROFILE = sys.version_info >= (3, 12) # cProfile on sys.monitoring: one profile for all threads
+DEFAULT_WINDOW = 10.0 # seconds of cProfile/tracemalloc from the start
+TOP = 25 # functions or allocation sites in the report
+
+
+class Profiler:
+    """
+    Time spent in the stages of the capture/replay hot path with optional cProfile or tracemalloc.
+
+    Engines call `observe(stage, started)` with the `clock()` reading taken before the stage; it
+    returns the current reading so that consecutive stages cost one clock call each. Engines keep
+    `None` instead of a profiler when profiling is off so that costs a single comparison.
+
+    Stages: read (bytes from a device or records from a file), parse (framing, pymavlink's
+    `recv_msg` - including its read - or decapsulation), pack (`msg.pack` of decoded messages),
+    encode (pcapng blocks with their IP/UDP headers), write (file or device writes) and sleep
+    (waiting for data or for packets to be due).
+
+    cProfile profiles the threads that call `enter_thread` (from Python 3.12 the first profile
+    enabled covers all threads and no other can be enabled) and tracemalloc traces the whole
+    process, both only for the first `window` seconds.
+    """
+
+    def __init__(self, mode: str = "timers", window: float = DEFAULT_WINDOW):
+        if mode not in MODES:
+            raise ValueError(f"unknown profiling mode {mode}; choices: {MODES}")
+        self.mode = mode
+        self.window = window
+        self.stages = {stage: Histogram(STAGE_BOUNDS) for stage in STAGES}
+        self.max = dict.fromkeys(STAGES, 0.0)
+        self.started = None
+        self.finished = None
+        self.deadline = None # end of the cProfile/tracemalloc window while it is open
+        self.profiles = []
+        self.active = 0 # threads with cProfile enabled
+        self.snapshot = None
+        self.peak = 0 # bytes traced by tracemalloc at most
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.started = clock()
+        if self.mode != "timers":
+            self.deadline = self.started + self.window
+        if self.mode == "tracemalloc":
+            tracemalloc.start(10)
+
+    def enter_thread(self):
+        """Profile the calling thread with cProfile (within the window)"""
+        if self.mode == "cprofile" and self.deadline is not None and clock() < self.deadline:
+            profile = cProfile.Profile()
+            with self._lock:
+                if SHARED_PROFILE and self.profiles:
+                    return
+                try:
+                    profile.enable()
+                except ValueError as e: # another profiler is active; profiling must not stop the engine
+                    logger.warning(f"cProfile not enabled: {e}")
+                    return
+                self.profiles.append(profile)
+                self.active += 1
+            self._local.profile = profile
+
+    def leave_thread(self):
+        profile = getattr(self._local, "profile", None)
+        if profile is not None:
+            profile.disable()
+            self._local.profile = None
+            with self._lock:
+                self.active -= 1
+
+    def observe(self, stage: str, started: float) -> float:
+        now = clock()
+        seconds = now - started
+        self.stages[stage].observe(seconds)
+        if seconds > self.max[stage]:
+            self.max[stage] = seconds
+        if self.deadline is not None and now >= self.deadline:
+            self._close_window()
+        return now
+
+    def _close_window(self):
+        self.leave_thread() # other threads are left when they observe next
+        with self._lock:
+            if self.mode == "tracemalloc" and tracemalloc.is_tracing():
+                self.snapshot = tracemalloc.take_snapshot()
+                self.peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            if not self.active:
+                self.deadline = None
+
+    def finish(self):
+        """Stop profiling the calling thread and tracing memory (at exit)"""
+        self._close_window()
+        self.deadline = None
+        self.finished = clock()
+
+    def report(self) -> str:
+        elapsed = ((self.finished or clock()) - self.started) if self.started is not None else 0.0
+        lines = [f"profile of {elapsed:.1f}s", f"{'stage':<7} {'calls':>10} {'total s':>9} {'share':>6} {'mean us':>9} {'p50 us':>9} {'p99 us':>9} {'max us':>9}"]
+        for stage, histogram in self.stages.items():
+            if not histogram.count:
+                continue
+            bound = lambda q: f"<{histogram.quantile(q) * 1e6:g}" if histogram.quantile(q) != float("inf") else "long"
+            lines.append(f"{stage:<7} {histogram.count:>10} {histogram.sum:>9.3f} {histogram.sum / elapsed * 100 if elapsed else 0:>5.1f}% "
+                         f"{histogram.sum / histogram.count * 1e6:>9.1f} {bound(0.5):>9} {bound(0.99):>9} {self.max[stage] * 1e6:>9.0f}")
+        if self.profiles:
+            text = io.StringIO()
+            stats = pstats.Stats(*self.profiles, stream=text)
+            stats.sort_stats("cumulative").print_stats(TOP)
+            lines += [f"cProfile of the first {self.window:g}s:", text.getvalue().strip()]
+        if self.snapshot is not None:
+            snapshot = self.snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                                    tracemalloc.Filter(False, "<frozen importlib._bootstrap>")))
+            lines.append(f"memory allocated in the first {self.window:g}s: peak {self.peak / 1024:.1f} KiB, still held at its end:")
+            lines += [f"{stat.size / 1024:>9.1f} KiB {stat.count:>8} blocks  {stat.traceback}" for stat in snapshot.statistics("lineno")[:TOP]]
+        return "\n".join(lines)
+
+    def save(self, path: str = None):
+        """Log the report and write it to a file if given (with raw cProfile statistics in `<path>.prof` for other viewers)"""
+        report = self.report()
+        logger.info(report)
+        if path:
+            with open(path, "w") as file:
+                file.write(report + "\n")
+            if self.profiles:
+                pstats.Stats(*self.profiles).dump_stats(path + ".prof")
@@ -0,0 +1,160 @@
+import struct
+import threading
+
+BLOCK = "block"
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+
+class RingBuffer:
+    """
+    Bounded FIFO of preallocated slots handing items from one producer thread to one consumer thread.
+
+    When the buffer is full the producer either blocks or drops the oldest or the newest item
+    depending on the overflow policy. High-water mark and number of dropped items are kept for stats.
+    """
+
+    def __init__(self, capacity: int, policy: str = BLOCK):
+        if capacity < 1:
+            raise ValueError("ring buffer capacity must be positive")
+        if policy not in POLICIES:
+            raise ValueError(f"unknown overflow policy {policy}; choices: {POLICIES}")
+        self.slots = [None] * capacity
+        self.capacity = capacity
+        self.policy = policy
+        self.head = 0 # index of the oldest item
+        self.count = 0
+        self.high_water = 0
+        self.dropped = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+    def __len__(self):
+        return self.count
+
+    def put(self, item, timeout: float = 0.1) -> bool:
+        """Store an item; return False if the item was dropped or the buffer is closed"""
+        with self.lock:
+            if self.count == self.capacity:
+                if self.policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.policy == DROP_OLDEST:
+                    self.head = (self.head + 1) % self.capacity
+                    self.count -= 1
+                    self.dropped += 1
+                else:
+                    while self.count == self.capacity and not self.closed:
+                        self.not_full.wait(timeout)
+            if self.closed:
+                return False
+            self.slots[(self.head + self.count) % self.capacity] = item
+            self.count += 1
+            if self.count > self.high_water:
+                self.high_water = self.count
+            self.not_empty.notify()
+        return True
+
+    def get_batch(self, max_items: int, timeout: float = 0.1) -> list:
+        """Remove and return up to max_items oldest items; wait up to timeout for at least one"""
+        with self.lock:
+            if self.count == 0 and not self.closed:
+                self.not_empty.wait(timeout)
+            n = min(self.count, max_items)
+            batch = []
+            slots, head, capacity = self.slots, self.head, self.capacity
+            for _ in range(n):
+                batch.append(slots[head])
+                slots[head] = None
+                head = (head + 1) % capacity
+            self.head = head
+            self.count -= n
+            if n:
+                self.not_full.notify()
+            return batch
+
+    def close(self):
+        """Wake up both sides; no more items will be accepted"""
+        with self.lock:
+            self.closed = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+
+
+class FrameRing:
+    """
+    Fixed-size byte ring keeping the most recent frames with their timestamps and interface IDs.
+
+    Records `timestamp (us), interface ID, length, data` are copied into one preallocated bytearray;
+    the oldest records get overwritten when there is no space. A record that does not fit before
+    the end of the buffer starts again at its beginning. Only the writer thread may use the ring.
+    """
+
+    _record = struct.Struct("<QHH")
+    WRAP = 0xFFFF # length of the marker telling that records continue from the beginning
+
+    def __init__(self, capacity: int):
+        if capacity < self._record.size:
+            raise ValueError("frame ring capacity is too small")
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.capacity = capacity
+        self.head = 0 # offset of the oldest record
+        self.tail = 0 # offset for the next record
+        self.count = 0
+        self.overwritten = 0
+
+    def __len__(self):
+        return self.count
+
+    def put(self, timestamp_us: int, interface_id: int, data: bytes) -> bool:
+        """Copy a frame into the ring overwriting the oldest ones if needed; False if it can never fit"""
+        size = self._record.size + len(data)
+        if size > self.capacity or len(data) >= self.WRAP:
+            return False
+        if self.count == 0:
+            self.head = self.tail = 0
+        tail = self.tail
+        if tail + size > self.capacity:
+            while self.count and self.head >= tail: # records behind the tail up to the end
+                self._evict()
+            if self.capacity - tail >= self._record.size:
+                self._record.pack_into(self.buffer, tail, 0, 0, self.WRAP)
+            tail = 0
+        while self.count and tail <= self.head < tail + size:
+            self._evict()
+        if self.count == 0:
+            self.head = tail
+        self._record.pack_into(self.buffer, tail, timestamp_us, interface_id, len(data))
+        start = tail + self._record.size
+        self.buffer[start:start + len(data)] = data
+        self.tail = start + len(data)
+        self.count += 1
+        return True
+
+    def _next(self, pos: int) -> int:
+        """Offset of the record following the one at pos (0 if the records continue from the beginning)"""
+        pos += self._record.size + self._record.unpack_from(self.buffer, pos)[2]
+        if self.capacity - pos < self._record.size or self._record.unpack_from(self.buffer, pos)[2] == self.WRAP:
+            return 0
+        return pos
+
+    def _evict(self):
+        self.head = self._next(self.head)
+        self.count -= 1
+        self.overwritten += 1
+
+    def __iter__(self):
+        """Yield `(timestamp_us, interface_id, data)` from the oldest record; data are views into the ring"""
+        pos = self.head
+        for _ in range(self.count):
+            timestamp_us, interface_id, length = self._record.unpack_from(self.buffer, pos)
+            start = pos + self._record.size
+            yield timestamp_us, interface_id, self.view[start:start + length]
+            pos = self._next(pos)
+
+    def clear(self):
+        self.head = self.tail = self.count = 0
@@ -0,0 +1,135 @@
+import concurrent.futures
+import glob
+import gzip
+import lzma
+import os
+import re
+import shutil
+import time
+
+from mavsniff.utils.log import logger
+
+COMPRESSIONS = {"gzip": (".gz", gzip.open), "lzma": (".xz", lzma.open)}
+COMPRESSED_SUFFIXES = {suffix: opener for suffix, opener in COMPRESSIONS.values()}
+SEGMENT_SUFFIXES = (".pcapng",) + tuple(".pcapng" + suffix for suffix in COMPRESSED_SUFFIXES)
+SEGMENT_NAME = re.compile(r"(.*-\d{8}-\d{6})(?:-(\d+))?") # <stem>-<time> with a counter when the second was taken
+
+
+def compress(path: str, compression: str) -> str:
+    """Compress a closed segment next to itself and remove the original; return the new path"""
+    suffix, opener = COMPRESSIONS[compression]
+    with open(path, "rb") as source, opener(path + suffix + ".part", "wb") as target:
+        shutil.copyfileobj(source, target, 1 << 20)
+    os.replace(path + suffix + ".part", path + suffix)
+    os.remove(path)
+    return path + suffix
+
+
+def segment_path(stem: str) -> str:
+    """Unused path `<stem>-<YYYYmmdd-HHMMSS>.pcapng` for a file segment started now"""
+    name = f"{stem}-{time.strftime('%Y%m%d-%H%M%S')}"
+    path, n = name + ".pcapng", 1
+    while any(os.path.exists(path + suffix) for suffix in ("",) + tuple(COMPRESSED_SUFFIXES)):
+        n += 1
+        path = f"{name}-{n}.pcapng"
+    return path
+
+
+class RotatingFile:
+    """
+    Writable file split into segments by size and/or age.
+
+    The owner writes whole blocks and calls `rotate(header)` when `should_rotate()` tells so; the
+    header (SHB and IDBs) starts every new segment so each one is a self-contained pcapng file.
+    Segments are named `<stem>-<YYYYmmdd-HHMMSS>.pcapng` after the time they were opened. Closed
+    segments are compressed by a background worker thread so the capture never waits for it.
+    """
+
+    def __init__(self, path: str, size: int = None, interval: float = None, compression: str = None):
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression {compression}; choices: {tuple(COMPRESSIONS)}")
+        self.stem = path[:-len(".pcapng")] if path.endswith(".pcapng") else path
+        self.size = size # bytes per segment
+        self.interval = interval # seconds per segment
+        self.compression = compression
+        self.compressor = concurrent.futures.ThreadPoolExecutor(max_workers=1) if compression else None
+        self.pending = [] # compressions in progress
+        self.segments = [] # paths of all segments opened so far
+        self.file = None
+        self._open()
+
+    def _open(self):
+        path = segment_path(self.stem)
+        self.file = open(path, "wb")
+        self.segments.append(path)
+        self.written = 0
+        self.opened = time.monotonic()
+
+    @property
+    def name(self) -> str:
+        return self.segments[-1]
+
+    def write(self, data) -> int:
+        self.written += len(data)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def should_rotate(self, header_len: int = 0) -> bool:
+        """Whether the current segment is full or too old; segments with no packets are never rotated"""
+        if self.written <= header_len:
+            return False
+        return bool((self.size and self.written >= self.size) or
+                    (self.interval and time.monotonic() - self.opened >= self.interval))
+
+    def rotate(self, header: bytes = b""):
+        """Close the current segment and start a new one beginning with header"""
+        self._close_segment()
+        self._open()
+        self.write(header)
+
+    def close(self):
+        """Close the last segment and wait for all compressions to finish"""
+        if self.file is None:
+            return
+        self._close_segment()
+        self.file = None
+        if self.compressor:
+            self.compressor.shutdown(wait=True)
+            for future in self.pending:
+                if future.exception():
+                    logger.warning(f"Failed to compress a segment: {future.exception()}")
+
+    def _close_segment(self):
+        self.file.close()
+        if self.compressor:
+            self.pending.append(self.compressor.submit(compress, self.file.name, self.compression))
+            self.pending = [future for future in self.pending if not future.done() or future.exception()]
+
+
+def _segment_order(path: str) -> tuple:
+    """Sort key of a segment: its name without suffixes (compressed or not, same order) with the counter as a number"""
+    name = path[:path.rindex(".pcapng")]
+    match = SEGMENT_NAME.fullmatch(name)
+    if match is None:
+        return name, 0
+    return match[1], int(match[2] or 1)
+
+
+def segment_paths(pattern: str) -> list:
+    """Recording segments in a directory or matching a glob pattern sorted by name (i.e. by time)"""
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern)
+    paths = [path for path in paths if path.endswith(SEGMENT_SUFFIXES) and os.path.isfile(path)]
+    return sorted(paths, key=_segment_order)
+
+
+def open_segment(path: str):
+    """Open a segment for reading; compressed ones are decompressed while being read (see `CaptureReader`)"""
+    for suffix, opener in COMPRESSED_SUFFIXES.items():
+        if path.endswith(suffix):
+            return opener(path, "rb")
+    return open(path, "rb")
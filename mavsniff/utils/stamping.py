@@ -0,0 +1,100 @@
+import socket
+import struct
+import sys
+
+from mavsniff.utils.timing import WallClock
+
+# SO_TIMESTAMPNS (equal to SCM_TIMESTAMPNS) is not exported by Python; 35 is its value on Linux
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35 if sys.platform.startswith("linux") else None)
+TIMESPEC = struct.Struct("@ll") # struct timespec of the control message
+CONTROL_SIZE = socket.CMSG_SPACE(TIMESPEC.size) if hasattr(socket, "CMSG_SPACE") else 0
+KERNEL = "kernel"
+READ = "read"
+SOURCES = {
+    KERNEL: "kernel receive time (SO_TIMESTAMPNS)",
+    READ: "time the chunk was read, before framing",
+}
+
+
+class StampedSocket:
+    """
+    Socket reading with `recvmsg` to get the kernel receive time of the data in `stamp_ns`.
+
+    Everything but `recv` and `recvfrom` goes to the wrapped socket so pymavlink keeps using it as
+    its own `port`. `stamp_ns` is None when the last read carried no timestamp.
+    """
+
+    def __init__(self, sock: socket.socket):
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        self.socket = sock
+        self.stamp_ns = None
+
+    def __getattr__(self, name):
+        return getattr(self.socket, name)
+
+    def recv(self, size: int, flags: int = 0) -> bytes:
+        data, control, _, _ = self.socket.recvmsg(size, CONTROL_SIZE, flags)
+        self._stamp(control)
+        return data
+
+    def recvfrom(self, size: int, flags: int = 0) -> tuple:
+        data, control, _, address = self.socket.recvmsg(size, CONTROL_SIZE, flags)
+        self._stamp(control)
+        return data, address
+
+    def _stamp(self, control: list):
+        self.stamp_ns = None
+        for level, kind, value in control:
+            if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and len(value) >= TIMESPEC.size:
+                seconds, nanoseconds = TIMESPEC.unpack_from(value)
+                self.stamp_ns = seconds * 1_000_000_000 + nanoseconds
+
+
+class Stamper:
+    """
+    Receive time of the chunk of bytes last read from a device, in `timestamp_us`.
+
+    The device's `recv` is replaced so that every chunk is stamped as soon as it is read - before
+    pymavlink or a framer splits it into frames, which all share the stamp. Sockets (UDP, TCP,
+    multicast) on Linux are read with `recvmsg` and stamped with the kernel's receive time of the
+    datagram or segment; serial lines (and sockets elsewhere) with the time the read returned.
+    `source` tells which of `SOURCES` applies. Times are on the anchored `clock`.
+    """
+
+    def __init__(self, device, clock: WallClock):
+        self.device = device
+        self.clock = clock
+        sockets = [getattr(device, name, None) for name in ("port", "listen")] # TCP servers get `port` on accept
+        self.kernel = (SO_TIMESTAMPNS is not None and CONTROL_SIZE > 0 and hasattr(socket.socket, "recvmsg")
+                       and any(isinstance(sock, socket.socket) for sock in sockets))
+        self.source = KERNEL if self.kernel else READ
+        self.timestamp_us = clock.now_us()
+        if self.kernel: # right away: data queued before the option is set would be stamped when read
+            listen = getattr(device, "listen", None)
+            if isinstance(listen, socket.socket):
+                listen.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1) # inherited by accepted connections
+            self._port()
+        self._recv = device.recv
+        device.recv = self.recv
+
+    def _port(self) -> StampedSocket:
+        """Stamping socket of the device wrapping its current one (new after an accept or reconnect); None if it does not stamp"""
+        port = self.device.port if self.kernel else None
+        if type(port) is socket.socket:
+            try:
+                port = self.device.port = StampedSocket(port)
+            except OSError: # the socket does not stamp, fall back to the read time
+                self.kernel = False
+                self.source = READ
+                port = None
+        return port
+
+    def recv(self, n=None) -> bytes:
+        port = self._port()
+        if port is not None:
+            port.stamp_ns = None
+        data = self._recv(n)
+        if data: # pymavlink reads (nothing) again for every message it still has buffered from the last chunk
+            stamp_ns = port.stamp_ns if port is not None else None
+            self.timestamp_us = self.clock.realtime_us(stamp_ns) if stamp_ns else self.clock.now_us()
+        return data
@@ -0,0 +1,157 @@
+import array
+import time
+
+clock = time.perf_counter # monotonic with the best available resolution
+
+DEFAULT_SPIN = 0.002 # seconds before the due time when sleeping turns into busy-waiting
+BITS_PER_BYTE = 10 # 8N1 serial framing: start bit, 8 data bits, stop bit
+DEFAULT_BURST = 280 # bytes the link accepts at once - one full MAVLink v2 frame
+
+
+def percentiles(values, ps=(50, 90, 99, 100)) -> dict:
+    """Percentiles of values (100 being the maximum)"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {p: ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in ps}
+
+
+def sleep_until(deadline: float, spin: float = DEFAULT_SPIN) -> float:
+    """Sleep until spin seconds before the deadline then busy-wait; return the time spent waiting"""
+    now = began = clock()
+    remaining = deadline - now
+    if remaining > spin:
+        time.sleep(remaining - spin)
+    now = clock()
+    while now < deadline:
+        now = clock()
+    return now - began
+
+
+class Scheduler:
+    """
+    Release packets at absolute due times derived from their recorded timestamps.
+
+    Due time of every packet is `start + (timestamp - first_timestamp) / speed` on a monotonic clock
+    so errors do not accumulate over a long recording. The wait sleeps until `spin` seconds before
+    the due time and busy-waits the rest. Speed 0 disables waiting (replay as fast as possible).
+    Lateness of every packet (send time minus due time) is kept for jitter statistics.
+    """
+
+    def __init__(self, speed: float = 1.0, spin: float = DEFAULT_SPIN):
+        if speed < 0:
+            raise ValueError("speed must not be negative")
+        self.speed = speed
+        self.spin = spin
+        self.start = None
+        self.first_ts = 0.0
+        self.lateness = array.array('d')
+
+    def due(self, timestamp: float) -> float:
+        """Clock time when a packet with the recorded timestamp should be sent"""
+        if self.start is None:
+            self.start = clock()
+            self.first_ts = timestamp
+        if not self.speed:
+            return self.start
+        return self.start + (timestamp - self.first_ts) / self.speed
+
+    def wait(self, timestamp: float) -> float:
+        """Wait until the packet is due and record its lateness; return the time spent waiting"""
+        due = self.due(timestamp)
+        waited = self.wait_until(due)
+        self.record(due)
+        return waited
+
+    def wait_until(self, due: float) -> float:
+        """Wait until the clock reaches due time; return the time spent waiting"""
+        return sleep_until(due, self.spin) if self.speed else 0.0
+
+    def record(self, due: float) -> float:
+        """Record lateness of a packet that was due at the given time and has just been sent; return it"""
+        if not self.speed:
+            return None
+        lateness = clock() - due
+        self.lateness.append(lateness)
+        return lateness
+
+    def jitter(self) -> dict:
+        """Lateness percentiles in seconds (100 being the maximum)"""
+        return percentiles(self.lateness)
+
+
+class LinkPacer:
+    """
+    Token bucket modelling the capacity of a (serial) link.
+
+    Tokens are bytes the link can take without queueing; they refill at `baud / bits_per_byte`
+    per second up to `burst`. A write has to wait until there are enough tokens for it so the
+    data do not pile up in OS buffers. Packets due together are `split` into writes of at most
+    `burst` bytes each waiting for its own tokens; the time a packet waited since its batch was
+    due is its queueing delay.
+    """
+
+    def __init__(self, baud: int, bits_per_byte: int = BITS_PER_BYTE, burst: int = DEFAULT_BURST):
+        if baud <= 0:
+            raise ValueError("baud rate must be positive")
+        self.rate = baud / bits_per_byte # bytes per second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.delays = array.array('d')
+
+    def _refill(self):
+        now = clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, size: int) -> float:
+        """Seconds until the link can take size bytes"""
+        self._refill()
+        need = min(size, self.burst)
+        return 0.0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+    def split(self, packets: list) -> list:
+        """Groups of packets of at most `burst` bytes (a larger packet alone) the link takes at once"""
+        groups, group, size = [], [], 0
+        for packet in packets:
+            if group and size + len(packet) > self.burst:
+                groups.append(group)
+                group, size = [], 0
+            group.append(packet)
+            size += len(packet)
+        if group:
+            groups.append(group)
+        return groups
+
+    def consume(self, size: int, delay: float, packets: int = 1):
+        """Account size bytes written after waiting delay seconds (shared by all packets of a write)"""
+        self._refill()
+        self.tokens -= size
+        for _ in range(packets):
+            self.delays.append(delay)
+
+
+class WallClock:
+    """
+    Wall-clock time in microseconds anchored to the monotonic clock.
+
+    The wall clock is read once at `anchor()`; later readings add the monotonic time elapsed since
+    so timestamps of a capture neither jump nor go back when NTP or a user sets the system clock.
+    Receive times the kernel stamped on the realtime clock are moved onto it by their age.
+    """
+
+    def __init__(self):
+        self.anchor()
+
+    def anchor(self):
+        self.wall_ns = time.time_ns()
+        self.monotonic_ns = time.monotonic_ns()
+
+    def now_us(self) -> int:
+        return (self.wall_ns + time.monotonic_ns() - self.monotonic_ns) // 1000
+
+    def realtime_us(self, realtime_ns: int) -> int:
+        """Anchored time of a realtime clock reading (of a past event) in nanoseconds"""
+        age_ns = max(time.time_ns() - realtime_ns, 0)
+        return (self.wall_ns + time.monotonic_ns() - self.monotonic_ns - age_ns) // 1000
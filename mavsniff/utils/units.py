@@ -0,0 +1,33 @@
+SIZE_UNITS = {"": 1, "B": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+DURATION_UNITS = {"": 1, "S": 1, "M": 60, "MIN": 60, "H": 3600, "D": 86400}
+
+
+def _split(value: str) -> tuple:
+    value = value.strip().upper()
+    i = len(value)
+    while i > 0 and value[i - 1].isalpha():
+        i -= 1
+    return value[:i], value[i:]
+
+
+def parse_size(value: str) -> int:
+    """Parse a byte size such as `4096`, `64K`, `512M` or `1G` (binary multiples)"""
+    number, unit = _split(value)
+    unit = unit[:-1] if len(unit) > 1 and unit.endswith("B") else unit # accept MB as M
+    if unit not in SIZE_UNITS:
+        raise ValueError(f"unknown size unit in {value}; use one of K, M, G, T")
+    size = int(float(number) * SIZE_UNITS[unit])
+    if size <= 0:
+        raise ValueError(f"size {value} must be positive")
+    return size
+
+
+def parse_duration(value: str) -> float:
+    """Parse a duration in seconds such as `90`, `90s`, `30m` (or `30min`), `1h` or `1d`"""
+    number, unit = _split(value)
+    if unit not in DURATION_UNITS:
+        raise ValueError(f"unknown time unit in {value}; use one of s, m (min), h, d")
+    duration = float(number) * DURATION_UNITS[unit]
+    if duration <= 0:
+        raise ValueError(f"duration {value} must be positive")
+    return duration
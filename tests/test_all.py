@@ -1,7 +1,17 @@
+import ast
+import asyncio
+import csv
 import io
+import os
 import pcapng
+import socket
+import struct
+import subprocess
+import sys
+import pytest
 import time
 import threading
+import zipfile
 
 from pymavlink import mavutil
 from pymavlink.dialects.v20 import ardupilotmega as mavlink2
@@ -9,9 +19,28 @@ from pymavlink.dialects.v20 import ardupilotmega as mavlink2
 from mavsniff.utils.mav import mavlink
 from mavsniff.utils import ip
 from mavsniff.capture import Capture
-from mavsniff.replay import Replay
+from mavsniff.recorder import FlightRecorder
+from mavsniff.proxy import Proxy
+from mavsniff.index import Index
+from mavsniff import analysis, edit
+from mavsniff.analysis import analyze, parse_fields, scan_chunk
+from mavsniff.export import export, parse_messages
+from mavsniff.replay import Replay, AsyncReplay
+from mavsniff.utils.framer import Framer
+from mavsniff.utils.filter import MessageFilter
+from mavsniff.utils import pcap
+from mavsniff.utils.pcap import PacketEncoder, PcapngReader, section_header
+from mavsniff.utils import ring
+from mavsniff.utils.ring import FrameRing
+from mavsniff.utils import segments
+from mavsniff.utils.segments import RotatingFile, segment_path, segment_paths
+from mavsniff.utils.metrics import Metrics, MetricsServer
+from mavsniff.utils.profiling import Profiler
+from mavsniff.utils import timing
+from mavsniff.utils.timing import Scheduler, LinkPacer
 
 TEST_DEVICE_URL = "tcp://localhost:3728"
+TEST_RAW_DEVICE_URL = "tcp://localhost:3729"
 
 def _generate_packets():
     mavconn = mavlink(TEST_DEVICE_URL, input=False)
@@ -25,6 +54,11 @@ def _generate_packets():
     finally:
         mavconn.close()
 
+def _recording(packets, interfaces=({},)) -> bytes:
+    """Recording as mavsniff writes it: section header, then `(timestamp_us, frame)` packets (of the first interface)"""
+    encoder = PacketEncoder()
+    return section_header(list(interfaces)) + b"".join(bytes(encoder.encode(n, frame, timestamp_us)) for n, (timestamp_us, frame) in enumerate(packets))
+
 def test_capture_timing():
     """Simple test that packets get captured with correct timing"""
     buffer = io.BytesIO()
@@ -177,3 +211,844 @@ def _generate_packets_and_garbage(mavlink: mavutil.mavfile):
     mavlink.write(mavlink2.MAVLink_mission_count_message(target_system=42, target_component=0, count=51).pack(mavlink.mav))
     time.sleep(0.1)
     mavlink.close()
+
+
+def test_capture_garbage_raw():
+    """Raw capture stores original frames and skips garbage without decoding"""
+    device = mavlink(TEST_RAW_DEVICE_URL, input=True, dialect="ardupilotmega")
+    buffer = io.BytesIO()
+
+    c = Capture(device, buffer, raw=True)
+    t = threading.Thread(target=c.run)
+    t.start(); time.sleep(0.01)
+
+    _generate_packets_and_garbage(mavlink(TEST_RAW_DEVICE_URL, input=False, dialect="ardupilotmega"))
+    time.sleep(0.1)
+    c.stop()
+    t.join()
+    device.close()
+
+    buffer.seek(0)
+    packets = list(pcapng.FileScanner(buffer))
+    assert len(packets) == 2+4 # 2 section headers, 4 valid packets
+    assert c.bad_messages >= 2, "garbage and the invalidated message should be counted as bad data"
+    counts = [device.mav.parse_char(ip.get_payload(p.packet_data)).count for p in packets[2:]]
+    assert counts == [13, 42, 50, 51]
+
+
+def test_framer_split_and_resync():
+    """Framer finds frames in arbitrarily chunked stream and keeps their bytes intact"""
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    frames = [mavlink2.MAVLink_mission_count_message(1, 1, n).pack(mav) for n in range(3)]
+    stream = b'\xfe\x05junk' + frames[0] + frames[1] + b'\xfd\x00\x00' + frames[2]
+
+    framer = Framer(mavlink2)
+    found = []
+    for i in range(0, len(stream), 7):
+        found.extend(framer.feed(stream[i:i+7]))
+    assert found == frames
+    assert framer.bad_data == 2
+
+
+def test_packet_encoder_matches_pcapng():
+    """PacketEncoder produces the same block as python-pcapng's EnhancedPacket"""
+    shb = pcapng.blocks.SectionHeader(endianness="<")
+    shb.register_interface(pcapng.blocks.InterfaceDescription(endianness="<", interface_id=0, section=shb))
+    encoder = PacketEncoder()
+    for n in range(1, 6):
+        frame = bytes(range(n * 7))
+        expected = io.BytesIO()
+        pcapng.blocks.EnhancedPacket(section=shb, interface_id=0, packet_data=ip.udp_header(n, len(frame)) + frame,
+            timestamp_high=1, timestamp_low=n, captured_len=len(frame) + 32, packet_len=len(frame) + 32, endianness="<")._write(expected)
+        assert bytes(encoder.encode(n, frame, (1 << 32) + n)) == expected.getvalue()
+
+
+def test_ring_buffer_overflow_policies():
+    """Ring buffer keeps the configured end of the stream when full"""
+    for policy, expected in ((ring.DROP_OLDEST, [2, 3, 4]), (ring.DROP_NEWEST, [0, 1, 2])):
+        buffer = ring.RingBuffer(3, policy)
+        for i in range(5):
+            buffer.put(i)
+        assert buffer.get_batch(10) == expected
+        assert buffer.dropped == 2
+        assert buffer.high_water == 3
+
+
+def test_pcapng_reader_matches_scanner():
+    """PcapngReader yields the same timestamps and payloads as pcapng.FileScanner in both byte orders"""
+    for endianness in "<>":
+        buffer = io.BytesIO()
+        shb = pcapng.blocks.SectionHeader(endianness=endianness)
+        shb.register_interface(pcapng.blocks.InterfaceDescription(endianness=endianness, interface_id=0, section=shb,
+            options={'if_tsresol': struct.pack('<B', 9)}))
+        writer = pcapng.FileWriter(buffer, shb)
+        for n in range(1, 4):
+            writer.write_block(pcapng.blocks.EnhancedPacket(section=shb, interface_id=0, packet_data=bytes(range(n * 5)),
+                timestamp_high=n, timestamp_low=n * 1000000007, captured_len=n * 5, packet_len=n * 5, endianness=endianness))
+
+        buffer.seek(0)
+        expected = [(p.timestamp, p.packet_data) for p in pcapng.FileScanner(buffer) if isinstance(p, pcapng.blocks.EnhancedPacket)]
+        buffer.seek(0)
+        with PcapngReader(buffer) as reader:
+            packets = [(timestamp, bytes(payload)) for timestamp, payload in reader]
+        assert packets == expected
+
+
+def test_pcapng_reader_seeks_into_later_section():
+    """Reading from a packet of a concatenated capture uses the byte order and interfaces of its own section"""
+    buffer = io.BytesIO()
+    for endianness, resol in (("<", 6), (">", 9)):
+        shb = pcapng.blocks.SectionHeader(endianness=endianness)
+        shb.register_interface(pcapng.blocks.InterfaceDescription(endianness=endianness, interface_id=0, section=shb,
+            options={'if_tsresol': struct.pack('<B', resol)}))
+        writer = pcapng.FileWriter(buffer, shb)
+        for n in range(1, 4):
+            writer.write_block(pcapng.blocks.EnhancedPacket(section=shb, interface_id=0, packet_data=bytes(range(n * 5)),
+                timestamp_high=0, timestamp_low=n * 1000, captured_len=n * 5, packet_len=n * 5, endianness=endianness))
+
+    buffer.seek(0)
+    with PcapngReader(buffer) as reader:
+        records = [(offset, timestamp, bytes(payload)) for offset, _, timestamp, payload in reader.records()]
+        assert len(records) == 6 and records[4][1] == pytest.approx(2e-6)
+        for skip in (1, 4):
+            seeked = [(offset, timestamp, bytes(payload)) for offset, _, timestamp, payload in reader.records(records[skip][0])]
+            assert seeked == records[skip:]
+
+
+def test_capture_reader_starts_at_file_position(tmp_path):
+    """Readers start where the file is positioned (as `open_reader` sniffs the format there) and report file offsets"""
+    recording = _recording([(1_000_000 + n, bytes((0xfe, 0, n))) for n in range(5)])
+    path = tmp_path / "prefixed.pcapng"
+    path.write_bytes(b"\xa1\xb2\xc3\xd4junk" + recording) # a pcap magic that must not be sniffed
+    with open(path, "rb") as file:
+        file.seek(8)
+        with pcap.open_reader(file) as reader:
+            assert isinstance(reader, PcapngReader)
+            records = [(offset, bytes(payload)) for offset, _, _, payload in reader.records()]
+            assert reader.boundaries(1) == [8]
+    with PcapngReader(io.BytesIO(recording)) as reader:
+        expected = [(offset + 8, bytes(payload)) for offset, _, _, payload in reader.records()]
+    assert records == expected
+    with open(path, "rb") as file:
+        file.seek(8)
+        with pcap.open_reader(file) as reader:
+            assert [offset for offset, _, _, _ in reader.records(expected[2][0])] == [offset for offset, _ in expected[2:]]
+
+
+def test_scheduler_speed():
+    """Scheduler releases packets at absolute times scaled by speed"""
+    scheduler = Scheduler(speed=10)
+    start = time.perf_counter()
+    for n in range(11):
+        scheduler.wait(1000.0 + n * 0.05)
+    assert 0.06 > time.perf_counter() - start >= 0.05
+    assert scheduler.jitter()[50] < 0.001
+
+
+class _RecordingDevice:
+    def __init__(self, address="recording", delay=0.0):
+        self.address = address
+        self.delay = delay # seconds every write takes
+        self.writes = []
+
+    def write(self, data):
+        time.sleep(self.delay)
+        self.writes.append(bytes(data))
+
+
+def test_replay_coalesces_due_packets():
+    """Packets due within the coalescing window are written at once"""
+    frames = [bytes((0xfe, 1, n)) for n in range(4)]
+    buffer = io.BytesIO(_recording(zip((1_000_000, 1_000_200, 1_000_400, 1_050_000), frames)))
+    device = _RecordingDevice()
+    assert Replay(device=device, file=buffer, coalesce=0.001).run() == 4
+    assert device.writes == [b"".join(frames[:3]), frames[3]]
+
+
+def test_link_pacer_shapes_to_baud_rate(monkeypatch):
+    """Writes beyond the burst wait for the link to drain at baud / 10 bytes per second"""
+    now = [100.0]
+    monkeypatch.setattr(timing, "clock", lambda: now[0]) # no tokens refill between the calls on a loaded machine
+    pacer = LinkPacer(baud=100_000, burst=100) # 10 kB/s
+    assert pacer.delay(100) == 0.0
+    pacer.consume(100, 0.0)
+    assert 0.0105 > pacer.delay(100) > 0.0095
+    now[0] += 0.004
+    assert pacer.delay(100) == pytest.approx(0.006)
+    assert [len(group) for group in pacer.split([bytes(40)] * 5 + [bytes(150), bytes(10)])] == [2, 2, 1, 1, 1]
+
+
+def test_replay_paces_coalesced_packets_per_burst():
+    """Packets due together beyond the link's burst are written as it drains, each with its own queueing delay"""
+    buffer = io.BytesIO(_recording((1_000_000, bytes((0xfe, 94, n, 1, 1, 0)) + bytes(94)) for n in range(4)))
+    device = _RecordingDevice()
+    replay = Replay(device=device, file=buffer, baud=10_000) # 1000 B/s, 280 B at once
+    assert replay.run() == 4
+    assert [len(write) for write in device.writes] == [200, 200]
+    assert list(replay.pacer.delays[:2]) == [0.0, 0.0] and replay.pacer.delays[2] == replay.pacer.delays[3] > 0.1
+
+
+def test_capture_accepts_next_tcp_client_after_disconnect():
+    """A TCP server device captures a client connecting after the previous one disconnected"""
+    device = mavlink("tcp://localhost:3738", input=True)
+    buffer = io.BytesIO()
+    c = Capture(device, buffer, raw=True)
+    t = threading.Thread(target=c.run)
+    t.start(); time.sleep(0.01)
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    frames = [mavlink2.MAVLink_mission_count_message(1, 1, n).pack(mav) for n in range(2)]
+    try:
+        for frame in frames:
+            with socket.create_connection(("localhost", 3738)) as client:
+                client.sendall(frame)
+                time.sleep(0.1)
+            time.sleep(0.1) # the capture notices the closed connection
+    finally:
+        c.stop()
+        t.join()
+        device.close()
+
+    buffer.seek(0)
+    packets = [b for b in pcapng.FileScanner(buffer) if isinstance(b, pcapng.blocks.EnhancedPacket)]
+    assert len(packets) == 2 and all(p.packet_data.endswith(frame) for p, frame in zip(packets, frames))
+
+
+def test_replay_warns_about_faster_recorded_link(caplog):
+    """Replay warns when the recording's if_txspeed is above the target baud rate"""
+    buffer = io.BytesIO(_recording([(1_000_000, bytes((0xfe, 0, 0, 1, 1, 0, 0, 0)))], [{"if_txspeed": 921600, "if_rxspeed": 921600}]))
+    with caplog.at_level("WARNING", logger="mavsniff"):
+        assert Replay(device=_RecordingDevice(), file=buffer, speed=0, baud=57600).run() == 1
+    assert "recorded link (921600 baud) is faster than the target (57600 baud)" in caplog.text
+
+
+def test_capture_multiple_devices():
+    """Packets from several devices go into one file with one interface per device"""
+    urls = ("udp://localhost:3730", "udp://localhost:3731")
+    devices = [mavlink(url, input=True) for url in urls]
+    buffer = io.BytesIO()
+    c = Capture(devices, buffer, raw=True)
+    t = threading.Thread(target=c.run)
+    t.start(); time.sleep(0.01)
+
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    outputs = [mavlink(url, input=False) for url in urls]
+    try:
+        for n in range(6):
+            outputs[n % 2].write(mavlink2.MAVLink_mission_count_message(1, 1, n).pack(mav))
+            time.sleep(0.01)
+        time.sleep(0.1)
+    finally:
+        c.stop()
+        t.join()
+        for device in devices + outputs:
+            device.close()
+
+    buffer.seek(0)
+    blocks = list(pcapng.FileScanner(buffer))
+    assert [b.interface_id for b in blocks if isinstance(b, pcapng.blocks.InterfaceDescription)] == [0, 1]
+    packets = [b for b in blocks if isinstance(b, pcapng.blocks.EnhancedPacket)]
+    assert [p.interface_id for p in packets] == [0, 1, 0, 1, 0, 1]
+    assert [p.timestamp for p in packets] == sorted(p.timestamp for p in packets)
+
+
+class _SlowFile(io.BytesIO):
+    """In-memory file taking a while for every write and remembering when it finished"""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+        self.written_at = []
+
+    def write(self, data):
+        time.sleep(self.delay)
+        self.written_at.append(time.perf_counter())
+        return super().write(data)
+
+
+def test_capture_blocks_on_full_buffer_without_polling():
+    """A full buffer holds the reader back until the writer frees space - nothing is lost and nothing waits for a poll"""
+    url = "udp://localhost:3743"
+    device, output = mavlink(url, input=True), mavlink(url, input=False)
+    file = _SlowFile(0.002)
+    c = Capture(device, file, raw=True, buffer_size=2)
+    c.stop() # e.g. SIGINT before the capture started
+    assert c.run() == 0 and file.getvalue() == b""
+
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    t = threading.Thread(target=c.run)
+    t.start(); time.sleep(0.05)
+    try:
+        sent = time.perf_counter()
+        output.write(mavlink2.MAVLink_heartbeat_message(2, 3, 0, 0, 4, 3).pack(mav))
+        time.sleep(0.1)
+        latency = file.written_at[1] - sent # after the section header
+        for n in range(100):
+            mav.seq = n
+            output.write(mavlink2.MAVLink_mission_count_message(1, 1, n).pack(mav))
+        time.sleep(0.5)
+    finally:
+        c.stop()
+        t.join()
+        device.close(); output.close()
+
+    assert latency < 0.05
+    assert c.written == 101 and c.ring.dropped == 0 and c.ring.high_water == 2
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="SO_TIMESTAMPNS is Linux only")
+def test_capture_stamps_packets_with_kernel_receive_time():
+    """Packets waiting in the socket keep the time they arrived instead of the time they were read or decoded"""
+    url = "udp://localhost:3733"
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    datagram = b"".join(mavlink2.MAVLink_heartbeat_message(1, 2, 3, 4, 5, 3).pack(mav) for _ in range(3))
+    for raw in (True, False):
+        device = mavlink(url, input=True)
+        buffer = io.BytesIO()
+        c = Capture(device, buffer, raw=raw)
+        output = mavlink(url, input=False)
+        sent = time.time()
+        output.write(datagram)
+        time.sleep(0.2)
+        t = threading.Thread(target=c.run)
+        t.start(); time.sleep(0.1)
+        c.stop()
+        t.join()
+        device.close(); output.close()
+
+        buffer.seek(0)
+        blocks = list(pcapng.FileScanner(buffer))
+        interface = next(b for b in blocks if isinstance(b, pcapng.blocks.InterfaceDescription))
+        assert "SO_TIMESTAMPNS" in interface.options["opt_comment"]
+        packets = [b for b in blocks if isinstance(b, pcapng.blocks.EnhancedPacket)]
+        assert len(packets) == 3 # all frames of the datagram get its stamp
+        assert packets[0].timestamp == packets[1].timestamp == packets[2].timestamp
+        assert abs(packets[0].timestamp - sent) < 0.1
+
+
+def test_async_replay_cancellation():
+    """AsyncReplay stops on cancellation and its stats iterator ends with the run"""
+    buffer = io.BytesIO(_recording((1_000_000 + n * 100_000, bytes((0xfe, 1, n))) for n in range(100))) # 10 seconds long
+
+    async def scenario():
+        device = _RecordingDevice()
+        replay = AsyncReplay(device=device, file=buffer)
+        task = asyncio.ensure_future(replay.run())
+        snapshots = []
+        async for stats in replay.stats(interval=0.05):
+            snapshots.append(stats)
+            if stats["replayed"] >= 3:
+                task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return device, snapshots
+
+    device, snapshots = asyncio.run(scenario())
+    assert 3 <= len(device.writes) < 10
+    assert snapshots[-1]["replayed"] >= 3
+
+
+def test_index_seeks_replay_window(tmp_path):
+    """Replay of a time window seeks by the sidecar index which gets rebuilt when the recording changes"""
+    path = str(tmp_path / "recording.pcapng")
+    with open(path, "wb") as file: # one packet every 100ms
+        file.write(_recording((5_000_000 + n * 100_000, bytes((0xfe, 0, n, 1, 2, 0))) for n in range(100)))
+    encoder = PacketEncoder()
+
+    with open(path, "rb") as file:
+        device = _RecordingDevice()
+        assert Replay(device=device, file=file, speed=0, start=3.0, end=3.45).run() == 5
+    assert b"".join(device.writes)[2::6] == bytes((30, 31, 32, 33, 34))
+
+    index = Index.load(path)
+    assert len(index) == 100 and index.ordered
+    assert (index.msgids[7], index.sysids[7], index.compids[7]) == (0, 1, 2)
+    assert index.seek(5.0) == 0 and index.seek(9.95) == 50 and index.seek(100.0) == 100
+
+    with open(path, "ab") as file:
+        file.write(encoder.encode(100, bytes((0xfe, 0, 100, 1, 2, 0)), 15_000_000))
+    assert Index.load(path) is None
+    assert len(Index.open(path)) == 101 and Index.load(path).ordered
+
+    with open(path, "ab") as file: # the clock went back
+        file.write(encoder.encode(101, bytes((0xfe, 0, 101, 1, 2, 0)), 4_000_000))
+    Index.open(path)
+    index = Index.load(path)
+    assert not index.ordered
+    assert index.seek(5.0) == 0 and index.seek(15.0) == 100 and index.seek(16.0) == 102
+
+
+def test_message_filter():
+    """Filters match message ID, name, sysid and compid of raw v1 and v2 headers"""
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    heartbeat = mavlink2.MAVLink_heartbeat_message(1, 2, 3, 4, 5, 3).pack(mav)
+    raw_imu = mavlink2.MAVLink_raw_imu_message(0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 0, 0).pack(mav)
+    v1 = bytes((0xfe, 9, 0, 2, 1, 0)) + bytes(11) # heartbeat from sysid 2
+
+    no_imu = MessageFilter(exclude=["RAW_IMU"])
+    assert no_imu.accepts(heartbeat) and not no_imu.accepts(raw_imu) and no_imu.accepts(v1)
+    only_sys1 = MessageFilter(include=["sysid=1"], exclude=["27"])
+    assert only_sys1.accepts(heartbeat) and not only_sys1.accepts(raw_imu) and not only_sys1.accepts(v1)
+    assert MessageFilter(include=["name=heartbeat,msgid=70000"]).accepts_ids(70000, 1, 1)
+    assert not MessageFilter(include=["compid=190"]).accepts(heartbeat)
+    with pytest.raises(ValueError):
+        MessageFilter(include=["NO_SUCH_MESSAGE"])
+
+    buffer = io.BytesIO(_recording((1_000_000 + n, frame) for n, frame in enumerate((heartbeat, raw_imu, raw_imu, heartbeat))))
+    device = _RecordingDevice()
+    replay = Replay(device=device, file=buffer, speed=0, message_filter=no_imu)
+    assert replay.run() == 2
+    assert replay.filtered == 2 and b"".join(device.writes) == heartbeat * 2
+
+
+def test_rotating_file_segments_replay_in_order(tmp_path):
+    """Rotated segments are self-contained, compressed in background and replayed as one recording"""
+    header = _recording(())
+
+    rotating = RotatingFile(str(tmp_path / "recording.pcapng"), size=len(header) + 200, compression="gzip")
+    rotating.write(header)
+    encoder = PacketEncoder()
+    for n in range(10):
+        if rotating.should_rotate(len(header)):
+            rotating.rotate(header)
+        rotating.write(encoder.encode(n, bytes((0xfe, 0, n, 1, 1, 0)), 1_000_000 + n * 1000))
+    rotating.close()
+
+    segments = segment_paths(str(tmp_path))
+    assert len(segments) == 4 and all(path.endswith(".pcapng.gz") for path in segments)
+    assert segment_paths(str(tmp_path / "recording-*")) == segments
+    device = _RecordingDevice()
+    assert Replay(device=device, file=segments, speed=0).run() == 10
+    assert b"".join(device.writes)[2::6] == bytes(range(10))
+
+
+def test_compressed_segments_are_streamed(tmp_path, monkeypatch):
+    """Compressed pcapng and pcap segments are read in chunks while decompressing, with the offsets of the plain file"""
+    monkeypatch.setattr(pcap, "STREAM_CHUNK", 64)
+    frames = [bytes((0xfe, n % 7, n)) + bytes(n % 7 + 3) for n in range(50)]
+    recording = _recording((1_000_000 + n * 1000, frame) for n, frame in enumerate(frames))
+    dump = struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 147)
+    for n, frame in enumerate(frames):
+        dump += struct.pack("<IIII", 1, n * 1000, len(frame), len(frame)) + frame
+    for name, data, compression in (("recording.pcapng", recording, "gzip"), ("dump.pcap", dump, "lzma")):
+        path = str(tmp_path / name)
+        with open(path, "wb") as file:
+            file.write(data)
+        with open(path, "rb") as file, pcap.open_reader(file) as reader:
+            expected = [(offset, timestamp, bytes(payload)) for offset, _, timestamp, payload in reader.records()]
+        assert len(expected) == 50
+        path = segments.compress(path, compression)
+        for skip in (0, 10):
+            with segments.open_segment(path) as file, pcap.open_reader(file) as reader:
+                assert reader.stream is not None
+                packets = [(offset, timestamp, bytes(payload)) for offset, _, timestamp, payload in reader.records(expected[skip][0])]
+                assert packets == expected[skip:]
+                assert len(reader.view) < 2 * 64 + 300
+
+
+def test_segments_opened_within_a_second_keep_their_order(tmp_path, monkeypatch):
+    """More than nine segments opened in one second are listed in the order they were opened"""
+    monkeypatch.setattr(segments.time, "strftime", lambda fmt: "20260101-120000")
+    created = []
+    for _ in range(12):
+        created.append(segment_path(str(tmp_path / "recording")))
+        open(created[-1], "wb").close()
+    assert created[1].endswith("recording-20260101-120000-2.pcapng")
+    assert segment_paths(str(tmp_path)) == created
+
+
+def test_frame_ring_keeps_latest_frames():
+    """Frame ring overwrites the oldest records and wraps records that do not fit at its end"""
+    frames = FrameRing(100)
+    for n in range(20):
+        assert frames.put(n, n % 2, bytes([n]) * (n % 7 + 1))
+        kept = [(ts, interface_id, bytes(data)) for ts, interface_id, data in frames]
+        assert kept[-1] == (n, n % 2, bytes([n]) * (n % 7 + 1))
+        assert [ts for ts, _, _ in kept] == list(range(n - len(kept) + 1, n + 1))
+        assert sum(12 + len(data) for _, _, data in kept) <= 100
+    assert not frames.put(20, 0, bytes(100))
+
+
+def test_flight_recorder_window_units():
+    """Flight recorder window is a duration or a size; a bare m is neither"""
+    from mavsniff.commands.capture import parse_ring
+    from mavsniff.recorder import DEFAULT_RING_SIZE
+    assert parse_ring("120s") == (DEFAULT_RING_SIZE, 120) and parse_ring("5min") == (DEFAULT_RING_SIZE, 300)
+    assert parse_ring("64MB") == (64 << 20, None) and parse_ring("512K") == (512 << 10, None)
+    for ambiguous in ("64m", "64M"):
+        with pytest.raises(ValueError, match="ambiguous"):
+            parse_ring(ambiguous)
+
+
+def test_flight_recorder_dumps_on_trigger(tmp_path):
+    """Flight recorder dumps its ring when system status of a vehicle changes and when the capture ends"""
+    device = mavlink("udp://localhost:3732", input=True)
+    recorder = FlightRecorder(device, str(tmp_path / "crash.pcapng"), ring_size=4096) # always raw
+    t = threading.Thread(target=recorder.run)
+    t.start(); time.sleep(0.01)
+
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    other = mavlink2.MAVLink(None, srcSystem=2, srcComponent=1) # another vehicle in a steady state
+    output = mavlink("udp://localhost:3732", input=False)
+    try:
+        for status in (3, 3, 4): # STANDBY, STANDBY, ACTIVE
+            output.write(mavlink2.MAVLink_heartbeat_message(2, 3, 0, 0, status, 3).pack(mav))
+            time.sleep(0.01)
+            output.write(mavlink2.MAVLink_heartbeat_message(2, 3, 0, 0, 5, 3).pack(other))
+            time.sleep(0.01)
+        output.write(mavlink2.MAVLink_mission_count_message(1, 1, 0).pack(mav))
+        time.sleep(0.1)
+    finally:
+        recorder.stop()
+        t.join()
+        device.close()
+        output.close()
+
+    assert len(recorder.dumps) == 2
+    counts = []
+    for path in recorder.dumps:
+        with open(path, "rb") as file, PcapngReader(file) as reader:
+            counts.append(len(list(reader)))
+    assert counts == [5, 2]
+
+
+def test_metrics_streams_loss_and_endpoint():
+    """Metrics count streams and sequence gaps per component and are served as Prometheus text"""
+    import urllib.request
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    frames = []
+    for seq in range(5):
+        mav.seq = seq
+        frames.append(mavlink2.MAVLink_heartbeat_message(1, 2, 3, 4, 5, 3).pack(mav))
+    metrics = Metrics()
+    metrics.observe(frames[:2] + frames[4:]) # sequence numbers 0, 1, 4
+    metrics.observe_written([(1_000_000, 0, frames[2])], 1_003_000)
+    metrics.source = lambda: {"captured": 4}
+
+    snapshot = metrics.snapshot()
+    assert snapshot["streams"] == [{"msgid": 0, "name": "HEARTBEAT", "sysid": 1, "packets": 4, "bytes": 4 * len(frames[0])}]
+    assert snapshot["components"] == [{"sysid": 1, "compid": 1, "received": 4, "lost": 2 + 253}] # 4 -> 2 wraps around
+    assert snapshot["write_latency"]["count"] == 1 and snapshot["write_latency"]["buckets"][0.005] == 1
+
+    server = MetricsServer(metrics, 0)
+    server.start()
+    try:
+        text = urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics", timeout=5).read().decode()
+    finally:
+        server.stop()
+    assert 'mavsniff_packets_total{msgid="0",name="HEARTBEAT",sysid="1"} 4' in text
+    assert "mavsniff_captured 4" in text
+    assert 'mavsniff_write_latency_seconds_bucket{le="+Inf"} 1' in text
+
+
+def test_metrics_of_decoded_capture_keep_original_header():
+    """Decoded capture counts messages by the sysid, compid and sequence they were received with, not those of re-packing"""
+    url = "udp://localhost:3734"
+    device = mavlink(url, input=True)
+    metrics = Metrics()
+    c = Capture(device, io.BytesIO(), metrics=metrics)
+    t = threading.Thread(target=c.run)
+    t.start(); time.sleep(0.01)
+    output = mavlink(url, input=False)
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    try:
+        for seq in range(5):
+            mav.seq = seq
+            output.write(mavlink2.MAVLink_heartbeat_message(1, 2, 3, 4, 5, 3).pack(mav))
+            time.sleep(0.01)
+        time.sleep(0.1)
+    finally:
+        c.stop()
+        t.join()
+        device.close(); output.close()
+
+    snapshot = metrics.snapshot()
+    assert [(s["sysid"], s["packets"]) for s in snapshot["streams"]] == [(1, 5)]
+    assert snapshot["components"] == [{"sysid": 1, "compid": 1, "received": 5, "lost": 0}]
+    assert snapshot["write_latency"]["count"] == 5
+
+
+def test_stats_of_chunks_merge_into_whole_file(tmp_path):
+    """Statistics scanned in chunks split at block boundaries equal those of a single scan"""
+    path = str(tmp_path / "recording.pcapng")
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    packets = []
+    for n in range(200): # every 10th sequence number is lost
+        mav.seq = n + n // 9
+        message = mavlink2.MAVLink_heartbeat_message(1, 2, 3, 4, 5, 3) if n % 4 == 0 else mavlink2.MAVLink_attitude_message(n, n / 10, 0, 0, 0, 0, 0)
+        packets.append((1_000_000 + n * 10_000, message.pack(mav)))
+    with open(path, "wb") as file:
+        file.write(_recording(packets))
+
+    big_endian, dump = str(tmp_path / "big-endian.pcapng"), str(tmp_path / "dump.pcap")
+    with open(path, "rb") as file, PcapngReader(file) as reader, open(big_endian, "wb") as big, open(dump, "wb") as classic:
+        records = list(reader.records())
+        shb = pcapng.blocks.SectionHeader(endianness=">")
+        shb.register_interface(pcapng.blocks.InterfaceDescription(endianness=">", interface_id=0, section=shb,
+                                                                  link_type=reader.interfaces[0].link_type))
+        writer = pcapng.FileWriter(big, shb)
+        classic.write(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, reader.interfaces[0].link_type))
+        for _, _, timestamp, data in records:
+            timestamp_us = round(timestamp * 1e6)
+            writer.write_block(pcapng.blocks.EnhancedPacket(section=shb, interface_id=0, packet_data=bytes(data), endianness=">",
+                timestamp_high=timestamp_us >> 32, timestamp_low=timestamp_us & 0xFFFFFFFF, captured_len=len(data), packet_len=len(data)))
+            classic.write(struct.pack("<IIII", timestamp_us // 1_000_000, timestamp_us % 1_000_000, len(data), len(data)) + bytes(data))
+
+    fields = parse_fields(["ATTITUDE.roll"])
+    whole = analyze(path, jobs=1, fields=fields).summary()
+    for recording in (path, big_endian, dump): # split alike whatever the format and byte order
+        with open(recording, "rb") as file, pcap.open_reader(file) as reader:
+            offsets = reader.boundaries(7)
+            size = len(reader.view)
+        assert len(offsets) == 7
+        chunks = [scan_chunk(recording, start, end, fields=fields) for start, end in zip(offsets, offsets[1:] + [size])]
+        merged = chunks[0]
+        for chunk in chunks[1:]:
+            merged.merge(chunk)
+        assert merged.summary() == analyze(recording, jobs=1, fields=fields).summary()
+        assert [(m["name"], m["packets"]) for m in merged.summary()["messages"]] == [("HEARTBEAT", 50), ("ATTITUDE", 150)]
+
+    assert whole["packets"] == 200 and whole["duration"] == pytest.approx(1.99)
+    assert [(m["name"], m["packets"]) for m in whole["messages"]] == [("HEARTBEAT", 50), ("ATTITUDE", 150)]
+    assert whole["messages"][0]["intervals"]["buckets"][0.05] == 49 # a heartbeat every 40ms
+    assert whole["components"] == [{"sysid": 1, "compid": 1, "received": 200, "lost": 22, "loss": 22 / 222}]
+    assert sum(whole["link"][0]["bytes_per_s"]) == whole["bytes"]
+    roll = whole["fields"][0]
+    assert roll["field"] == "ATTITUDE.roll" and roll["count"] == 150 and roll["max"] == pytest.approx(19.9)
+    with pytest.raises(ValueError):
+        parse_fields(["ATTITUDE.nothing"])
+
+
+def test_export_columns_in_parallel_chunks(tmp_path, monkeypatch):
+    """Exported columns hold decoded fields and do not depend on how the recording is split between workers"""
+    path = str(tmp_path / "recording.pcapng")
+    mav = mavlink2.MAVLink(None, srcSystem=3, srcComponent=1)
+    with open(path, "wb") as file:
+        file.write(_recording((1_000_000 + n * 1000, (mavlink2.MAVLink_statustext_message(4, f"text {n}".encode()) if n % 3 == 0 else
+                                                      mavlink2.MAVLink_attitude_message(n, n / 8, -n / 8, 0, 0, 0, 1.5)).pack(mav))
+                              for n in range(300)))
+
+    def load(npz) -> dict:
+        arrays = {}
+        with zipfile.ZipFile(npz) as archive:
+            for name in archive.namelist():
+                data = archive.read(name)
+                header_len = struct.unpack_from("<H", data, 8)[0]
+                header = ast.literal_eval(data[10:10 + header_len].decode("latin1"))
+                arrays[name[:-len(".npy")]] = (header["descr"], header["shape"], data[10 + header_len:])
+        return arrays
+
+    assert export(path, str(tmp_path / "single"), msgids=parse_messages(["ATTITUDE,statustext"]), jobs=1) == {"STATUSTEXT": 100, "ATTITUDE": 200}
+    monkeypatch.setattr(analysis, "MIN_CHUNK", 1024)
+    export(path, str(tmp_path / "parallel"), msgids=parse_messages(["ATTITUDE", "STATUSTEXT"]), jobs=3)
+    single, parallel = load(tmp_path / "single.npz"), load(tmp_path / "parallel.npz")
+    assert single == parallel
+    descr, shape, data = single["ATTITUDE.roll"]
+    assert (descr, shape) == ("<f4", (200,))
+    assert struct.unpack("<200f", data)[:3] == (1 / 8, 2 / 8, 4 / 8)
+    assert struct.unpack("<200f", single["ATTITUDE.yawspeed"][2]) == (1.5,) * 200
+    assert struct.unpack("<200d", single["ATTITUDE._timestamp"][2])[0] == pytest.approx(1.001)
+    assert single["ATTITUDE._sysid"][2] == b"\x03" * 200
+    descr, shape, data = single["STATUSTEXT.text"]
+    assert (descr, shape) == ("|S50", (100,)) and data[50:56] == b"text 3"
+
+    export(path, str(tmp_path / "table"), "csv", parse_messages(["STATUSTEXT"]), jobs=1)
+    with open(tmp_path / "table-STATUSTEXT.csv", newline="") as file:
+        rows = list(csv.reader(file))
+    assert rows[0][:4] == ["_timestamp", "_sysid", "_compid", "severity"] and len(rows) == 101
+    assert rows[2][3:5] == ["4", "text 3"]
+
+    path = str(tmp_path / "follow.pcapng")
+    with open(path, "wb") as file:
+        file.write(_recording([(2_000_000, mavlink2.MAVLink_follow_target_message(42, 0, 1, 2, 3.0, [0] * 3, [0] * 3, [1, 0, 0, 0], [0] * 3, [0] * 3, 0).pack(mav))]))
+    export(path, str(tmp_path / "follow"), jobs=1) # FOLLOW_TARGET has a timestamp field of its own
+    follow = load(tmp_path / "follow.npz")
+    assert struct.unpack("<Q", follow["FOLLOW_TARGET.timestamp"][2]) == (42,)
+    assert struct.unpack("<d", follow["FOLLOW_TARGET._timestamp"][2]) == (2.0,)
+    export(path, str(tmp_path / "follow"), "csv", jobs=1)
+    with open(tmp_path / "follow-FOLLOW_TARGET.csv", newline="") as file:
+        header = next(csv.reader(file))
+    assert len(header) == len(set(header))
+    with pytest.raises(ValueError):
+        parse_messages(["NOTHING"])
+
+    path = str(tmp_path / "corrupt.pcapng")
+    frame = bytes(mavlink2.MAVLink_attitude_message(7, 1, 2, 3, 0, 0, 0).pack(mav))
+    with open(path, "wb") as file:
+        file.write(_recording([(3_000_000, frame[:-5]), # truncated
+                               (3_001_000, frame[:12] + b"\xff" + frame[13:]), # corrupt payload
+                               (3_002_000, frame)]))
+    assert export(path, str(tmp_path / "corrupt"), jobs=1) == {"ATTITUDE": 1}
+
+
+def test_merge_slice_and_split_recordings(tmp_path):
+    """Recordings merge by time with an interface per source, slice by time/count and split by sysid"""
+    paths = []
+    for sysid, offset_us in ((1, 0), (2, 50_000)):
+        paths.append(str(tmp_path / f"vehicle{sysid}.pcapng"))
+        with open(paths[-1], "wb") as file: # one packet every 100ms, the second recording shifted by 50ms
+            file.write(_recording(((1_000_000 + offset_us + n * 100_000, bytes((0xfe, 0, n, sysid, 1, 0))) for n in range(10)),
+                                  [{"if_name": f"vehicle{sysid}", "if_txspeed": 57600}]))
+
+    merged = str(tmp_path / "merged.pcapng")
+    assert edit.merge(paths, merged) == 20
+    with open(merged, "rb") as file, PcapngReader(file) as reader:
+        records = list(reader.records())
+        assert [(interface.name, interface.speed) for interface in reader.interfaces] == [("vehicle1", 57600), ("vehicle2", 57600)]
+    assert [interface_id for _, interface_id, _, _ in records] == [0, 1] * 10
+    assert [ts for _, _, ts, _ in records] == sorted(ts for _, _, ts, _ in records)
+    assert bytes(ip.get_mavlink(records[3][3])) == bytes((0xfe, 0, 1, 2, 1, 0))
+
+    sliced = str(tmp_path / "sliced.pcapng")
+    assert edit.slice_recording(merged, sliced, start=0.3, end=0.6, skip=1, count=3) == 3
+    with open(sliced, "rb") as file, PcapngReader(file) as reader:
+        assert [round(ts, 2) for ts, _ in reader] == [1.35, 1.4, 1.45]
+
+    parts = edit.split(merged, str(tmp_path / "merged"), by="sysid")
+    assert sorted(parts) == [1, 2] and parts[2].endswith("merged-sysid2.pcapng")
+    with open(parts[2], "rb") as file, PcapngReader(file) as reader:
+        assert [bytes(ip.get_mavlink(data))[3] for _, data in reader] == [2] * 10
+
+
+def test_replay_fans_out_to_devices_independently():
+    """Every device gets all packets; a slow device does not delay the others"""
+    buffer = io.BytesIO(_recording((1_000_000 + n * 10_000, bytes((0xfe, 0, n, 1, 1, 0))) for n in range(20))) # one packet every 10ms
+
+    fast, slow = _RecordingDevice("fast"), _RecordingDevice("slow", delay=0.03)
+    replay = Replay(device=[fast, slow], file=buffer, spin=0.0)
+    assert replay.run() == 20
+    assert b"".join(fast.writes) == b"".join(slow.writes) and len(b"".join(fast.writes)) == 20 * 6
+    outputs = {output["device"]: output for output in replay.counters()["outputs"]}
+    assert outputs["fast"]["written"] == outputs["slow"]["written"] == 20
+    assert outputs["slow"]["lateness_max"] > 0.2 # 20 writes of 30ms for packets 10ms apart
+    assert outputs["fast"]["lateness_max"] < outputs["slow"]["lateness_max"] / 4
+
+
+def test_replay_at_max_rate_waits_for_slowest_device(monkeypatch, caplog):
+    """Without timing a slow device slows the replay down instead of losing packets; a timed replay drops them with a warning"""
+    monkeypatch.setattr("mavsniff.replay.MAX_BATCH", 1)
+    monkeypatch.setattr("mavsniff.replay.OUTPUT_QUEUE", 2)
+    buffer = io.BytesIO(_recording((1_000_000 + n * 100, bytes((0xfe, 0, n, 1, 1, 0))) for n in range(30)))
+    for speed in (0, 1):
+        buffer.seek(0)
+        fast, slow = _RecordingDevice("fast"), _RecordingDevice("slow", delay=0.002)
+        replay = Replay(device=[fast, slow], file=buffer, speed=speed, spin=0.0)
+        with caplog.at_level("WARNING", logger="mavsniff"):
+            assert replay.run() == 30
+        dropped = {output["device"]: output["dropped_batches"] for output in replay.counters()["outputs"]}
+        if speed:
+            assert dropped["slow"] > 0 and "slow: dropped" in caplog.text
+        else:
+            assert dropped == {"fast": 0, "slow": 0} and len(slow.writes) == 30 and not caplog.text
+
+
+def test_replay_profiles_stages(tmp_path):
+    """Every stage of the replay is timed and cProfile runs within the window only"""
+    buffer = io.BytesIO(_recording((1_000_000 + n * 1000, bytes((0xfe, 0, n, 1, 1, 0, 0, 0))) for n in range(50)))
+
+    profiler = Profiler("cprofile", window=60)
+    assert Replay(device=_RecordingDevice(), file=buffer, speed=0, profiler=profiler).run() == 50
+    assert profiler.stages["read"].count == profiler.stages["parse"].count == 50
+    assert profiler.stages["write"].count == profiler.stages["sleep"].count >= 1
+    assert profiler.active == 0 and profiler.deadline is None
+    profiler.save(str(tmp_path / "profile.txt"))
+    report = (tmp_path / "profile.txt").read_text()
+    assert "parse" in report and "cProfile" in report and "decap.py" in report
+    assert (tmp_path / "profile.txt.prof").exists()
+    with pytest.raises(ValueError):
+        Profiler("perf")
+
+
+def test_proxy_forwards_both_ways_and_captures_directions(tmp_path):
+    """Proxy forwards bytes between vehicle and ground station and captures each direction as an interface"""
+    path = str(tmp_path / "session.pcapng")
+    upstream, downstream = mavlink("udp://localhost:3741", input=True), mavlink("udp://localhost:3742", input=True)
+    vehicle, gcs = mavlink("udp://localhost:3741", input=False), mavlink("udp://localhost:3742", input=False)
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    heartbeat = bytes(mavlink2.MAVLink_heartbeat_message(2, 3, 0, 0, 4, 3).pack(mav))
+    request = bytes(mavlink2.MAVLink_mission_request_list_message(1, 1, 0).pack(mav))
+    with open(path, "wb") as file:
+        proxy = Proxy(upstream, downstream, file)
+        t = threading.Thread(target=proxy.run)
+        t.start(); time.sleep(0.01)
+        try:
+            for device, data in ((vehicle, heartbeat), (gcs, request), (vehicle, heartbeat)):
+                device.write(data) # UDP peers are known once they send something - the first heartbeat goes nowhere
+                time.sleep(0.05)
+            assert vehicle.recv(1024) == request
+            assert gcs.recv(1024) == heartbeat
+        finally:
+            proxy.stop()
+            t.join()
+            for device in (upstream, downstream, vehicle, gcs):
+                device.close()
+
+    counters = proxy.counters()
+    assert counters["forwarded_from_upstream"] == len(heartbeat) and counters["forwarded_from_downstream"] == len(request)
+    assert counters["undelivered_from_upstream"] == len(heartbeat) and counters["undelivered_from_downstream"] == 0
+    assert 0 < counters["forward_latency_max_from_upstream"] < 0.05
+    with open(path, "rb") as file, PcapngReader(file) as reader:
+        packets = [(interface_id, bytes(ip.get_mavlink(data))) for _, interface_id, _, data in reader.records()]
+        assert [interface.name for interface in reader.interfaces] == ["upstream -> downstream", "downstream -> upstream"]
+    assert packets == [(0, heartbeat), (1, request), (0, heartbeat)]
+
+
+def test_replay_decapsulates_wireshark_captures():
+    """Classic pcap with Ethernet, IPv4/UDP datagrams of several frames and an IPv6/TCP stream replays frame by frame"""
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    frames = [bytes(mavlink2.MAVLink_heartbeat_message(2, 3, 0, 0, 4, 3).pack(mav)) for _ in range(5)]
+    ethernet = lambda ethertype: bytes(12) + struct.pack(">H", ethertype)
+    def ipv4_udp(payload):
+        header = struct.pack(">BBHHHBBH4s4s", 0x45, 0, 28 + len(payload), 0, 0, 64, 17, 0, bytes(4), bytes(4))
+        return ethernet(0x0800) + header + struct.pack(">HHHH", 14550, 14550, 8 + len(payload), 0) + payload + bytes(6) # padding
+    def ipv6_tcp(seq, payload, flags=0x18):
+        tcp = struct.pack(">HHIIBBHHH", 5760, 40000, seq, 0, 5 << 4, flags, 0, 0, 0)
+        return ethernet(0x86DD) + struct.pack(">IHBB16s16s", 6 << 28, len(tcp) + len(payload), 6, 64, bytes(16), bytes(16)) + tcp + payload
+    packets = [
+        ipv4_udp(frames[0] + frames[1]), # two frames in one datagram
+        ethernet(0x0806) + bytes(28), # ARP
+        ipv6_tcp(99, b"", flags=0x02), # SYN
+        ipv6_tcp(100, frames[2] + frames[3][:5]), # a frame split across segments
+        ipv6_tcp(100 + len(frames[2]), frames[3]), # retransmission of the split frame's start
+        ipv6_tcp(100 + len(frames[2]) + len(frames[3]), frames[4]),
+    ]
+    buffer = io.BytesIO()
+    buffer.write(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+    for n, packet in enumerate(packets):
+        buffer.write(struct.pack("<IIII", 1_700_000_000, n * 1000, len(packet), len(packet)) + packet)
+    buffer.seek(0)
+
+    device = _RecordingDevice()
+    replay = Replay(device=device, file=buffer, speed=0)
+    assert replay.run() == 5
+    assert b"".join(device.writes) == b"".join(frames)
+    assert replay.non_data == 2 # ARP and SYN
+
+
+def test_commands_are_imported_lazily():
+    """Listing serial ports does not pay for pymavlink, pcapng or other commands"""
+    code = ("import sys; from mavsniff.__main__ import main; main(['ports'], standalone_mode=False); "
+            "print(sorted(m for m in sys.modules if m.startswith(('pymavlink', 'pcapng', 'mavsniff.commands.'))))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.splitlines()[-1] == "['mavsniff.commands.ports']"
+
+
+def test_wsplugin_reuses_cached_dissector(tmp_path, monkeypatch):
+    """A dissector is generated once per definitions and an unchanged plugin is not rewritten"""
+    from mavsniff.commands import wsplugin
+    monkeypatch.setattr(wsplugin, "CACHE_DIR", str(tmp_path / "cache"))
+    args = ["--wireshark-plugin-dir", str(tmp_path / "plugins"), "--version", "2.0", "minimal"]
+    wsplugin.wsplugin(args, standalone_mode=False)
+    plugin = tmp_path / "plugins" / "mavlink_disector.lua"
+    assert b"mavlink_proto" in plugin.read_bytes()
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+    def generate(*args):
+        raise AssertionError("generated again")
+    monkeypatch.setattr(wsplugin.mavgen, "mavgen", generate)
+    modified = plugin.stat().st_mtime_ns
+    assert wsplugin.wsplugin(args + ["--override"], standalone_mode=False) == 0
+    assert plugin.stat().st_mtime_ns == modified
+    plugin.unlink()
+    wsplugin.wsplugin(args, standalone_mode=False)
+    assert plugin.exists()